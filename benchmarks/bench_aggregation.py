@@ -0,0 +1,121 @@
+"""
+Times calculating AggregatedStats from every game at once against adding the games to an AggregatedStatsAccumulator
+(like each month of a window is) one game at a time, and all at once with the NumPy group-by reductions of addGames (like
+iterMonthlyAccumulators does), checking that all of them calculate the same stats & that both ways of adding the games
+give the same accumulator.
+
+Usage: python -m benchmarks.bench_aggregation [num games...]
+"""
+import math
+import random
+import sys
+import time
+
+import tf2stats
+from consts import GameResult, Team, ClassType
+
+SIXES_LINEUP = [ClassType.SCOUT, ClassType.SCOUT, ClassType.SOLDIER, ClassType.SOLDIER, ClassType.DEMOMAN, ClassType.MEDIC]
+
+def createSyntheticGameStats(num_games, num_players=80, seed=0):
+  rng = random.Random(seed)
+  steam_ids = ['[U:1:%d]' % (100000 + i) for i in range(num_players)]
+
+  all_game_stats = []
+  for i in range(num_games):
+    duration = rng.randint(600, 1800)
+    winning_team = rng.choice([Team.RED, Team.BLUE, None])
+    player_stat_values = {}
+    for j, steam_id in enumerate(rng.sample(steam_ids, 12)):
+      team = Team.RED if j < 6 else Team.BLUE
+      class_type = SIXES_LINEUP[j % 6]
+      damage = 0 if class_type == ClassType.MEDIC else rng.randint(0, 12000)
+      heals = rng.randint(0, 35000) if class_type == ClassType.MEDIC else 0
+      heals_received = rng.randint(0, 6000)
+      player_stat_values[steam_id] = {
+        'damage': damage, 'heals': heals, 'kills': rng.randint(0, 40), 'assists': rng.randint(0, 15), 'deaths': rng.randint(0, 25),
+        'airshots': rng.randint(0, 6), 'captures': rng.randint(0, 5), 'heals_received': heals_received,
+        'team': team, 'class_type': class_type,
+        'total_playtime_in_seconds': duration if rng.random() > 0.1 else rng.randint(0, duration),
+        'game_result': GameResult.TIE if winning_team == None else (GameResult.WIN if winning_team == team else GameResult.LOSS),
+        'average_dpm': damage / (duration / 60.0), 'average_hpm': heals / (duration / 60.0), 'average_hrpm': heals_received / (duration / 60.0),
+      }
+    all_game_stats.append(tf2stats.SingleGameStats.fromStatValues(i, { 'duration': duration, 'winning_team': winning_team }, player_stat_values))
+
+  return all_game_stats, steam_ids
+
+def isClose(a, b):
+  if a == None or b == None:
+    return a == b
+  return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9) # the accumulators add up the values in a different order
+
+def checkSameAggregatedStats(expected, actual):
+  assert [stat.name for stat in expected.stats] == [stat.name for stat in actual.stats]
+  for expected_stat, actual_stat in zip(expected.stats, actual.stats):
+    expected_winners = [(steam_id, value.log_id, value.value) for steam_id, value in expected_stat.winners]
+    actual_winners = [(steam_id, value.log_id, value.value) for steam_id, value in actual_stat.winners]
+    assert expected_winners == actual_winners and expected_stat.num_winners == actual_stat.num_winners, f"{expected_stat.name} winners differ"
+
+  assert [leaderboard.name for leaderboard in expected.leaderboards] == [leaderboard.name for leaderboard in actual.leaderboards]
+  for expected_leaderboard, actual_leaderboard in zip(expected.leaderboards, actual.leaderboards):
+    expected_entries = [(steam_id, value.log_id, value.value) for steam_id, value in expected_leaderboard.entries]
+    actual_entries = [(steam_id, value.log_id, value.value) for steam_id, value in actual_leaderboard.entries]
+    assert expected_entries == actual_entries, f"{expected_leaderboard.name} entries differ"
+
+  assert expected.player_stats.keys() == actual.player_stats.keys()
+  for steam_id, expected_player in expected.player_stats.items():
+    actual_player = actual.player_stats[steam_id]
+    assert expected_player.game_result_counts == actual_player.game_result_counts, f"{steam_id} game results differ"
+    for attr in ['average_dpm', 'average_hpm', 'average_heals_received_per_minute', 'win_rate']:
+      assert isClose(getattr(expected_player, attr), getattr(actual_player, attr)), f"{steam_id} {attr} differs"
+    for class_type, dpm in expected_player.per_class_dpm.items():
+      assert isClose(dpm, actual_player.per_class_dpm[class_type]), f"{steam_id} {class_type} dpm differs"
+
+def checkSameAccumulators(expected, actual):
+  expected_json, actual_json = expected.toJson(), actual.toJson()
+  # the leaderboards keep the same entries, but their heaps can be in a different order
+  for accumulator_json in [expected_json, actual_json]:
+    accumulator_json['leaderboards'] = [sorted(map(tuple, leaderboard_json)) for leaderboard_json in accumulator_json['leaderboards']]
+  assert expected_json == actual_json, "accumulators differ"
+
+def accumulateGames(all_game_stats, tracked_steam_ids, all_log_tags=None):
+  accumulator = tf2stats.AggregatedStatsAccumulator(tracked_steam_ids)
+  for game_stats in all_game_stats:
+    accumulator.add(game_stats, all_log_tags[game_stats.log_id] if all_log_tags != None else None)
+  return accumulator
+
+def accumulateVectorizedGames(all_game_stats, tracked_steam_ids, all_log_tags=None):
+  accumulator = tf2stats.AggregatedStatsAccumulator(tracked_steam_ids)
+  tf2stats.addGames(accumulator, all_game_stats, all_log_tags)
+  return accumulator
+
+def aggregateWithAccumulator(all_game_stats, tracked_steam_ids):
+  return tf2stats.AggregatedStats.fromAccumulator(accumulateGames(all_game_stats, tracked_steam_ids))
+
+def timeAggregation(aggregate, all_game_stats, tracked_steam_ids):
+  start = time.perf_counter()
+  aggregated_stats = aggregate(all_game_stats, tracked_steam_ids)
+  return aggregated_stats, time.perf_counter() - start
+
+if __name__ == '__main__':
+  game_counts = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+  for num_games in game_counts:
+    all_game_stats, steam_ids = createSyntheticGameStats(num_games)
+    tracked_steam_ids = steam_ids[:60]
+
+    expected, batch_time = timeAggregation(tf2stats.AggregatedStats, all_game_stats, tracked_steam_ids)
+    actual, accumulator_time = timeAggregation(aggregateWithAccumulator, all_game_stats, tracked_steam_ids)
+    checkSameAggregatedStats(expected, actual)
+    actual, vectorized_time = timeAggregation(tf2stats.VectorizedAggregatedStats, all_game_stats, tracked_steam_ids)
+    checkSameAggregatedStats(expected, actual)
+
+    # with & without LogTags deciding which games count, and added on to an accumulator that already has games (like a
+    # month that gets new logs)
+    all_log_tags = { game_stats.log_id: tf2stats.classifyLog(game_stats, tf2stats.LogTagsConfig(set(), set())) for game_stats in all_game_stats }
+    for log_tags in [None, all_log_tags]:
+      expected_accumulator = accumulateGames(all_game_stats, tracked_steam_ids, log_tags)
+      actual_accumulator = accumulateVectorizedGames(all_game_stats[:num_games // 2], tracked_steam_ids, log_tags)
+      tf2stats.addGames(actual_accumulator, all_game_stats[num_games // 2:], log_tags)
+      checkSameAccumulators(expected_accumulator, actual_accumulator)
+
+    print(f"{num_games:7d} games: batch {batch_time:.2f}s, accumulator {accumulator_time:.2f}s ({batch_time / accumulator_time:.1f}x), "
+      f"vectorized accumulator {vectorized_time:.2f}s ({batch_time / vectorized_time:.1f}x), same results")
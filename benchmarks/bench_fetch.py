@@ -0,0 +1,76 @@
+"""
+Fetches logs from a local stub logs.tf server into a temporary cache, reporting throughput & how the fetcher reacted to
+rate limiting and failures, checks that a log that's been deleted (404) is skipped without losing the others, then counts
+the requests needed to sync an uploader's log metadata in full & incrementally, and checks that an incremental sync
+updates a recent log that was re-uploaded.
+
+Usage: python -m benchmarks.bench_fetch [num logs] [server requests per second]
+"""
+import sys
+import tempfile
+import time
+
+import logcache
+import logstf
+from logmetadata import LogMetadataStore
+from logsfetcher import AsyncLogsFetcher
+
+from .stub_logstf_server import StubLogsTfServer, createStubLogMetadata
+
+if __name__ == '__main__':
+  num_logs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+  requests_per_second = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+  server = StubLogsTfServer(requests_per_second=requests_per_second).startInBackground()
+  with tempfile.TemporaryDirectory() as cache_dir:
+    logs_cache = logcache.SegmentLogCache(cache_dir)
+    fetcher = AsyncLogsFetcher(logs_cache, api_url=server.api_url, initial_delay=0.05)
+
+    start = time.perf_counter()
+    fetched_logs = fetcher.fetchLogs(list(range(1, num_logs + 1)))
+    elapsed = time.perf_counter() - start
+
+    assert len(fetched_logs) == num_logs
+    assert all(logs_cache.contains(log_id) for log_id in fetched_logs)
+    logs_cache.close()
+
+  print(f"Fetched {num_logs} logs in {elapsed:.2f}s ({num_logs / elapsed:.1f} logs/s, server limit {requests_per_second}/s)")
+  print(f"Client: {fetcher.num_requests} requests, {fetcher.num_retries} retries, {fetcher.num_rate_limited} rate limited")
+  print(f"Server: {server.num_requests} requests, {server.num_rate_limited} rate limited, {server.num_failures} failures, {server.num_connections} connections")
+
+  # fetch the same logs again with one of them deleted
+  missing_log_id = num_logs // 2
+  server.missing_log_ids = { missing_log_id }
+  with tempfile.TemporaryDirectory() as cache_dir:
+    logs_cache = logcache.SegmentLogCache(cache_dir)
+    fetcher = AsyncLogsFetcher(logs_cache, api_url=server.api_url, initial_delay=0.05)
+    fetched_logs = fetcher.fetchLogs(list(range(1, num_logs + 1)))
+
+    assert sorted(fetched_logs) == [log_id for log_id in range(1, num_logs + 1) if log_id != missing_log_id]
+    assert all(logs_cache.contains(log_id) for log_id in fetched_logs) and not logs_cache.contains(missing_log_id)
+    assert fetcher.num_failed_logs == 1
+    logs_cache.close()
+  server.missing_log_ids = set()
+  print(f"Fetched {len(fetched_logs)} logs with log {missing_log_id} deleted, skipping only that one")
+
+  # sync the metadata of an uploader with a long history, then again after a day's worth of new logs
+  server.uploader_log_ids = list(range(num_logs * 50, 0, -1))
+  with tempfile.TemporaryDirectory() as cache_dir:
+    logs_client = logstf.LogsClient(logcache.SegmentLogCache(cache_dir), logs_fetcher=AsyncLogsFetcher(None, api_url=server.api_url, initial_delay=0.05))
+    for sync_name, num_new_logs in [('first sync', 0), ('incremental sync', 0), ('incremental sync', 12)]:
+      server.uploader_log_ids = list(range(len(server.uploader_log_ids) + num_new_logs, 0, -1))
+      num_requests = logs_client.logs_fetcher.num_requests
+      log_metadata = logs_client.getUploaderLogMetadata('uploader')
+      assert [log['id'] for log in log_metadata['logs']] == server.uploader_log_ids
+      print(f"Metadata {sync_name} with {num_new_logs} new logs: {logs_client.logs_fetcher.num_requests - num_requests} requests ({len(log_metadata['logs'])} logs)")
+
+    # re-upload a recent log that's already known, which an incremental sync should pick up
+    reuploaded_log_id = server.uploader_log_ids[20]
+    reuploaded_date = createStubLogMetadata(server.uploader_log_ids[0])['date'] + 1
+    server.log_metadata_factory = lambda log_id: dict(createStubLogMetadata(log_id), date=reuploaded_date) if log_id == reuploaded_log_id else createStubLogMetadata(log_id)
+    log_metadata = logs_client.getUploaderLogMetadata('uploader')
+    assert next(log for log in log_metadata['logs'] if log['id'] == reuploaded_log_id)['date'] == reuploaded_date
+    server.log_metadata_factory = createStubLogMetadata
+    print(f"Metadata incremental sync picked up the re-upload of log {reuploaded_log_id}")
+    logs_client.close()
+  server.shutdown()
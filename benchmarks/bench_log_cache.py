@@ -0,0 +1,78 @@
+"""
+Compares the load time & disk usage of the one-file-per-log cache layout against the segment cache, and checks that
+migrating the old layout at startup (like main.py does) only reads its files the first time.
+
+Usage: python -m benchmarks.bench_log_cache [logs dir]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import logcache
+
+def getDirectorySize(directory):
+  return sum(os.path.getsize(os.path.join(directory, filename)) for filename in os.listdir(directory))
+
+def timeLoadingAllLogs(cache, log_ids):
+  start = time.perf_counter()
+  for log_id in log_ids:
+    cache.load(log_id)
+  return time.perf_counter() - start
+
+def timeLoadingSingleLog(cache, log_id, repetitions=100):
+  start = time.perf_counter()
+  for _ in range(repetitions):
+    cache.load(log_id)
+  return (time.perf_counter() - start) / repetitions
+
+def timeStartupMigrations(directory_cache, log_ids):
+  """
+  Returns how long the first & second startups take to migrate a copy of the json files in {directory_cache} into a
+  segment cache in the same directory. Raises if the second startup still finds any json files to read
+  """
+  with tempfile.TemporaryDirectory() as cache_dir:
+    for log_id in log_ids:
+      shutil.copy(directory_cache.getLogFilepath(log_id), cache_dir)
+
+    startup_times = []
+    for _ in range(2):
+      start = time.perf_counter()
+      segment_cache = logcache.SegmentLogCache(cache_dir)
+      logcache.migrateLegacyLogCache(cache_dir, segment_cache)
+      segment_cache.close()
+      startup_times.append(time.perf_counter() - start)
+
+      assert logcache.DirectoryLogCache.listLogFileIdsInDir(cache_dir) == [], "the migrated json files were left behind"
+      assert not os.path.exists(os.path.join(cache_dir, logcache.DirectoryLogCache.MANIFEST_FILENAME)), "the migrated manifest was left behind"
+    assert len(logcache.SegmentLogCache(cache_dir).logIds()) == len(log_ids), "logs were lost by the migration"
+    return startup_times
+
+if __name__ == '__main__':
+  logs_dir = sys.argv[1] if len(sys.argv) > 1 else '.logs'
+  directory_cache = logcache.DirectoryLogCache(logs_dir)
+  log_ids = sorted(directory_cache.logIds())
+  if len(log_ids) == 0:
+    sys.exit(f"No {{log id}}.json files found in '{logs_dir}'")
+
+  with tempfile.TemporaryDirectory() as segment_dir:
+    segment_cache = logcache.SegmentLogCache(segment_dir)
+    logcache.migrateLogCache(directory_cache, segment_cache)
+
+    directory_size = sum(os.path.getsize(directory_cache.getLogFilepath(log_id)) for log_id in log_ids)
+    segment_size = getDirectorySize(segment_dir)
+    print(f"{len(log_ids)} logs")
+    print(f"Disk usage:      directory {directory_size / 1e6:.1f} MB, segment {segment_size / 1e6:.1f} MB ({segment_size / directory_size:.1%})")
+
+    directory_time = timeLoadingAllLogs(directory_cache, log_ids)
+    segment_time = timeLoadingAllLogs(segment_cache, log_ids)
+    print(f"Load all logs:   directory {directory_time:.2f}s, segment {segment_time:.2f}s")
+
+    middle_log_id = log_ids[len(log_ids) // 2]
+    print(f"Load one log:    directory {timeLoadingSingleLog(directory_cache, middle_log_id) * 1e3:.2f}ms, segment {timeLoadingSingleLog(segment_cache, middle_log_id) * 1e3:.2f}ms")
+
+    segment_cache.close()
+
+  first_startup_time, second_startup_time = timeStartupMigrations(directory_cache, log_ids)
+  print(f"Startup:         migrating {first_startup_time:.2f}s, after migrating {second_startup_time * 1e3:.2f}ms (no json files read)")
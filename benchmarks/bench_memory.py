@@ -0,0 +1,85 @@
+"""
+Measures how many bytes the parsed stats take per player per game, comparing the current representation (one tuple of
+raw values per game & player) against the dict of StatValue objects per game & player that it replaced. Uses a synthetic
+corpus of {num logs} logs, or the logs cached in {logs dir} if one is given.
+
+Usage: python -m benchmarks.bench_memory [num logs] [--logs-dir logs dir]
+"""
+import argparse
+import gc
+import sys
+import tracemalloc
+
+import tf2stats
+
+from .bench_parse_scaling import openLogsCache
+from .synthetic_logs import iterSyntheticLogs
+
+class DictStatValue:
+  """
+  A StatValue without __slots__, like before the stats were stored as tuples
+  """
+  def __init__(self, stat_def, log_id, value):
+    self.stat_def = stat_def
+    self.value = value
+    self.log_id = log_id
+
+class DictSingleGameStats:
+  """
+  A game's stats as a dict of StatValues, with each of its players' stats holding a copy of the game's dict (with
+  "game_" prefixed names) alongside their own StatValues, like before the stats were stored as tuples
+  """
+  def __init__(self, log_id, game_stat_values, player_stat_values):
+    self.log_id = log_id
+    self.stats = { stat_def.name: DictStatValue(stat_def, log_id, game_stat_values[stat_def.name]) for stat_def in tf2stats.GAME_STAT_EXTRACTOR.output_defs }
+    self.player_stats = [DictPlayerSingleGameStats(log_id, self, steam_id, values) for steam_id, values in player_stat_values.items()]
+
+class DictPlayerSingleGameStats:
+  def __init__(self, log_id, game_stats, player_steam_id, player_stat_values):
+    self.log_id = log_id
+    self.steam_id = player_steam_id
+    self.game_stats = game_stats
+    self.stats = { "game_" + k: v for k, v in game_stats.stats.items() }
+    for stat_def in tf2stats.PLAYER_STAT_EXTRACTOR.output_defs:
+      self.stats[stat_def.name] = DictStatValue(stat_def, log_id, player_stat_values[stat_def.name])
+
+def loadLogs(num_logs, logs_dir):
+  if logs_dir == None:
+    return dict(iterSyntheticLogs(num_logs))
+
+  logs_cache = openLogsCache(logs_dir)
+  logs = { log_id: logs_cache.load(log_id) for log_id in sorted(logs_cache.logIds()) }
+  logs_cache.close()
+  return logs
+
+def measureAllocatedBytes(create_game_stats, all_stat_values):
+  """
+  Returns the bytes still allocated after creating the stats of every game from its raw {all_stat_values}
+  """
+  gc.collect()
+  tracemalloc.start()
+  all_game_stats = [create_game_stats(log_id, game_stat_values, player_stat_values) for log_id, (game_stat_values, player_stat_values) in all_stat_values.items()]
+  gc.collect()
+  allocated_bytes = tracemalloc.get_traced_memory()[0]
+  tracemalloc.stop()
+  del all_game_stats
+  return allocated_bytes
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Measures how many bytes the parsed stats take per player per game')
+  parser.add_argument('num_logs', type=int, nargs='?', default=300, help='the size of the synthetic corpus')
+  parser.add_argument('--logs-dir', help='measure the logs in this logs cache instead of a synthetic corpus')
+  args = parser.parse_args()
+
+  logs = loadLogs(args.num_logs, args.logs_dir)
+  if len(logs) == 0:
+    sys.exit(f"No cached logs found in '{args.logs_dir}'")
+  # both representations are created from the same raw values, so only the containers around them are compared
+  all_stat_values = { log_id: tf2stats.SingleGameStats(log_id, log).getStatValues() for log_id, log in logs.items() }
+  del logs
+
+  num_player_games = sum(len(player_stat_values) for game_stat_values, player_stat_values in all_stat_values.values())
+  print(f"{len(all_stat_values)} games, {num_player_games} player-games")
+  for name, create_game_stats in [('dicts', DictSingleGameStats), ('tuples', tf2stats.SingleGameStats.fromStatValues)]:
+    allocated_bytes = measureAllocatedBytes(create_game_stats, all_stat_values)
+    print(f"{name:>6}: {allocated_bytes / 1e6:.2f} MB, {allocated_bytes / num_player_games:.0f} bytes per player-game")
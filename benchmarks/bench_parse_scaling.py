@@ -0,0 +1,39 @@
+"""
+Times parsing every cached log into stat records with 1 to N worker processes.
+
+Usage: python -m benchmarks.bench_parse_scaling [logs dir] [max workers]
+"""
+import os
+import sys
+import time
+
+import logcache
+import tf2stats
+
+def openLogsCache(logs_dir):
+  if os.path.isfile(os.path.join(logs_dir, logcache.SegmentLogCache.SEGMENT_FILENAME)):
+    return logcache.SegmentLogCache(logs_dir)
+  return logcache.DirectoryLogCache(logs_dir)
+
+if __name__ == '__main__':
+  logs_dir = sys.argv[1] if len(sys.argv) > 1 else '.logs'
+  max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+
+  logs_cache = openLogsCache(logs_dir)
+  raw_logs = [(log_id, logs_cache.loadRaw(log_id)) for log_id in sorted(logs_cache.logIds())]
+  logs_cache.close()
+  if len(raw_logs) == 0:
+    sys.exit(f"No cached logs found in '{logs_dir}'")
+
+  num_workers_to_test = sorted(set([1] + [2 ** i for i in range(1, max_workers.bit_length())] + [max_workers]))
+  serial_records, serial_time = None, None
+  for num_workers in num_workers_to_test:
+    start = time.perf_counter()
+    records = list(tf2stats.extractStatRecords(raw_logs, num_workers))
+    elapsed = time.perf_counter() - start
+
+    if serial_records == None:
+      serial_records, serial_time = records, elapsed
+    assert records == serial_records, f"{num_workers} workers produced different records than parsing serially"
+
+    print(f"{num_workers:3d} workers: {elapsed:.2f}s ({len(raw_logs) / elapsed:.0f} logs/s, {serial_time / elapsed:.1f}x)")
@@ -0,0 +1,156 @@
+"""
+Times each stage of a run separately against a synthetic corpus of logs (see synthetic_logs) & an in-memory fake of the
+Sheets API, and writes the timings as JSON so they can be compared between commits.
+
+Usage: python -m benchmarks.bench_pipeline [num logs...] [--seed N] [--output results.json]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import tempfile
+import time
+
+import googledocs
+import logcache
+import logstf
+import main
+import tf2stats
+
+from .fake_sheets import FakeSpreadsheet
+from .synthetic_logs import SCRIM_TEAM_STEAM_IDS, createSyntheticAliasLookup, createSyntheticLogMetadata, iterSyntheticLogs
+
+class StageTimer:
+  """
+  Adds up the time spent in each stage, which can be entered many times (e.g. once per log)
+  """
+  END = object() # what timeIter gets from next once the iterator is exhausted
+
+  def __init__(self):
+    self.stage_times = {}
+
+  def time(self, stage, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    self.stage_times[stage] = self.stage_times.get(stage, 0) + time.perf_counter() - start
+    return result
+
+  def timeIter(self, stage, iterable):
+    """
+    Yields each item of {iterable}, adding the time spent getting it to {stage}
+    """
+    iterator = iter(iterable)
+    while True:
+      item = self.time(stage, next, iterator, StageTimer.END)
+      if item is StageTimer.END:
+        return
+      yield item
+
+def createWindows(log_metadata):
+  first_year, first_month = logstf.getMonthOfDate(min(log[u'date'] for log in log_metadata[u'logs']))
+  last_year, last_month = logstf.getMonthOfDate(max(log[u'date'] for log in log_metadata[u'logs']))
+  windows = [main.StatsWindow('All-Time', logstf.TimeBounds(logstf.TimeBounds.forMonth(first_year, first_month).start, logstf.TimeBounds.forMonth(last_year, last_month).end))]
+  for year in range(first_year, last_year + 1):
+    for month in range(1, 13):
+      if (first_year, first_month) <= (year, month) <= (last_year, last_month):
+        windows.append(main.StatsWindow(datetime.date(year, month, 1).strftime('%B') + ' ' + str(year), logstf.TimeBounds.forMonth(year, month)))
+  last_log_date = max(log[u'date'] for log in log_metadata[u'logs'])
+  return windows + main.createWeeklyWindows(4, last_log_date) + main.createRollingWindows([30], last_log_date)
+
+def benchmarkPipeline(num_logs, seed):
+  timer = StageTimer()
+  alias_lookup = createSyntheticAliasLookup()
+
+  log_metadata = timer.time('generate_metadata', createSyntheticLogMetadata, num_logs, seed)
+  windows = createWindows(log_metadata)
+  log_index = timer.time('metadata_filtering', logstf.LogMetadataIndex, log_metadata[u'logs'])
+  log_dates = { log[u'id']: log[u'date'] for log in log_metadata[u'logs'] }
+
+  with tempfile.TemporaryDirectory() as temp_dir:
+    # cache the logs projected to just the fields the stats need, like the fetcher does
+    cache_dir = os.path.join(temp_dir, 'logs')
+    logs_cache = logcache.SegmentLogCache(cache_dir)
+    projection_id = logcache.getProjectionId(tf2stats.LOG_PROJECTION)
+    log_ids = []
+    generated_logs = iterSyntheticLogs(num_logs, seed)
+    while True:
+      generated_log = timer.time('generate_logs', next, generated_logs, None)
+      if generated_log == None:
+        break
+      log_id, log = generated_log
+      projected_log = timer.time('project_logs', tf2stats.projectJson, log, tf2stats.LOG_PROJECTION)
+      timer.time('cache_save', logs_cache.save, log_id, projected_log, projection_id)
+      log_ids.append(log_id)
+    timer.time('cache_save', logs_cache.flush)
+    logs_cache.close()
+
+    # parse & tag each log into the stats store, like ingestLogs
+    stats_store = tf2stats.StatsStore(os.path.join(temp_dir, 'stats.sqlite'))
+    logs_cache = timer.time('cache_load', logcache.SegmentLogCache, cache_dir)
+    tags_config = tf2stats.LogTagsConfig(SCRIM_TEAM_STEAM_IDS, [])
+    all_log_tags = {}
+    num_games, num_player_games = 0, 0
+    for log_id in log_ids:
+      log = timer.time('cache_load', logs_cache.load, log_id)
+      game_stats = timer.time('game_stats', tf2stats.SingleGameStats, log_id, log)
+      all_log_tags[log_id] = timer.time('log_tagging', tf2stats.classifyLog, game_stats, tags_config)
+      timer.time('stats_store_save', stats_store.saveGameStats, game_stats, log_dates[log_id])
+      if all_log_tags[log_id].isCounted():
+        num_games += 1
+        num_player_games += len(game_stats.player_stats)
+    timer.time('stats_store_save', stats_store.saveLogTags, all_log_tags.values())
+    timer.time('stats_store_save', stats_store.commit)
+    logs_cache.close()
+
+    # aggregate like WindowsUpdate.write: bring each month's accumulator up to date, then merge the months into each window.
+    # The months are all built before merging, so that building & merging them are timed separately
+    bucket_log_revisions = main.BucketLogRevisions(log_index, (bucket_key for window in windows for bucket_key in window.bucket_keys), stats_store)
+    bucket_accumulators = list(timer.timeIter('monthly_accumulators', tf2stats.iterMonthlyAccumulators(stats_store, bucket_log_revisions, None, alias_lookup.keys())))
+
+    spreadsheet = FakeSpreadsheet()
+    sheets_planner = googledocs.SheetsBatchPlanner(spreadsheet)
+    num_changed_cells = 0
+    for window, window_accumulator in timer.timeIter('merge_windows', main.mergeWindows(windows, bucket_accumulators, alias_lookup.keys())):
+      stats_summary = timer.time('aggregated_stats', window_accumulator.toAggregatedStats)
+      data, num_player_stat_cols = timer.time('grid_building', main.generateWorksheetData, alias_lookup, stats_summary)
+      num_changed_cells += timer.time('sheet_write_planning', sheets_planner.planWorksheetWrite, window.worksheet_name, data, num_player_stat_cols, main.NUM_CORE_PLAYER_STAT_COLS, main.HPM_QUANTILE_COLS)
+    timer.time('sheet_write', sheets_planner.execute)
+    stats_store.close()
+
+  return {
+    'num_logs': num_logs,
+    'seed': seed,
+    'stage_seconds': { stage: round(seconds, 4) for stage, seconds in timer.stage_times.items() },
+    'counts': {
+      'windows': len(windows),
+      'games': num_games,
+      'player_games': num_player_games,
+      'changed_cells': num_changed_cells,
+      'sheets_api_calls': spreadsheet.call_counts,
+    },
+  }
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Times each stage of a run against a synthetic corpus of logs')
+  parser.add_argument('num_logs', type=int, nargs='*', default=[1000, 10000], help='the corpus sizes to benchmark (e.g. 1000 10000 100000)')
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--output', default='bench_pipeline.json', help='where to write the results')
+  args = parser.parse_args()
+
+  results = {
+    'started_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    'python_version': platform.python_version(),
+    'platform': platform.platform(),
+    'runs': [],
+  }
+  for num_logs in args.num_logs:
+    run = benchmarkPipeline(num_logs, args.seed)
+    results['runs'].append(run)
+    print(f"{num_logs} logs:")
+    for stage, seconds in run['stage_seconds'].items():
+      print(f"  {stage:>22}: {seconds:8.3f}s")
+
+  with open(args.output, 'w') as f:
+    json.dump(results, f, indent=2)
+  print(f"Wrote results to '{args.output}'")
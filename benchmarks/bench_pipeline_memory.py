@@ -0,0 +1,81 @@
+"""
+Checks that the peak memory of a first run (fetching every log of a synthetic corpus from a local stub of logs.tf, then
+parsing, tagging & aggregating them all & writing the worksheets) stays flat as the corpus grows, since logs are fetched
+& parsed a chunk at a time and aggregated a month at a time, instead of being held in memory at once. Exits with an error
+if the peak of the largest corpus is more than {max_growth} above the peak of the smallest.
+
+A little memory does still grow with the number of logs: the logs cache's index & the index of the logs' metadata hold a
+small entry per log, and each player's quantile sketches in the All-Time window grow until they're full (see QuantileSketch).
+Memory is traced with tracemalloc, so only Python allocations are counted & logs are parsed in this process.
+
+Usage: python -m benchmarks.bench_pipeline_memory [num logs...] [--max-growth 0.2]
+"""
+import argparse
+import gc
+import io
+import contextlib
+import tempfile
+import tracemalloc
+
+import googledocs
+import logcache
+import logstf
+import main
+import tf2stats
+from instrumentation import formatBytes
+from logsfetcher import AsyncLogsFetcher
+
+from .fake_sheets import FakeSpreadsheet
+from .stub_logstf_server import StubLogsTfServer
+from .synthetic_logs import DEFAULT_SPAN_DAYS, SCRIM_TEAM_STEAM_IDS, createSyntheticAliasLookup, createSyntheticLog, createSyntheticLogMetadata
+
+LOGS_PER_DAY = 1000 / DEFAULT_SPAN_DAYS
+
+def measurePeakMemory(num_logs, seed=0):
+  """
+  Returns the peak bytes allocated while updating the All-Time window of a fresh run over a corpus of {num_logs} logs,
+  whose history is as long as it takes to play that many logs (so a bigger corpus is a longer history, like a real one)
+  """
+  span_days = round(num_logs / LOGS_PER_DAY)
+  server = StubLogsTfServer(requests_per_second=100000, failure_rate=0, response_delay=0, log_factory=lambda log_id: createSyntheticLog(log_id, num_logs, seed, span_days))
+  server.startInBackground()
+  log_metadata = createSyntheticLogMetadata(num_logs, seed, span_days)
+  alias_lookup = createSyntheticAliasLookup()
+  log_dates = [log[u'date'] for log in log_metadata[u'logs']]
+  windows = [main.StatsWindow('All-Time', logstf.TimeBounds.forMonths(*logstf.getMonthOfDate(min(log_dates)), *logstf.getMonthOfDate(max(log_dates))))]
+
+  with tempfile.TemporaryDirectory() as data_dir:
+    logs_cache = logcache.SegmentLogCache(data_dir + '/logs')
+    logs_client = logstf.LogsClient(logs_cache, tf2stats.LOG_PROJECTION, AsyncLogsFetcher(logs_cache, tf2stats.LOG_PROJECTION, api_url=server.api_url, initial_delay=0))
+    stats_store = tf2stats.StatsStore(data_dir + '/stats.sqlite')
+    sheets_planner = googledocs.SheetsBatchPlanner(FakeSpreadsheet())
+
+    gc.collect()
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+      main.updateStatsForWindows(logs_client, stats_store, log_metadata, SCRIM_TEAM_STEAM_IDS, [], sheets_planner, alias_lookup, windows)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    logs_client.close()
+    stats_store.close()
+  server.shutdown()
+  server.server_close()
+  return peak_bytes
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Checks that a run's peak memory doesn't grow with the number of logs")
+  parser.add_argument('num_logs', type=int, nargs='*', default=[1000, 3000], help='the corpus sizes to compare')
+  parser.add_argument('--max-growth', type=float, default=0.2, help='how much higher (as a fraction) the largest corpus\' peak may be than the smallest\'s')
+  args = parser.parse_args()
+
+  main.PARSE_WORKERS = 1 # tracemalloc can't see into worker processes
+  peaks = {}
+  for num_logs in sorted(args.num_logs):
+    peaks[num_logs] = measurePeakMemory(num_logs)
+    print(f"{num_logs:>7} logs: {formatBytes(peaks[num_logs])} peak")
+
+  growth = peaks[max(peaks)] / peaks[min(peaks)] - 1
+  print(f"Peak memory grew {growth:.1%} from {min(peaks)} to {max(peaks)} logs (at most {args.max_growth:.1%} allowed)")
+  if growth > args.max_growth:
+    raise SystemExit("Peak memory grows with the number of logs")
@@ -0,0 +1,60 @@
+"""
+Counts the Sheets API calls needed to write a run's worksheets, comparing writing each worksheet on its own against planning
+every write in one SheetsBatchPlanner, for a first run, an unchanged rerun & a rerun with a few more games.
+
+Usage: python -m benchmarks.bench_sheets [num worksheets]
+"""
+import sys
+
+import googledocs
+import main
+import tf2stats
+from benchmarks.bench_aggregation import createSyntheticGameStats
+from benchmarks.fake_sheets import FakeSpreadsheet
+
+class SingleWorksheetWriter:
+  """
+  Writes each worksheet as soon as it's planned (with a SheetsBatchPlanner of its own), like a run did before the writes
+  were batched
+  """
+  def __init__(self, spreadsheet):
+    self.spreadsheet = spreadsheet
+
+  def planWorksheetWrite(self, worksheet_name, data, num_player_stat_cols, num_core_player_stat_cols, aux_hpm_col_indices=()):
+    sheets_planner = googledocs.SheetsBatchPlanner(self.spreadsheet)
+    num_changed_cells = sheets_planner.planWorksheetWrite(worksheet_name, data, num_player_stat_cols, num_core_player_stat_cols, aux_hpm_col_indices)
+    sheets_planner.execute()
+    return num_changed_cells
+
+  def execute(self):
+    pass
+
+def writeWorksheets(sheets_planner, all_window_stats, alias_lookup):
+  for worksheet_name, stats_summary in all_window_stats.items():
+    main.updateSpreadsheet(sheets_planner, worksheet_name, alias_lookup, stats_summary)
+  sheets_planner.execute()
+
+def createWindowStats(num_windows, games_per_window, extra_games=0):
+  all_window_stats = {}
+  for i in range(num_windows):
+    all_game_stats, steam_ids = createSyntheticGameStats(games_per_window + extra_games, seed=i)
+    all_window_stats['Window %d' % i] = tf2stats.AggregatedStats(all_game_stats, steam_ids[:40])
+  return all_window_stats, { steam_id: 'player%d' % j for j, steam_id in enumerate(steam_ids[:40]) }
+
+if __name__ == '__main__':
+  num_windows = int(sys.argv[1]) if len(sys.argv) > 1 else 24
+  runs = [('first run', 0), ('unchanged rerun', 0), ('rerun with new games', 3)]
+
+  spreadsheets = { 'per worksheet': FakeSpreadsheet(), 'batched': FakeSpreadsheet() }
+  for run_name, extra_games in runs:
+    all_window_stats, alias_lookup = createWindowStats(num_windows, 200, extra_games)
+    for writer_name, spreadsheet in spreadsheets.items():
+      spreadsheet.call_counts = {}
+      sheets_planner = SingleWorksheetWriter(spreadsheet) if writer_name == 'per worksheet' else googledocs.SheetsBatchPlanner(spreadsheet)
+      writeWorksheets(sheets_planner, all_window_stats, alias_lookup)
+      print(f"{run_name:>22}, {writer_name:>13}: {spreadsheet.getNumCalls():3d} calls {spreadsheet.call_counts}")
+
+  per_worksheet, batched = spreadsheets['per worksheet'].worksheets, spreadsheets['batched'].worksheets
+  assert per_worksheet.keys() == batched.keys()
+  assert all(per_worksheet[title].getValues() == batched[title].getValues() for title in per_worksheet), "worksheet contents differ"
+  print("same worksheet contents")
@@ -0,0 +1,153 @@
+"""
+An in-memory stand-in for a gspread Spreadsheet that implements the parts of the Sheets API that googledocs uses, and counts
+every API call made to it.
+"""
+import re
+
+from googledocs import NUMBER_PATTERN, quoteWorksheetName
+
+def parseEnteredValue(value):
+  # like USER_ENTERED, numbers & percentages are stored as numbers, and an empty string clears the cell
+  if value == '':
+    return None
+  if value.startswith('='):
+    return { 'formulaValue': value }
+  if value.endswith('%') and NUMBER_PATTERN.match(value[:-1]):
+    return { 'numberValue': float(value[:-1]) / 100 }
+  if NUMBER_PATTERN.match(value):
+    return { 'numberValue': float(value) }
+  return { 'stringValue': value }
+
+def parseColumnLetters(letters):
+  col_index = 0
+  for letter in letters:
+    col_index = col_index * 26 + ord(letter) - ord('A') + 1
+  return col_index - 1
+
+class FakeWorksheet:
+  def __init__(self, spreadsheet, sheet_id, title, num_rows, num_cols):
+    self.spreadsheet = spreadsheet
+    self.id = sheet_id
+    self.title = title
+    self.num_rows = num_rows
+    self.num_cols = num_cols
+    self.num_conditional_format_rules = 0
+    self.cells = {} # (row index, col index): entered value json
+
+  def resize(self, num_rows, num_cols):
+    self.num_rows, self.num_cols = num_rows, num_cols
+    self.cells = { (y, x): value for (y, x), value in self.cells.items() if y < num_rows and x < num_cols }
+
+  def getValues(self):
+    """
+    The value of every cell as it would be entered, for comparing contents
+    """
+    values = [['' for x in range(self.num_cols)] for y in range(self.num_rows)]
+    for (y, x), value in self.cells.items():
+      values[y][x] = list(value.values())[0]
+    return values
+
+  def getFormattedValues(self):
+    """
+    The value of every cell as it's displayed, like the API returns by default (whole numbers without a decimal point)
+    """
+    return [[str(int(value)) if isinstance(value, float) and value.is_integer() else str(value) for value in row] for row in self.getValues()]
+
+  def get_all_values(self):
+    self.spreadsheet.countCall('values.get')
+    return self.getFormattedValues()
+
+  def toJson(self):
+    return {
+      'properties': { 'sheetId': self.id, 'title': self.title, 'gridProperties': { 'rowCount': self.num_rows, 'columnCount': self.num_cols } },
+      'conditionalFormats': [{}] * self.num_conditional_format_rules,
+      'data': [{ 'rowData': [
+        { 'values': [{ 'userEnteredValue': self.cells[(y, x)] } if (y, x) in self.cells else {} for x in range(self.num_cols)] }
+        for y in range(self.num_rows)
+      ] }],
+    }
+
+class FakeSpreadsheet:
+  def __init__(self):
+    self.worksheets = {}
+    self.call_counts = {}
+
+  def countCall(self, name):
+    self.call_counts[name] = self.call_counts.get(name, 0) + 1
+
+  def getNumCalls(self):
+    return sum(self.call_counts.values())
+
+  def getWorksheetById(self, sheet_id):
+    return next(worksheet for worksheet in self.worksheets.values() if worksheet.id == sheet_id)
+
+  def getWorksheetByRange(self, a1_range):
+    quoted_title = a1_range.rsplit('!', 1)[0]
+    return next(worksheet for worksheet in self.worksheets.values() if quoteWorksheetName(worksheet.title) == quoted_title)
+
+  def createWorksheet(self, sheet_id, title, num_rows, num_cols):
+    if title in self.worksheets or any(worksheet.id == sheet_id for worksheet in self.worksheets.values()):
+      raise Exception(f"Worksheet '{title}' ({sheet_id}) already exists")
+    self.worksheets[title] = FakeWorksheet(self, sheet_id, title, num_rows, num_cols)
+    return self.worksheets[title]
+
+  # gspread Spreadsheet methods
+  def fetch_sheet_metadata(self, params=None):
+    self.countCall('spreadsheets.get')
+    return { 'sheets': [worksheet.toJson() for worksheet in self.worksheets.values()] }
+
+  def worksheet(self, title):
+    self.countCall('spreadsheets.get')
+    if title not in self.worksheets:
+      raise Exception(f"Worksheet '{title}' not found")
+    return self.worksheets[title]
+
+  def add_worksheet(self, title, rows, cols):
+    self.countCall('spreadsheets.batchUpdate')
+    return self.createWorksheet(max([worksheet.id for worksheet in self.worksheets.values()], default=0) + 1, title, rows, cols)
+
+  def del_worksheet(self, worksheet):
+    self.countCall('spreadsheets.batchUpdate')
+    del self.worksheets[worksheet.title]
+
+  def batch_update(self, body):
+    self.countCall('spreadsheets.batchUpdate')
+    for request in body['requests']:
+      if 'addSheet' in request:
+        properties = request['addSheet']['properties']
+        self.createWorksheet(properties['sheetId'], properties['title'], properties['gridProperties']['rowCount'], properties['gridProperties']['columnCount'])
+      elif 'updateSheetProperties' in request:
+        properties = request['updateSheetProperties']['properties']
+        grid_properties = properties['gridProperties']
+        if 'rowCount' in grid_properties:
+          self.getWorksheetById(properties['sheetId']).resize(grid_properties['rowCount'], grid_properties['columnCount'])
+      elif 'addConditionalFormatRule' in request:
+        self.getWorksheetById(request['addConditionalFormatRule']['rule']['ranges']['sheetId']).num_conditional_format_rules += 1
+      elif 'deleteConditionalFormatRule' in request:
+        self.getWorksheetById(request['deleteConditionalFormatRule']['sheetId']).num_conditional_format_rules -= 1
+      # the other formatting requests don't change anything that's read back
+
+  def values_batch_get(self, ranges, params=None):
+    self.countCall('spreadsheets.values.batchGet')
+    value_ranges = []
+    for a1_range in ranges:
+      worksheet = self.getWorksheetByRange(a1_range + '!A1')
+      value_ranges.append({ 'range': a1_range, 'values': worksheet.getFormattedValues() })
+    return { 'valueRanges': value_ranges }
+
+  def values_batch_update(self, body):
+    self.countCall('spreadsheets.values.batchUpdate')
+    for value_range in body['data']:
+      worksheet = self.getWorksheetByRange(value_range['range'])
+      start_col, start_row = re.match(r'^([A-Z]+)(\d+)', value_range['range'].rsplit('!', 1)[1]).groups()
+      start_row_index, start_col_index = int(start_row) - 1, parseColumnLetters(start_col)
+      for y, row in enumerate(value_range['values']):
+        for x, value in enumerate(row):
+          cell = (start_row_index + y, start_col_index + x)
+          if cell[0] >= worksheet.num_rows or cell[1] >= worksheet.num_cols:
+            raise Exception(f"{value_range['range']} is outside of the grid")
+          entered_value = parseEnteredValue(value)
+          if entered_value == None:
+            worksheet.cells.pop(cell, None)
+          else:
+            worksheet.cells[cell] = entered_value
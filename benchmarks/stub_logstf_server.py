@@ -0,0 +1,134 @@
+"""
+A local stand-in for the logs.tf API that simulates its rate limiting & occasional failures, so the logs fetcher can be
+exercised without hitting the real site.
+
+Usage: python -m benchmarks.stub_logstf_server [port]
+"""
+import gzip
+import http.server
+import json
+import random
+import sys
+import threading
+import time
+import urllib.parse
+
+def createStubLog(log_id):
+  return {
+    'length': 1800,
+    'teams': { 'Red': { 'score': 3 }, 'Blue': { 'score': 2 } },
+    'players': {},
+    'info': { 'date': 1500000000 + log_id },
+    'events': [{ 'type': 'pointcap', 'time': t } for t in range(500)], # padding, so responses are a realistic size
+  }
+
+def createStubLogMetadata(log_id):
+  return { 'id': log_id, 'title': 'Pug %d' % log_id, 'map': 'cp_process_final', 'date': 1500000000 + log_id, 'views': 0, 'players': 12 }
+
+class StubLogsTfServer(http.server.ThreadingHTTPServer):
+  """
+  Serves /api/v1/log/{id} & a single uploader's list of logs ids {uploader_log_ids} at /api/v1/log?uploader=..., answering
+  with 429 & Retry-After once more than {requests_per_second} requests arrive, and failing {failure_rate} of requests with a 503.
+  The logs in {missing_log_ids} are answered with a 404, like logs that have been deleted
+  """
+  daemon_threads = True
+
+  def __init__(self, port=0, requests_per_second=10, failure_rate=0.02, response_delay=0.01, log_factory=createStubLog, uploader_log_ids=[], log_metadata_factory=createStubLogMetadata, missing_log_ids=()):
+    super().__init__(('127.0.0.1', port), StubLogsTfRequestHandler)
+    self.requests_per_second = requests_per_second
+    self.failure_rate = failure_rate
+    self.response_delay = response_delay
+    self.log_factory = log_factory
+    self.uploader_log_ids = sorted(uploader_log_ids, reverse=True) # newest first, like logs.tf
+    self.log_metadata_factory = log_metadata_factory
+    self.missing_log_ids = set(missing_log_ids)
+
+    self.lock = threading.Lock()
+    self.tokens = requests_per_second
+    self.last_refill_time = time.monotonic()
+    self.num_requests = 0
+    self.num_rate_limited = 0
+    self.num_failures = 0
+    self.num_connections = 0
+
+  def takeRateLimitToken(self):
+    # token bucket holding up to 1 second's worth of requests
+    with self.lock:
+      now = time.monotonic()
+      self.tokens = min(self.requests_per_second, self.tokens + (now - self.last_refill_time) * self.requests_per_second)
+      self.last_refill_time = now
+      self.num_requests += 1
+      if self.tokens < 1:
+        self.num_rate_limited += 1
+        return False
+      self.tokens -= 1
+      return True
+
+  def handle_error(self, request, client_address):
+    pass # clients closing their keep-alive connections isn't an error
+
+  @property
+  def api_url(self):
+    return 'http://127.0.0.1:%d/api/v1' % self.server_address[1]
+
+  def startInBackground(self):
+    threading.Thread(target=self.serve_forever, daemon=True).start()
+    return self
+
+class StubLogsTfRequestHandler(http.server.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1' # allow keep-alive connections
+
+  def setup(self):
+    super().setup()
+    with self.server.lock:
+      self.server.num_connections += 1
+
+  def do_GET(self):
+    if not self.server.takeRateLimitToken():
+      self.sendResponse(429, b'{"success": false, "error": "Rate limited"}', { 'Retry-After': '1' })
+      return
+    if random.random() < self.server.failure_rate:
+      with self.server.lock:
+        self.server.num_failures += 1
+      self.sendResponse(503, b'{"success": false}')
+      return
+
+    path_prefix = '/api/v1/log/'
+    url = urllib.parse.urlsplit(self.path)
+    if url.path == '/api/v1/log':
+      query = urllib.parse.parse_qs(url.query)
+      offset, limit = int(query.get('offset', ['0'])[0]), int(query.get('limit', ['1000'])[0])
+      response_json = { 'success': True, 'logs': [self.server.log_metadata_factory(log_id) for log_id in self.server.uploader_log_ids[offset:offset + limit]] }
+    elif url.path.startswith(path_prefix) and url.path[len(path_prefix):].isdigit() and int(url.path[len(path_prefix):]) in self.server.missing_log_ids:
+      self.sendResponse(404, b'{"success": false, "error": "Log not found"}')
+      return
+    elif url.path.startswith(path_prefix) and url.path[len(path_prefix):].isdigit():
+      response_json = self.server.log_factory(int(url.path[len(path_prefix):]))
+    else:
+      self.sendResponse(404, b'{"success": false, "error": "Not found"}')
+      return
+
+    time.sleep(self.server.response_delay)
+    body = json.dumps(response_json).encode('utf-8')
+    headers = {}
+    if 'gzip' in self.headers.get('Accept-Encoding', ''):
+      body = gzip.compress(body)
+      headers['Content-Encoding'] = 'gzip'
+    self.sendResponse(200, body, headers)
+
+  def sendResponse(self, status, body, headers={}):
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    for name, value in headers.items():
+      self.send_header(name, value)
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+if __name__ == '__main__':
+  server = StubLogsTfServer(int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
+  print(f"Serving stub logs.tf API at {server.api_url}")
+  server.serve_forever()
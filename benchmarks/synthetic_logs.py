@@ -0,0 +1,221 @@
+"""
+Generates a corpus of realistic logs.tf logs & the matching uploader metadata, so the whole pipeline can be exercised at any
+scale without hitting logs.tf.
+
+Each log is generated on its own from the corpus seed & its id, so corpora of 100k logs can be streamed rather than held
+in memory. Most logs are 6v6 pugs (12 players, sometimes with subs), with some highlander games (18 players), off-classes,
+players swapping classes mid-game, and scrims played by SCRIM_TEAM_STEAM_IDS.
+
+Usage: python -m benchmarks.synthetic_logs [logs dir] [num logs] [seed]
+"""
+import datetime
+import os
+import random
+import sys
+
+import logcache
+
+FIRST_LOG_ID = 3000000
+START_DATE = int(datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc).timestamp())
+DEFAULT_SPAN_DAYS = 730
+NUM_COMMUNITY_PLAYERS = 150
+
+SIXES_LINEUP = ['scout', 'scout', 'soldier', 'soldier', 'demoman', 'medic']
+HIGHLANDER_LINEUP = ['scout', 'soldier', 'pyro', 'demoman', 'heavyweapons', 'engineer', 'medic', 'sniper', 'spy']
+OFF_CLASSES = ['pyro', 'sniper', 'engineer', 'heavyweapons', 'spy']
+MAPS = ['cp_process_f12', 'cp_gullywash_f9', 'cp_snakewater_final1', 'koth_product_final', 'cp_sunshine', 'cp_granary_pro_rc8']
+
+HIGHLANDER_RATE = 0.05
+SCRIM_RATE = 0.05
+SUB_RATE = 0.08 # chance of each slot in a game being shared with a sub
+OFF_CLASS_RATE = 0.05 # chance of a combat class slot switching to an off-class for part of the game
+
+def getCommunitySteamIds():
+  return ['[U:1:%d]' % (40000000 + i) for i in range(NUM_COMMUNITY_PLAYERS)]
+
+# the regulars of a team that also scrims on the uploader's server (to be ignored as scrims)
+SCRIM_TEAM_STEAM_IDS = getCommunitySteamIds()[:6]
+
+def getLogRandom(seed, log_id, purpose):
+  return random.Random('%s:%d:%s' % (seed, log_id, purpose))
+
+def getLogDate(log_id, num_logs, span_days=DEFAULT_SPAN_DAYS):
+  # logs are spread evenly over the span, so a corpus always covers the same months whatever its size
+  return START_DATE + (log_id - FIRST_LOG_ID) * span_days * 24 * 3600 // num_logs
+
+def getLogFormat(seed, log_id):
+  """
+  Returns (whether it's a highlander game, whether it's a scrim, the number of players including subs) for a log
+  """
+  rng = getLogRandom(seed, log_id, 'format')
+  is_highlander = rng.random() < HIGHLANDER_RATE
+  is_scrim = not is_highlander and rng.random() < SCRIM_RATE
+  lineup = HIGHLANDER_LINEUP if is_highlander else SIXES_LINEUP
+  num_subs = sum(1 for _ in range(2 * len(lineup)) if rng.random() < SUB_RATE)
+  return is_highlander, is_scrim, 2 * len(lineup) + num_subs
+
+def createClassStats(rng, class_type, total_time, kills, deaths, assists, damage):
+  return {
+    'type': class_type,
+    'kills': kills,
+    'assists': assists,
+    'deaths': deaths,
+    'dmg': damage,
+    'weapon': { 'unique': { 'kills': kills, 'dmg': damage, 'avg_dmg': round(damage / max(kills, 1), 2), 'shots': 0, 'hits': 0 } },
+    'total_time': total_time,
+  }
+
+def createPlayerLog(rng, team, class_types, class_times):
+  playtime = sum(class_times)
+  playtime_minutes = max(playtime, 1) / 60.0
+  is_medic = class_types[0] == 'medic'
+
+  dpm = 0 if is_medic else rng.gauss(260 if class_types[0] in ['scout', 'soldier', 'demoman'] else 180, 60)
+  damage = max(0, int(dpm * playtime_minutes)) if not is_medic else rng.randint(0, 400)
+  heals = int(max(0, rng.gauss(1050, 150)) * playtime_minutes) if is_medic else 0
+  kills = max(0, int(rng.gauss(0.6, 0.3) * playtime_minutes)) if not is_medic else rng.randint(0, 3)
+  deaths = max(0, int(rng.gauss(0.5, 0.15) * playtime_minutes))
+  assists = max(0, int(rng.gauss(0.3, 0.15) * playtime_minutes))
+  airshots = rng.randint(0, 4) if class_types[0] in ['soldier', 'demoman'] else 0
+  heals_received = 0 if is_medic else int(max(0, rng.gauss(180, 60)) * playtime_minutes)
+
+  # split the player's totals across each class they played, in proportion to the time they played it
+  class_stats = []
+  for class_type, class_time in zip(class_types, class_times):
+    share = class_time / max(playtime, 1)
+    class_stats.append(createClassStats(rng, class_type, class_time, int(kills * share), int(deaths * share), int(assists * share), int(damage * share)))
+  if rng.random() < 0.05:
+    class_stats.append({ 'type': 'unknown', 'kills': 0, 'assists': 0, 'deaths': 0, 'dmg': 0, 'weapon': {}, 'total_time': rng.randint(1, 30) })
+
+  return {
+    'team': team,
+    'class_stats': class_stats,
+    'kills': kills, 'deaths': deaths, 'assists': assists, 'suicides': rng.randint(0, 2),
+    'kapd': '%.1f' % ((kills + assists) / max(deaths, 1)), 'kpd': '%.1f' % (kills / max(deaths, 1)),
+    'dmg': damage, 'dmg_real': int(damage * 0.9), 'dt': int(damage * rng.uniform(0.8, 1.2)), 'dt_real': int(damage * 0.5),
+    'hr': heals_received, 'lks': rng.randint(0, 6), 'as': airshots,
+    'dapd': damage // max(deaths, 1), 'dapm': int(damage / playtime_minutes),
+    'ubers': rng.randint(0, 12) if is_medic else 0,
+    'ubertypes': { 'medigun': rng.randint(0, 12) } if is_medic else {},
+    'drops': rng.randint(0, 2) if is_medic else 0,
+    'medkits': rng.randint(0, 30), 'medkits_hp': rng.randint(0, 1500),
+    'backstabs': rng.randint(0, 5) if 'spy' in class_types else 0,
+    'headshots': rng.randint(0, 8) if 'sniper' in class_types else 0, 'headshots_hit': 0,
+    'sentries': rng.randint(0, 3) if 'engineer' in class_types else 0,
+    'heal': heals, 'cpc': rng.randint(0, 4), 'ic': 0,
+    'medicstats': { 'advantages_lost': rng.randint(0, 3), 'biggest_advantage_lost': rng.randint(0, 40), 'deaths_with_95_99_uber': 0, 'avg_time_before_healing': round(rng.uniform(3, 8), 2) } if is_medic else {},
+  }
+
+def createSyntheticLog(log_id, num_logs, seed=0, span_days=DEFAULT_SPAN_DAYS):
+  """
+  Returns the full logs.tf json of the {log_id}th log of a corpus of {num_logs} logs
+  """
+  is_highlander, is_scrim, num_players = getLogFormat(seed, log_id)
+  rng = getLogRandom(seed, log_id, 'log')
+  lineup = HIGHLANDER_LINEUP if is_highlander else SIXES_LINEUP
+  length = rng.randint(900, 1800)
+  date = getLogDate(log_id, num_logs, span_days)
+
+  community_steam_ids = getCommunitySteamIds()
+  if is_scrim:
+    # the scrim team plays together on red, against players who aren't from the community
+    red_steam_ids = list(SCRIM_TEAM_STEAM_IDS)
+    blue_steam_ids = ['[U:1:%d]' % rng.randint(100000000, 900000000) for _ in lineup]
+    steam_ids = red_steam_ids + blue_steam_ids + rng.sample(community_steam_ids[len(SCRIM_TEAM_STEAM_IDS):], num_players - 2 * len(lineup))
+  else:
+    steam_ids = rng.sample(community_steam_ids, num_players)
+
+  players, names = {}, {}
+  slot_steam_ids = steam_ids[:2 * len(lineup)]
+  sub_steam_ids = steam_ids[2 * len(lineup):]
+  for slot, steam_id in enumerate(slot_steam_ids):
+    team = 'Red' if slot < len(lineup) else 'Blue'
+    class_type = lineup[slot % len(lineup)]
+
+    # a slot shared with a sub is split at a random point of the game
+    slot_players = [(steam_id, length)]
+    if len(sub_steam_ids) > 0 and rng.random() < len(sub_steam_ids) / (2 * len(lineup) - slot):
+      split_time = rng.randint(60, length - 60)
+      slot_players = [(steam_id, split_time), (sub_steam_ids.pop(), length - split_time)]
+
+    for player_steam_id, playtime in slot_players:
+      if class_type != 'medic' and rng.random() < OFF_CLASS_RATE:
+        off_class_time = rng.randint(30, max(31, playtime // 3))
+        class_types, class_times = [class_type, rng.choice(OFF_CLASSES)], [playtime - off_class_time, off_class_time]
+      else:
+        class_types, class_times = [class_type], [playtime]
+      players[player_steam_id] = createPlayerLog(rng, team, class_types, class_times)
+      names[player_steam_id] = 'player%s' % player_steam_id[5:-1]
+
+  red_score, blue_score = rng.randint(0, 5), rng.randint(0, 5)
+  num_rounds = red_score + blue_score
+  return {
+    'version': 3,
+    'teams': {
+      team: { 'score': score, 'kills': sum(player['kills'] for player in players.values() if player['team'] == team), 'deaths': 0, 'dmg': sum(player['dmg'] for player in players.values() if player['team'] == team), 'charges': rng.randint(5, 20), 'drops': rng.randint(0, 3), 'firstcaps': rng.randint(0, num_rounds), 'caps': rng.randint(0, 15) }
+      for team, score in [('Red', red_score), ('Blue', blue_score)]
+    },
+    'length': length,
+    'players': players,
+    'names': names,
+    'rounds': [
+      {
+        'start_time': date + i * (length // max(num_rounds, 1)), 'winner': rng.choice(['Red', 'Blue']), 'team': {}, 'length': length // max(num_rounds, 1),
+        'events': [{ 'type': 'pointcap', 'time': t, 'team': rng.choice(['Red', 'Blue']), 'point': rng.randint(1, 5) } for t in range(0, length // max(num_rounds, 1), 60)],
+        'players': {},
+      }
+      for i in range(num_rounds)
+    ],
+    'healspread': { steam_id: {} for steam_id, player in players.items() if player['heal'] > 0 },
+    'classkills': { steam_id: {} for steam_id in players },
+    'classdeaths': { steam_id: {} for steam_id in players },
+    'classkillassists': { steam_id: {} for steam_id in players },
+    'chat': [{ 'steamid': rng.choice(list(players)), 'name': 'player', 'msg': 'gg' } for _ in range(rng.randint(5, 40))],
+    'info': {
+      'map': rng.choice(MAPS), 'supplemental': True, 'total_length': length, 'hasRealDamage': True, 'hasWeaponDamage': True, 'hasAccuracy': False,
+      'hasHP': True, 'hasHP_real': True, 'hasHS': True, 'hasHS_hit': False, 'hasBS': True, 'hasCP': True, 'hasSB': False, 'hasDT': True,
+      'hasAS': True, 'hasHR': True, 'hasIntel': False, 'AD_scoring': False, 'notifications': [], 'title': 'Synthetic Pugs', 'date': date,
+      'uploader': { 'id': '76561197960265728', 'name': 'Synthetic Uploader', 'info': 'TFTrue v4.85' },
+    },
+    'killstreaks': [],
+    'success': True,
+  }
+
+def createSyntheticLogMetadata(num_logs, seed=0, span_days=DEFAULT_SPAN_DAYS):
+  """
+  Returns the uploader metadata (as returned by logs.tf, newest log first) that lists every log of the corpus
+  """
+  log_ids = range(FIRST_LOG_ID, FIRST_LOG_ID + num_logs)
+  return {
+    'success': True,
+    'results': num_logs,
+    'total': num_logs,
+    'parameters': { 'uploader': '76561197960265728', 'limit': num_logs, 'offset': 0 },
+    'logs': [
+      { 'id': log_id, 'title': 'Synthetic Pugs', 'map': getLogRandom(seed, log_id, 'map').choice(MAPS), 'date': getLogDate(log_id, num_logs, span_days), 'views': 0, 'players': getLogFormat(seed, log_id)[2] }
+      for log_id in reversed(log_ids)
+    ],
+  }
+
+def iterSyntheticLogs(num_logs, seed=0, span_days=DEFAULT_SPAN_DAYS):
+  for log_id in range(FIRST_LOG_ID, FIRST_LOG_ID + num_logs):
+    yield log_id, createSyntheticLog(log_id, num_logs, seed, span_days)
+
+def createSyntheticAliasLookup():
+  """
+  An alias for every community player, like the 'Key' worksheet
+  """
+  return { steam_id: 'player%s' % steam_id[5:-1] for steam_id in getCommunitySteamIds() }
+
+if __name__ == '__main__':
+  logs_dir = sys.argv[1] if len(sys.argv) > 1 else '.synthetic_logs'
+  num_logs = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+  seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+  logs_cache = logcache.SegmentLogCache(logs_dir)
+  for log_id, log in iterSyntheticLogs(num_logs, seed):
+    logs_cache.save(log_id, log, logcache.FULL_LOG_PROJECTION_ID)
+  logs_cache.close()
+  logcache.saveJson(os.path.join(logs_dir, 'metadata.json'), createSyntheticLogMetadata(num_logs, seed))
+
+  print(f"Generated {num_logs} logs in '{logs_dir}'")
@@ -1,3 +1,9 @@
+import json
+import math
+import re
+import threading
+import time
+from collections import deque
 from enum import Enum
 from sys import float_info
 
@@ -6,6 +12,8 @@ from httplib2 import Http
 from oauth2client import file, client, tools
 import gspread
 
+from instrumentation import METRICS
+
 class BorderTypes(Enum):
   Top = 'top'
   Bottom = 'bottom'
@@ -78,6 +86,24 @@ def readAllCells(spreadsheet, worksheet_name):
   except:
     # the worksheet doesn't exist, so return no data
     return [[]]
+
+def readAllCellsOfWorksheets(spreadsheet, worksheet_names):
+  """
+  Returns the cells of each worksheet (like readAllCells), keyed by name, all read in a single call
+  """
+  try:
+    response = spreadsheet.values_batch_get([quoteWorksheetName(worksheet_name) for worksheet_name in worksheet_names])
+  except:
+    # one of the worksheets doesn't exist, so read them one by one
+    return { worksheet_name: readAllCells(spreadsheet, worksheet_name) for worksheet_name in worksheet_names }
+
+  all_cells = {}
+  for worksheet_name, value_range in zip(worksheet_names, response['valueRanges']):
+    rows = value_range.get('values', [[]])
+    # trailing empty cells aren't returned, so pad every row to the same width like get_all_values
+    num_cols = max([len(row) for row in rows])
+    all_cells[worksheet_name] = [row + [''] * (num_cols - len(row)) for row in rows]
+  return all_cells
   
 def createUpdateColumnSizeRequest(worksheet, col_index_start, num_cols, pixelSize):
   return {
@@ -206,31 +232,30 @@ def createUpdateBorders(worksheet, row_index_start, col_index_start, num_rows, n
 
   return request
 
-def writeToWorksheetOverwriting(spreadsheet, worksheet_name, data):
-  num_rows = len(data)
-  num_cols = max([len(row) for row in data])
+BEST_COLOR = '#00ffff'
+GOOD_COLOR = '#b7ffcd'
+AVERAGE_COLOR = '#fce8b2'
+SUBPAR_COLOR = '#f4c7c3'
 
-  # get a clean worksheet
-  try:
-    worksheet = spreadsheet.worksheet(worksheet_name)
-    spreadsheet.del_worksheet(worksheet)
-  except Exception as e:
-    print(f"Failed to delete worksheet '{worksheet_name}': {e}")
-  
-  worksheet = spreadsheet.add_worksheet(worksheet_name, num_rows, num_cols)
+def createDpmFormattingRules(worksheet, col_index):
+  return createAllConditionalFormattingRulesForColumn(worksheet, col_index, [
+    RecolorBackgroundConditionalCriteria.max(BEST_COLOR),
+    RecolorBackgroundConditionalCriteria.greaterThan(GOOD_COLOR, 300),
+    RecolorBackgroundConditionalCriteria.between(AVERAGE_COLOR, 200, 300),
+    RecolorBackgroundConditionalCriteria.lessThan(SUBPAR_COLOR, 200),
+  ])
 
-  all_cells = worksheet.range(1, 1, num_rows + 1, num_cols + 1)
-  for cell in all_cells:
-    # if there is data for the cell, update it
-    if cell.row - 1 < len(data) and cell.col - 1 < len(data[cell.row - 1]):
-      cell.value = str(data[cell.row - 1][cell.col - 1]) 
-  
-  worksheet.update_cells(all_cells, 'USER_ENTERED')
+def createHpmFormattingRules(worksheet, col_index):
+  return createAllConditionalFormattingRulesForColumn(worksheet, col_index, [
+    RecolorBackgroundConditionalCriteria.max(BEST_COLOR),
+    RecolorBackgroundConditionalCriteria.greaterThan(GOOD_COLOR, 950),
+    RecolorBackgroundConditionalCriteria.between(AVERAGE_COLOR, 850, 950),
+    RecolorBackgroundConditionalCriteria.lessThan(SUBPAR_COLOR, 850),
+  ])
 
-def formatWorksheet(spreadsheet, worksheet_name, data, num_player_stat_cols, num_core_player_stat_cols):
+def createFormatWorksheetRequests(worksheet, data, num_player_stat_cols, num_core_player_stat_cols, aux_hpm_col_indices=()):
   num_rows = len(data)
   num_cols = num_player_stat_cols
-  worksheet = spreadsheet.worksheet(worksheet_name)
 
   # 1. freeze the header row & col
   freeze_cells = createUpdateGridPropertiesRequest(worksheet, {
@@ -257,23 +282,8 @@ def formatWorksheet(spreadsheet, worksheet_name, data, num_player_stat_cols, num
 
   # 5. create conditional formatting rules
   # 5.a. conditional formatting rules for core stats
-  BEST_COLOR = '#00ffff'
-  GOOD_COLOR = '#b7ffcd'
-  AVERAGE_COLOR = '#fce8b2'
-  SUBPAR_COLOR = '#f4c7c3'
-
-  core_stat_dpm_formatting = createAllConditionalFormattingRulesForColumn(worksheet, 2, [
-    RecolorBackgroundConditionalCriteria.max(BEST_COLOR),
-    RecolorBackgroundConditionalCriteria.greaterThan(GOOD_COLOR, 300),
-    RecolorBackgroundConditionalCriteria.between(AVERAGE_COLOR, 200, 300),
-    RecolorBackgroundConditionalCriteria.lessThan(SUBPAR_COLOR, 200),
-  ])
-  core_stat_hpm_formatting = createAllConditionalFormattingRulesForColumn(worksheet, 4, [
-    RecolorBackgroundConditionalCriteria.max(BEST_COLOR),
-    RecolorBackgroundConditionalCriteria.greaterThan(GOOD_COLOR, 950),
-    RecolorBackgroundConditionalCriteria.between(AVERAGE_COLOR, 850, 950),
-    RecolorBackgroundConditionalCriteria.lessThan(SUBPAR_COLOR, 850),
-  ])
+  core_stat_dpm_formatting = createDpmFormattingRules(worksheet, 2)
+  core_stat_hpm_formatting = createHpmFormattingRules(worksheet, 4)
   core_stat_win_rate_formatting = createAllConditionalFormattingRulesForColumn(worksheet, 5, [
     RecolorBackgroundConditionalCriteria.max(BEST_COLOR),
     RecolorBackgroundConditionalCriteria.greaterThan(GOOD_COLOR, 0.6),
@@ -283,27 +293,318 @@ def formatWorksheet(spreadsheet, worksheet_name, data, num_player_stat_cols, num
 
   # 5.b. conditional formatting rules for auxiliary stats
   aux_stat_dpm_formatting_unflattened = [
-    createAllConditionalFormattingRulesForColumn(worksheet, num_core_player_stat_cols + i, [
-      RecolorBackgroundConditionalCriteria.max(BEST_COLOR),
-      RecolorBackgroundConditionalCriteria.greaterThan(GOOD_COLOR, 300),
-      RecolorBackgroundConditionalCriteria.between(AVERAGE_COLOR, 200, 300),
-      RecolorBackgroundConditionalCriteria.lessThan(SUBPAR_COLOR, 200),
-    ])
-    for i in range(num_cols - num_core_player_stat_cols)
+    createHpmFormattingRules(worksheet, col_index) if col_index in aux_hpm_col_indices else createDpmFormattingRules(worksheet, col_index)
+    for col_index in range(num_core_player_stat_cols, num_cols)
   ]
   aux_stat_dpm_formatting = [item for sublist in aux_stat_dpm_formatting_unflattened for item in sublist]
 
   # 5.z. consolidate into a single list of conditional formatting rules
   conditional_formatting_rules = core_stat_dpm_formatting + core_stat_hpm_formatting + core_stat_win_rate_formatting + aux_stat_dpm_formatting
   
-  # Finally, send format request
-  spreadsheet.batch_update({
-    'requests': [
-      freeze_cells,
-      format_title_row,
-      format_core_stat_text,
-      resize_column_widths_p1,
-      resize_column_widths_p2,
-      core_aux_stat_border
-    ] + conditional_formatting_rules
+  # Finally, consolidate all of the format requests
+  return [
+    freeze_cells,
+    format_title_row,
+    format_core_stat_text,
+    resize_column_widths_p1,
+    resize_column_widths_p2,
+    core_aux_stat_border
+  ] + conditional_formatting_rules
+
+def createFormatHistoryWorksheetRequests(worksheet, data, dpm_col_index, hpm_col_index):
+  """
+  Formats a player's history worksheet: a header row followed by one row per game
+  """
+  num_rows = len(data)
+  num_cols = max([len(row) for row in data])
+  return [
+    createUpdateGridPropertiesRequest(worksheet, { 'frozenRowCount': 1 }),
+    createFormatCellsRequest(worksheet, 0, 0, 1, num_cols, { 'textFormat': { 'bold': True } }),
+    createUpdateColumnSizeRequest(worksheet, 0, num_cols, 150),
+    createFormatCellsRequest(worksheet, 1, 1, num_rows - 1, num_cols - 1, { 'horizontalAlignment': 'CENTER' }),
+  ] + createDpmFormattingRules(worksheet, dpm_col_index) + createHpmFormattingRules(worksheet, hpm_col_index)
+
+class WorksheetSnapshot:
+  """
+  The current state of a worksheet, read in a single call: its id & grid size, the number of conditional formatting
+  rules on it, and every cell's value as entered (i.e. formulas rather than what they calculate)
+  """
+  def __init__(self, sheet_json):
+    properties = sheet_json['properties']
+    self.id = properties['sheetId']
+    self.title = properties['title']
+    self.num_rows = properties['gridProperties']['rowCount']
+    self.num_cols = properties['gridProperties']['columnCount']
+    self.num_conditional_format_rules = len(sheet_json.get('conditionalFormats', []))
+
+    self.values = []
+    for grid_data in sheet_json.get('data', []):
+      for row_data in grid_data.get('rowData', []):
+        self.values.append([getEnteredCellValue(cell_data) for cell_data in row_data.get('values', [])])
+
+  @staticmethod
+  def forNewWorksheet(sheet_id, title, num_rows, num_cols):
+    return WorksheetSnapshot({ 'properties': { 'sheetId': sheet_id, 'title': title, 'gridProperties': { 'rowCount': num_rows, 'columnCount': num_cols } } })
+
+def getEnteredCellValue(cell_data):
+  entered_value = cell_data.get('userEnteredValue', {})
+  for key in ['formulaValue', 'stringValue', 'numberValue', 'boolValue']:
+    if key in entered_value:
+      return entered_value[key]
+  return ''
+
+def readWorksheetSnapshots(spreadsheet):
+  """
+  Returns the WorksheetSnapshot of every worksheet in the spreadsheet, keyed by title, all read in a single call
+  """
+  metadata = spreadsheet.fetch_sheet_metadata({
+    'includeGridData': 'true',
+    'fields': 'sheets(properties(sheetId,title,gridProperties),conditionalFormats(ranges),data(rowData(values(userEnteredValue))))',
   })
+  snapshots = [WorksheetSnapshot(sheet_json) for sheet_json in metadata['sheets']]
+  return { snapshot.title: snapshot for snapshot in snapshots }
+
+NUMBER_PATTERN = re.compile(r'^-?\d+(\.\d+)?$')
+
+def normalizeCellValue(value):
+  """
+  Converts a cell's value to the value the sheet stores for it, so that written data can be compared to what's read back
+  (e.g. '55.0%' is stored as 0.55, and '12.50' as 12.5)
+  """
+  if isinstance(value, (int, float)) and not isinstance(value, bool):
+    return float(value)
+  value = str(value)
+  if value.endswith('%') and NUMBER_PATTERN.match(value[:-1]):
+    return float(value[:-1]) / 100
+  if NUMBER_PATTERN.match(value):
+    return float(value)
+  return value
+
+def isSameCellValue(value1, value2):
+  if value1 == value2:
+    return True
+  value1, value2 = normalizeCellValue(value1), normalizeCellValue(value2)
+  if isinstance(value1, float) and isinstance(value2, float):
+    return math.isclose(value1, value2, rel_tol=1e-12)
+  return value1 == value2
+
+def getColumnLetters(col_index):
+  letters = ''
+  col_index += 1
+  while col_index > 0:
+    col_index, remainder = divmod(col_index - 1, 26)
+    letters = chr(ord('A') + remainder) + letters
+  return letters
+
+def quoteWorksheetName(worksheet_name):
+  return "'" + worksheet_name.replace("'", "''") + "'"
+
+def getA1Range(worksheet_name, row_index_start, col_index_start, num_rows, num_cols):
+  return '%s!%s%d:%s%d' % (
+    quoteWorksheetName(worksheet_name),
+    getColumnLetters(col_index_start), row_index_start + 1,
+    getColumnLetters(col_index_start + num_cols - 1), row_index_start + num_rows
+  )
+
+def getCellValue(data, row_index, col_index):
+  if row_index < len(data) and col_index < len(data[row_index]):
+    return data[row_index][col_index]
+  return ''
+
+def diffWorksheetData(current_data, data, num_rows, num_cols):
+  """
+  Returns the (row index, col index, num rows, num cols) of the rectangles of cells in {data} that differ from
+  {current_data}, within the first {num_rows} x {num_cols} cells. Each row's changes are split into runs of adjacent
+  cells, and a run is merged into the one above it when they span the same columns
+  """
+  changed_ranges = []
+  open_ranges = {} # (col index start, num cols): index of the range in changed_ranges that ended on the previous row
+  for row_index in range(num_rows):
+    row_open_ranges = {}
+    changed = [not isSameCellValue(getCellValue(current_data, row_index, col_index), getCellValue(data, row_index, col_index)) for col_index in range(num_cols)]
+    col_index = 0
+    while col_index < num_cols:
+      if not changed[col_index]:
+        col_index += 1
+        continue
+
+      run_start = col_index
+      while col_index < num_cols and changed[col_index]:
+        col_index += 1
+      run_key = (run_start, col_index - run_start)
+
+      if run_key in open_ranges:
+        range_index = open_ranges[run_key]
+        start_row, start_col, range_num_rows, range_num_cols = changed_ranges[range_index]
+        changed_ranges[range_index] = (start_row, start_col, range_num_rows + 1, range_num_cols)
+      else:
+        range_index = len(changed_ranges)
+        changed_ranges.append((row_index, run_start, 1, col_index - run_start))
+      row_open_ranges[run_key] = range_index
+    open_ranges = row_open_ranges
+
+  return changed_ranges
+
+class QuotaPacer:
+  """
+  Spaces out API calls so that no more than {max_calls} are made in any {period} seconds (the Sheets API allows 60
+  write requests per minute per user), and retries calls that are rejected for exceeding the quota anyway. The quota is
+  per user rather than per spreadsheet, so one pacer can be shared by the planners of several spreadsheets on different
+  threads
+  """
+  def __init__(self, max_calls=60, period=60.0, max_retries=5, initial_retry_delay=2.0, sleep=time.sleep, clock=time.monotonic):
+    self.max_calls = max_calls
+    self.period = period
+    self.max_retries = max_retries
+    self.initial_retry_delay = initial_retry_delay
+    self.sleep = sleep
+    self.clock = clock
+    self.call_times = deque()
+    self.num_calls = 0
+    self.num_retries = 0
+    self.lock = threading.Lock()
+
+  def waitForQuota(self):
+    # the lock is held while sleeping, so waiting threads take the freed up calls in turn
+    with self.lock:
+      while len(self.call_times) >= self.max_calls:
+        elapsed = self.clock() - self.call_times[0]
+        if elapsed >= self.period:
+          self.call_times.popleft()
+        else:
+          self.sleep(self.period - elapsed)
+      self.call_times.append(self.clock())
+      self.num_calls += 1
+
+  def call(self, func, *args):
+    METRICS.increment('sheets.payload_bytes', sum(len(json.dumps(arg)) for arg in args if isinstance(arg, dict)))
+    retry_delay = self.initial_retry_delay
+    for attempt in range(self.max_retries + 1):
+      self.waitForQuota()
+      METRICS.increment('sheets.api_calls')
+      METRICS.increment('sheets.api_calls.' + func.__name__)
+      try:
+        with METRICS.timeLatency('sheets.api_call'):
+          return func(*args)
+      except gspread.exceptions.APIError as e:
+        if attempt == self.max_retries or e.response.status_code != 429:
+          raise
+        with self.lock:
+          self.num_retries += 1
+        METRICS.increment('sheets.retries')
+        self.sleep(retry_delay)
+        retry_delay *= 2
+
+def splitIntoBatches(items, max_items_per_batch, max_batch_bytes):
+  """
+  Splits {items} (in order) into lists of at most {max_items_per_batch} items whose JSON is at most {max_batch_bytes} in total
+  """
+  batches, batch, batch_bytes = [], [], 0
+  for item in items:
+    item_bytes = len(json.dumps(item))
+    if len(batch) > 0 and (len(batch) == max_items_per_batch or batch_bytes + item_bytes > max_batch_bytes):
+      batches.append(batch)
+      batch, batch_bytes = [], 0
+    batch.append(item)
+    batch_bytes += item_bytes
+  if len(batch) > 0:
+    batches.append(batch)
+  return batches
+
+class SheetsBatchPlanner:
+  """
+  Collects every worksheet creation, formatting request & value write for a run, then sends them in as few
+  spreadsheets.batchUpdate & values.batchUpdate calls as the payload limits allow.
+
+  The current state of every worksheet is read in one call when the first write is planned, and new worksheets are
+  given their own sheet ids up front, so their formatting can be planned before they exist
+  """
+  MAX_REQUESTS_PER_CALL = 1000
+  MAX_PAYLOAD_BYTES = 2 * 1024 * 1024 # the Sheets API recommends keeping request bodies below 2MB
+
+  def __init__(self, spreadsheet, pacer=None):
+    self.spreadsheet = spreadsheet
+    self.pacer = pacer if pacer != None else QuotaPacer()
+    self.snapshots = None
+    self.requests = []
+    self.value_ranges = []
+
+  def getSnapshots(self):
+    if self.snapshots == None:
+      self.snapshots = self.pacer.call(readWorksheetSnapshots, self.spreadsheet)
+    return self.snapshots
+
+  def reset(self):
+    """
+    Forgets the worksheets' current state (so it's read again before the next write is planned) & drops any writes that
+    haven't been sent. Only needed when the planner is kept between runs (e.g. in watch mode), since anyone could have
+    edited the spreadsheet in the meantime
+    """
+    self.snapshots = None
+    self.requests = []
+    self.value_ranges = []
+
+  def worksheetExists(self, worksheet_name):
+    return worksheet_name in self.getSnapshots()
+
+  def createSheetId(self):
+    return max([snapshot.id for snapshot in self.getSnapshots().values()], default=0) + 1
+
+  def planWorksheetWrite(self, worksheet_name, data, num_player_stat_cols, num_core_player_stat_cols, aux_hpm_col_indices=()):
+    """
+    Plans writing a window's stats to its worksheet (see planFormattedWorksheetWrite). The auxiliary stats are formatted
+    as DPMs, except for the columns in {aux_hpm_col_indices}
+    """
+    return self.planFormattedWorksheetWrite(worksheet_name, data, lambda worksheet: createFormatWorksheetRequests(worksheet, data, num_player_stat_cols, num_core_player_stat_cols, aux_hpm_col_indices))
+
+  def planFormattedWorksheetWrite(self, worksheet_name, data, create_format_requests):
+    """
+    Plans writing {data} to the worksheet (creating it if needed) by diffing it against the worksheet's current values, so
+    only the ranges of cells that changed are sent. The worksheet is only resized & re-formatted (with the requests from
+    {create_format_requests}(worksheet)) when the layout (its number of rows/cols) changes. Returns the number of cells
+    that will be written
+    """
+    num_rows = len(data)
+    num_cols = max([len(row) for row in data])
+
+    worksheet = self.getSnapshots().get(worksheet_name)
+    if worksheet == None:
+      worksheet = WorksheetSnapshot.forNewWorksheet(self.createSheetId(), worksheet_name, num_rows, num_cols)
+      self.snapshots[worksheet_name] = worksheet
+      self.requests.append({ 'addSheet': { 'properties': { 'sheetId': worksheet.id, 'title': worksheet_name, 'gridProperties': { 'rowCount': num_rows, 'columnCount': num_cols } } } })
+      layout_changed = True
+    else:
+      layout_changed = worksheet.num_rows != num_rows or worksheet.num_cols != num_cols or worksheet.num_conditional_format_rules == 0
+
+    if layout_changed:
+      # resize the grid (which drops any cells outside of it) & replace the formatting, including the old conditional
+      # formatting rules since they would otherwise stack up
+      format_requests = create_format_requests(worksheet)
+      self.requests.append(createUpdateGridPropertiesRequest(worksheet, { 'rowCount': num_rows, 'columnCount': num_cols }))
+      self.requests += [{ 'deleteConditionalFormatRule': { 'sheetId': worksheet.id, 'index': 0 } } for _ in range(worksheet.num_conditional_format_rules)]
+      self.requests += format_requests
+      worksheet.num_rows, worksheet.num_cols = num_rows, num_cols
+      worksheet.values = [row[:num_cols] for row in worksheet.values[:num_rows]]
+      worksheet.num_conditional_format_rules = len([request for request in format_requests if 'addConditionalFormatRule' in request])
+
+    changed_ranges = diffWorksheetData(worksheet.values, data, num_rows, num_cols)
+    self.value_ranges += [
+      {
+        'range': getA1Range(worksheet_name, row_index, col_index, range_num_rows, range_num_cols),
+        'values': [[str(getCellValue(data, y, x)) for x in range(col_index, col_index + range_num_cols)] for y in range(row_index, row_index + range_num_rows)],
+      }
+      for row_index, col_index, range_num_rows, range_num_cols in changed_ranges
+    ]
+    worksheet.values = [list(row) for row in data]
+
+    return sum(range_num_rows * range_num_cols for _, _, range_num_rows, range_num_cols in changed_ranges)
+
+  def execute(self):
+    """
+    Sends every planned request, with the worksheet creation & formatting first so the value writes always fit the grid
+    """
+    for requests in splitIntoBatches(self.requests, SheetsBatchPlanner.MAX_REQUESTS_PER_CALL, SheetsBatchPlanner.MAX_PAYLOAD_BYTES):
+      self.pacer.call(self.spreadsheet.batch_update, { 'requests': requests })
+    for value_ranges in splitIntoBatches(self.value_ranges, SheetsBatchPlanner.MAX_REQUESTS_PER_CALL, SheetsBatchPlanner.MAX_PAYLOAD_BYTES):
+      self.pacer.call(self.spreadsheet.values_batch_update, { 'valueInputOption': 'USER_ENTERED', 'data': value_ranges })
+    self.requests, self.value_ranges = [], []
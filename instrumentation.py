@@ -0,0 +1,244 @@
+"""
+Lightweight run metrics: wall time per stage, counters, latency histograms & peak memory, which are cheap enough to always
+collect. METRICS is shared by every module, and can be written out as a JSON trace (in the Chrome trace event format, so
+it can be opened in chrome://tracing or Perfetto) along with a human-readable summary.
+"""
+import contextlib
+import cProfile
+import json
+import sys
+import threading
+import time
+
+try:
+  import resource
+except ImportError: # not available on Windows
+  resource = None
+
+LATENCY_BUCKET_BOUNDS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30] # in seconds
+
+def formatSeconds(seconds):
+  return '%.0fms' % (seconds * 1000) if seconds < 1 else '%.2fs' % seconds
+
+def formatBytes(num_bytes):
+  for unit in ['B', 'KB', 'MB', 'GB']:
+    if num_bytes < 1024 or unit == 'GB':
+      return '%.1f%s' % (num_bytes, unit) if unit != 'B' else '%d%s' % (num_bytes, unit)
+    num_bytes /= 1024
+
+class LatencyHistogram:
+  def __init__(self):
+    self.bucket_counts = [0] * (len(LATENCY_BUCKET_BOUNDS) + 1) # the last bucket is for anything slower than every bound
+    self.count = 0
+    self.total = 0
+    self.max = 0
+
+  def record(self, seconds):
+    bucket = next((i for i, bound in enumerate(LATENCY_BUCKET_BOUNDS) if seconds <= bound), len(LATENCY_BUCKET_BOUNDS))
+    self.bucket_counts[bucket] += 1
+    self.count += 1
+    self.total += seconds
+    self.max = max(self.max, seconds)
+
+  def getPercentile(self, percentile):
+    """
+    Returns the upper bound of the bucket holding the {percentile}th latency
+    """
+    target = percentile / 100 * self.count
+    seen = 0
+    for i, count in enumerate(self.bucket_counts):
+      seen += count
+      if count > 0 and seen >= target:
+        return min(LATENCY_BUCKET_BOUNDS[i], self.max) if i < len(LATENCY_BUCKET_BOUNDS) else self.max
+    return self.max
+
+  @staticmethod
+  def getBucketLabel(bucket):
+    return '<=%gs' % LATENCY_BUCKET_BOUNDS[bucket] if bucket < len(LATENCY_BUCKET_BOUNDS) else '>%gs' % LATENCY_BUCKET_BOUNDS[-1]
+
+  def toJson(self):
+    return {
+      'count': self.count,
+      'total_seconds': self.total,
+      'max_seconds': self.max,
+      'buckets': { LatencyHistogram.getBucketLabel(bucket): count for bucket, count in enumerate(self.bucket_counts) if count > 0 },
+    }
+
+def getPeakRssBytes():
+  if resource == None:
+    return None
+  peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak_rss if sys.platform == 'darwin' else peak_rss * 1024 # macOS reports bytes, Linux reports kilobytes
+
+class RunMetrics:
+  """
+  Records how long each (possibly nested) stage took, named counters (e.g. cache hits) and latency histograms
+  (e.g. of HTTP requests). Safe to record from several threads
+  """
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.start_time = time.perf_counter()
+    self.stage_stack = threading.local()
+    self.stage_spans = [] # (stage path, start offset, duration, thread index)
+    self.thread_names = [] # of each thread that ran a stage, by index (numbered from 1 in the order they first finished one)
+    self.thread_indices = {} # by thread id
+    self.counters = {}
+    self.histograms = {}
+
+  def reset(self):
+    self.__init__()
+
+  @contextlib.contextmanager
+  def stage(self, name):
+    """
+    Times the code in the with block as a stage, which is nested inside any stage that's already running on this thread
+    """
+    stack = getattr(self.stage_stack, 'names', None)
+    if stack == None:
+      stack = self.stage_stack.names = []
+    stack.append(name)
+    path = '/'.join(stack)
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      end = time.perf_counter()
+      stack.pop()
+      with self.lock:
+        self.stage_spans.append((path, start - self.start_time, end - start, self.getThreadIndex()))
+
+  def getThreadIndex(self):
+    """
+    Returns the index of the current thread, numbering it if it hasn't run a stage before. Must be called with the lock held
+    """
+    thread_id = threading.get_ident()
+    if thread_id not in self.thread_indices:
+      self.thread_names.append(threading.current_thread().name)
+      self.thread_indices[thread_id] = len(self.thread_names)
+    return self.thread_indices[thread_id]
+
+  def stageIter(self, name, iterable):
+    """
+    Yields each item of {iterable}, timing the work of producing each one as the stage {name}. For generators whose work is
+    interleaved with the code consuming them, which a stage around the whole loop would also count
+    """
+    iterator = iter(iterable)
+    while True:
+      with self.stage(name):
+        item = next(iterator, StopIteration)
+      if item is StopIteration:
+        return
+      yield item
+
+  def increment(self, counter_name, amount=1):
+    with self.lock:
+      self.counters[counter_name] = self.counters.get(counter_name, 0) + amount
+
+  def recordLatency(self, histogram_name, seconds):
+    with self.lock:
+      if histogram_name not in self.histograms:
+        self.histograms[histogram_name] = LatencyHistogram()
+      self.histograms[histogram_name].record(seconds)
+
+  @contextlib.contextmanager
+  def timeLatency(self, histogram_name):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.recordLatency(histogram_name, time.perf_counter() - start)
+
+  def getStageTotals(self):
+    """
+    Returns the total seconds spent in each stage path, in the order that the stages first started
+    """
+    stage_totals = {}
+    for path, start, duration, thread_index in sorted(self.stage_spans, key=lambda span: span[1]):
+      stage_totals[path] = stage_totals.get(path, 0) + duration
+    return stage_totals
+
+  def toJson(self):
+    return {
+      'wall_seconds': time.perf_counter() - self.start_time,
+      'peak_rss_bytes': getPeakRssBytes(),
+      'stage_seconds': self.getStageTotals(),
+      'counters': dict(sorted(self.counters.items())),
+      'histograms': { name: histogram.toJson() for name, histogram in sorted(self.histograms.items()) },
+    }
+
+  def toTraceJson(self):
+    return {
+      'traceEvents': [
+        { 'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': thread_index, 'args': { 'name': thread_name } }
+        for thread_index, thread_name in enumerate(self.thread_names, 1)
+      ] + [
+        { 'name': path.split('/')[-1], 'cat': path, 'ph': 'X', 'ts': start * 1e6, 'dur': duration * 1e6, 'pid': 1, 'tid': thread_index }
+        for path, start, duration, thread_index in self.stage_spans
+      ],
+      'metrics': self.toJson(),
+    }
+
+  def getSummary(self):
+    metrics = self.toJson()
+    lines = ['Finished in %s' % formatSeconds(metrics['wall_seconds'])]
+    if metrics['peak_rss_bytes'] != None:
+      lines.append('Peak memory: %s' % formatBytes(metrics['peak_rss_bytes']))
+
+    lines.append('Stages:')
+    for path, seconds in metrics['stage_seconds'].items():
+      lines.append('  %-50s %10s' % ('  ' * path.count('/') + path.split('/')[-1], formatSeconds(seconds)))
+
+    if len(self.counters) > 0:
+      lines.append('Counters:')
+      for name, value in metrics['counters'].items():
+        lines.append('  %-50s %10s' % (name, formatBytes(value) if name.endswith('bytes') else value))
+
+    if len(self.histograms) > 0:
+      lines.append('Latencies:')
+      for name, histogram in sorted(self.histograms.items()):
+        lines.append('  %-50s %d, p50 <= %s, p90 <= %s, p99 <= %s, max %s' % (
+          name, histogram.count, formatSeconds(histogram.getPercentile(50)), formatSeconds(histogram.getPercentile(90)),
+          formatSeconds(histogram.getPercentile(99)), formatSeconds(histogram.max)
+        ))
+
+    return '\n'.join(lines)
+
+  def writeReport(self, trace_filepath):
+    with open(trace_filepath, 'w') as f:
+      json.dump(self.toTraceJson(), f)
+
+METRICS = RunMetrics()
+
+class OptionalProfiler:
+  """
+  Once started, profiles the code run inside profile() blocks (e.g. the hot parse & aggregation paths) with cProfile, and
+  dumps the stats to a file that can be read with pstats or snakeviz. Until then, profile() does nothing
+  """
+  def __init__(self):
+    self.profiler = None
+    self.stats_filepath = None
+
+  def start(self, stats_filepath):
+    self.profiler = cProfile.Profile()
+    self.stats_filepath = stats_filepath
+
+  @property
+  def enabled(self):
+    return self.profiler != None
+
+  @contextlib.contextmanager
+  def profile(self):
+    if self.profiler == None:
+      yield
+      return
+    self.profiler.enable()
+    try:
+      yield
+    finally:
+      self.profiler.disable()
+
+  def dump(self):
+    if self.profiler != None:
+      self.profiler.dump_stats(self.stats_filepath)
+
+PROFILER = OptionalProfiler()
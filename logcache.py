@@ -0,0 +1,348 @@
+import argparse
+import io
+import json
+import os
+import struct
+import zlib
+
+from instrumentation import METRICS
+
+def loadJson(filepath):
+  with io.open(filepath, 'r') as f:
+    return json.load(f)
+
+def saveJson(filepath, jsonObject):
+  with io.open(filepath, 'w') as f:
+    return json.dump(jsonObject, f)
+
+def getLogDate(log):
+  return log[u'info'][u'date']
+
+FULL_LOG_PROJECTION_ID = 0
+
+def getProjectionId(projection):
+  """
+  Identifies which fields of the logs were kept when caching them (see tf2stats.projectJson), or FULL_LOG_PROJECTION_ID if the whole log was cached
+  """
+  if projection == None:
+    return FULL_LOG_PROJECTION_ID
+  return zlib.crc32(json.dumps(projection, sort_keys=True).encode('utf-8')) or 1
+
+class ManifestEntry:
+  """
+  What the cache knows about a log without loading it: its date (from the log's info), stored size & checksum, and
+  the projection it was cached with
+  """
+  __slots__ = ['date', 'size', 'checksum', 'projection_id'] # there's one for every cached log, kept in memory while the cache is open
+
+  def __init__(self, date, size, checksum, projection_id=FULL_LOG_PROJECTION_ID):
+    self.date = date
+    self.size = size
+    self.checksum = checksum
+    self.projection_id = projection_id
+
+  def toJson(self):
+    return [self.date, self.size, self.checksum, self.projection_id]
+
+  @staticmethod
+  def fromJson(entry_json):
+    return ManifestEntry(*entry_json)
+
+class DirectoryLogCache:
+  """
+  Caches each log as its own uncompressed {log id}.json file, with a manifest of every cached log in manifest.json
+  """
+  MANIFEST_FILENAME = 'manifest.json'
+
+  def __init__(self, cache_dir):
+    self.cache_dir = cache_dir + '/'
+    if not os.path.isdir(self.cache_dir):
+      os.makedirs(self.cache_dir)
+
+    self.manifest_filepath = self.cache_dir + DirectoryLogCache.MANIFEST_FILENAME
+    self.manifest = {}
+    if os.path.isfile(self.manifest_filepath):
+      self.manifest = { int(log_id): ManifestEntry.fromJson(entry) for log_id, entry in loadJson(self.manifest_filepath).items() }
+    self.manifest_dirty = False
+
+    # add any log files that were cached before the manifest existed & drop any that have been deleted since
+    cached_log_ids = set(self.listLogFileIds())
+    for log_id in cached_log_ids - self.manifest.keys():
+      self.manifest[log_id] = self.createManifestEntry(self.readLogFile(log_id))
+      self.manifest_dirty = True
+    for log_id in self.manifest.keys() - cached_log_ids:
+      del self.manifest[log_id]
+      self.manifest_dirty = True
+
+  def listLogFileIds(self):
+    return DirectoryLogCache.listLogFileIdsInDir(self.cache_dir)
+
+  @staticmethod
+  def listLogFileIdsInDir(cache_dir):
+    """
+    Returns the id of every {log id}.json file in {cache_dir} (if it exists) without reading any of them
+    """
+    if not os.path.isdir(cache_dir):
+      return []
+    return [int(filename[:-len('.json')]) for filename in os.listdir(cache_dir) if filename.endswith('.json') and filename[:-len('.json')].isdigit()]
+
+  def readLogFile(self, log_id):
+    with open(self.getLogFilepath(log_id), 'rb') as f:
+      return f.read()
+
+  def createManifestEntry(self, log_file_contents):
+    return ManifestEntry(getLogDate(json.loads(log_file_contents)), len(log_file_contents), zlib.crc32(log_file_contents))
+
+  def contains(self, log_id):
+    return log_id in self.manifest
+
+  def getManifestEntry(self, log_id):
+    return self.manifest.get(log_id)
+
+  def load(self, log_id):
+    return json.loads(self.loadRaw(log_id))
+
+  def loadRaw(self, log_id):
+    """
+    Returns the log's json text without decoding it
+    """
+    log_file_contents = self.readLogFile(log_id)
+    METRICS.increment('logs_cache.bytes_read', len(log_file_contents))
+    return log_file_contents
+
+  def save(self, log_id, log, projection_id=FULL_LOG_PROJECTION_ID):
+    log_file_contents = json.dumps(log).encode('utf-8')
+    with open(self.getLogFilepath(log_id), 'wb') as f:
+      f.write(log_file_contents)
+
+    self.manifest[log_id] = ManifestEntry(getLogDate(log), len(log_file_contents), zlib.crc32(log_file_contents), projection_id)
+    self.manifest_dirty = True
+
+  def logIds(self):
+    return list(self.manifest.keys())
+
+  def delete(self, log_id):
+    os.remove(self.getLogFilepath(log_id))
+    del self.manifest[log_id]
+    self.manifest_dirty = True
+
+  def getLogFilepath(self, log_id):
+    return self.cache_dir + str(log_id) + '.json'
+
+  def flush(self):
+    if not self.manifest_dirty:
+      return
+
+    temp_manifest_filepath = self.manifest_filepath + '.tmp'
+    saveJson(temp_manifest_filepath, { str(log_id): entry.toJson() for log_id, entry in self.manifest.items() })
+    os.replace(temp_manifest_filepath, self.manifest_filepath)
+    self.manifest_dirty = False
+
+  def close(self):
+    if len(self.manifest) == 0:
+      # every log has been deleted (e.g. migrated), so don't leave an empty manifest behind
+      if os.path.isfile(self.manifest_filepath):
+        os.remove(self.manifest_filepath)
+      return
+    self.flush()
+
+class SegmentIndexEntry(ManifestEntry):
+  __slots__ = ['offset']
+
+  def __init__(self, offset, date, size, checksum, projection_id=FULL_LOG_PROJECTION_ID):
+    super().__init__(date, size, checksum, projection_id)
+    self.offset = offset
+
+  def toJson(self):
+    return [self.offset] + super().toJson()
+
+  @staticmethod
+  def fromJson(entry_json):
+    return SegmentIndexEntry(*entry_json)
+
+class SegmentLogCache:
+  """
+  Caches logs as zlib-compressed records appended to a single segment file, along with an index of each log's offset.
+  The index doubles as the cache's manifest.
+
+  Each record is a header of (log id, log date, compressed size, projection id) followed by the compressed log json. Re-saving a log
+  appends a new record and points the index at it, so the old record is dead space until the segment is compacted.
+  """
+  SEGMENT_FILENAME = 'logs.seg'
+  INDEX_FILENAME = 'logs.idx'
+  RECORD_HEADER = struct.Struct('<QqII')
+  COMPRESSION_LEVEL = 6
+
+  def __init__(self, cache_dir):
+    self.cache_dir = cache_dir + '/'
+    if not os.path.isdir(self.cache_dir):
+      os.makedirs(self.cache_dir)
+
+    self.segment_filepath = self.cache_dir + SegmentLogCache.SEGMENT_FILENAME
+    self.index_filepath = self.cache_dir + SegmentLogCache.INDEX_FILENAME
+    self.segment = open(self.segment_filepath, 'a+b')
+    self.index = {}
+    self.index_dirty = False
+    self.loadIndex()
+
+  def loadIndex(self):
+    indexed_segment_size = 0
+    if os.path.isfile(self.index_filepath):
+      index_json = loadJson(self.index_filepath)
+      self.index = { int(log_id): SegmentIndexEntry.fromJson(entry) for log_id, entry in index_json[u'logs'].items() }
+      indexed_segment_size = index_json[u'segment_size']
+
+    # recover any records that were appended after the index was last written (e.g. if the process was killed)
+    segment_size = os.path.getsize(self.segment_filepath)
+    if indexed_segment_size > segment_size:
+      self.index = {}
+      indexed_segment_size = 0
+    if indexed_segment_size < segment_size:
+      self.index.update(self.scanRecords(indexed_segment_size))
+      self.index_dirty = True
+
+  def scanRecords(self, start_offset):
+    """
+    Returns the index entry of the latest complete record for each log in the segment after {start_offset}
+    """
+    entries = {}
+    self.segment.seek(start_offset)
+    offset = start_offset
+    while True:
+      header = self.segment.read(SegmentLogCache.RECORD_HEADER.size)
+      if len(header) < SegmentLogCache.RECORD_HEADER.size:
+        break
+      log_id, date, size, projection_id = SegmentLogCache.RECORD_HEADER.unpack(header)
+      payload_offset = offset + SegmentLogCache.RECORD_HEADER.size
+      payload = self.segment.read(size)
+      if len(payload) < size:
+        break # a partially written record
+      entries[log_id] = SegmentIndexEntry(payload_offset, date, size, zlib.crc32(payload), projection_id)
+      offset = payload_offset + size
+
+    return entries
+
+  def contains(self, log_id):
+    return log_id in self.index
+
+  def getManifestEntry(self, log_id):
+    return self.index.get(log_id)
+
+  def load(self, log_id):
+    return json.loads(self.loadRaw(log_id))
+
+  def loadRaw(self, log_id):
+    """
+    Returns the log's json text without decoding it
+    """
+    entry = self.index[log_id]
+    self.segment.seek(entry.offset)
+    payload = self.segment.read(entry.size)
+    METRICS.increment('logs_cache.bytes_read', entry.size)
+    if zlib.crc32(payload) != entry.checksum:
+      raise ValueError(f"Cached log {log_id} is corrupt")
+
+    return zlib.decompress(payload)
+
+  def save(self, log_id, log, projection_id=FULL_LOG_PROJECTION_ID):
+    payload = zlib.compress(json.dumps(log).encode('utf-8'), SegmentLogCache.COMPRESSION_LEVEL)
+    date = getLogDate(log)
+
+    self.segment.seek(0, os.SEEK_END)
+    offset = self.segment.tell()
+    self.segment.write(SegmentLogCache.RECORD_HEADER.pack(log_id, date, len(payload), projection_id) + payload)
+
+    self.index[log_id] = SegmentIndexEntry(offset + SegmentLogCache.RECORD_HEADER.size, date, len(payload), zlib.crc32(payload), projection_id)
+    self.index_dirty = True
+
+  def logIds(self):
+    return list(self.index.keys())
+
+  def flush(self):
+    self.segment.flush()
+    if not self.index_dirty:
+      return
+
+    temp_index_filepath = self.index_filepath + '.tmp'
+    saveJson(temp_index_filepath, {
+      'segment_size': os.path.getsize(self.segment_filepath),
+      'logs': { str(log_id): entry.toJson() for log_id, entry in self.index.items() }
+    })
+    os.replace(temp_index_filepath, self.index_filepath)
+    self.index_dirty = False
+
+  def compact(self):
+    """
+    Rewrites the segment with only the latest record of each log, dropping any dead space
+    """
+    temp_segment_filepath = self.segment_filepath + '.tmp'
+    compacted_index = {}
+    with open(temp_segment_filepath, 'wb') as compacted_segment:
+      for log_id, entry in sorted(self.index.items()):
+        self.segment.seek(entry.offset)
+        payload = self.segment.read(entry.size)
+        compacted_index[log_id] = SegmentIndexEntry(compacted_segment.tell() + SegmentLogCache.RECORD_HEADER.size, entry.date, entry.size, entry.checksum, entry.projection_id)
+        compacted_segment.write(SegmentLogCache.RECORD_HEADER.pack(log_id, entry.date, entry.size, entry.projection_id) + payload)
+
+    self.segment.close()
+    os.replace(temp_segment_filepath, self.segment_filepath)
+    self.segment = open(self.segment_filepath, 'a+b')
+    self.index = compacted_index
+    self.index_dirty = True
+    self.flush()
+
+  def close(self):
+    self.flush()
+    self.segment.close()
+
+def migrateLogCache(source_cache, destination_cache, delete_migrated=False):
+  """
+  Copies every log in {source_cache} that isn't already in {destination_cache}, returning the number of copied logs.
+  If {delete_migrated}, every log of {source_cache} that's in {destination_cache} afterwards is deleted from it
+  """
+  migrated_log_ids = [log_id for log_id in source_cache.logIds() if not destination_cache.contains(log_id)]
+  for log_id in migrated_log_ids:
+    destination_cache.save(log_id, source_cache.load(log_id), source_cache.getManifestEntry(log_id).projection_id)
+  destination_cache.flush()
+
+  if delete_migrated:
+    for log_id in source_cache.logIds():
+      if destination_cache.contains(log_id):
+        source_cache.delete(log_id)
+  return len(migrated_log_ids)
+
+def migrateLegacyLogCache(cache_dir, destination_cache):
+  """
+  Moves any logs cached as {log id}.json files in {cache_dir} (the layout before SegmentLogCache) into {destination_cache},
+  deleting the files so that later runs don't need to read them again. Returns the number of migrated logs
+  """
+  if len(DirectoryLogCache.listLogFileIdsInDir(cache_dir)) == 0:
+    return 0
+  source_cache = DirectoryLogCache(cache_dir)
+  num_migrated_logs = migrateLogCache(source_cache, destination_cache, delete_migrated=True)
+  source_cache.close()
+  return num_migrated_logs
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Manage the logs cache')
+  subparsers = parser.add_subparsers(dest='command', required=True)
+  migrate_parser = subparsers.add_parser('migrate', help='copy a directory of {log id}.json files into a segment cache')
+  migrate_parser.add_argument('source_dir')
+  migrate_parser.add_argument('destination_dir')
+  migrate_parser.add_argument('--delete', action='store_true', help='delete the json files once they have been migrated')
+  compact_parser = subparsers.add_parser('compact', help='drop the dead space left in a segment cache by re-saved logs')
+  compact_parser.add_argument('cache_dir')
+  args = parser.parse_args()
+
+  if args.command == 'migrate':
+    source_cache = DirectoryLogCache(args.source_dir)
+    destination_cache = SegmentLogCache(args.destination_dir)
+    print(f"Migrated {migrateLogCache(source_cache, destination_cache, args.delete)} logs")
+    source_cache.close()
+    destination_cache.close()
+  elif args.command == 'compact':
+    cache = SegmentLogCache(args.cache_dir)
+    size_before = os.path.getsize(cache.segment_filepath)
+    cache.compact()
+    print(f"Compacted {size_before} bytes to {os.path.getsize(cache.segment_filepath)} bytes")
+    cache.close()
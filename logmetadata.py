@@ -0,0 +1,54 @@
+import json
+import sqlite3
+
+class LogMetadataStore:
+  """
+  A local SQLite index of the log metadata (id, title, map, date & player count) that logs.tf lists for each uploader, so
+  that each sync only needs to fetch the logs uploaded since the last one. Logs listed by several uploaders are only stored once
+  """
+  def __init__(self, filepath):
+    # only ever used by one thread at a time (whichever is syncing the LogsClient), but not always the one that opened it
+    self.connection = sqlite3.connect(filepath, check_same_thread=False)
+    self.connection.executescript('''
+      CREATE TABLE IF NOT EXISTS logs (log_id INTEGER PRIMARY KEY, date INTEGER NOT NULL, metadata TEXT NOT NULL);
+      CREATE TABLE IF NOT EXISTS uploader_logs (uploader_id TEXT NOT NULL, log_id INTEGER NOT NULL, PRIMARY KEY (uploader_id, log_id));
+    ''')
+
+  def getUploaderLogIds(self, uploader_id):
+    return set(log_id for log_id, in self.connection.execute('SELECT log_id FROM uploader_logs WHERE uploader_id = ?', (uploader_id,)))
+
+  def saveUploaderLogs(self, uploader_id, logs, replace=False):
+    """
+    Adds (or updates) the metadata of {logs} uploaded by {uploader_id}. If {replace}, {logs} is the uploader's full list of
+    logs, so any of their logs that aren't in it anymore (e.g. were deleted) are removed
+    """
+    self.connection.executemany(
+      'INSERT OR REPLACE INTO logs (log_id, date, metadata) VALUES (?, ?, ?)',
+      [(log[u'id'], log[u'date'], json.dumps(log)) for log in logs]
+    )
+    if replace:
+      self.connection.execute('DELETE FROM uploader_logs WHERE uploader_id = ?', (uploader_id,))
+    self.connection.executemany('INSERT OR IGNORE INTO uploader_logs (uploader_id, log_id) VALUES (?, ?)', [(uploader_id, log[u'id']) for log in logs])
+    if replace:
+      self.connection.execute('DELETE FROM logs WHERE log_id NOT IN (SELECT log_id FROM uploader_logs)')
+
+  def loadLogMetadata(self, uploader_ids):
+    """
+    Returns the metadata of every log uploaded by any of {uploader_ids} (without duplicates), newest first like logs.tf lists them
+    """
+    uploader_ids = list(uploader_ids)
+    placeholders = ', '.join('?' * len(uploader_ids))
+    return [
+      json.loads(metadata)
+      for metadata, in self.connection.execute(
+        f'SELECT metadata FROM logs WHERE log_id IN (SELECT log_id FROM uploader_logs WHERE uploader_id IN ({placeholders})) ORDER BY log_id DESC',
+        uploader_ids
+      )
+    ]
+
+  def commit(self):
+    self.connection.commit()
+
+  def close(self):
+    self.connection.commit()
+    self.connection.close()
@@ -0,0 +1,220 @@
+import asyncio
+import random
+import time
+import urllib.parse
+
+import aiohttp
+
+from instrumentation import METRICS
+from logcache import getProjectionId
+from tf2stats import projectJson
+
+LOGS_TF_API_URL = 'http://logs.tf/api/v1'
+NUM_RECHECKED_LOGS = 100 # how many of an uploader's most recent known logs every incremental metadata sync lists again
+
+class TransientFetchError(Exception):
+  """
+  A failed request that is worth retrying (e.g. a timeout, a 5xx response or being rate limited)
+  """
+  def __init__(self, message, retry_after=None):
+    super().__init__(message)
+    self.retry_after = retry_after
+
+class AdaptiveRateLimiter:
+  """
+  Spaces out requests, gradually shrinking the delay between them while responses are fast and quickly growing it when
+  they slow down or the server starts rate limiting
+  """
+  def __init__(self, initial_delay=0.2, min_delay=0.02, max_delay=10.0):
+    self.delay = initial_delay
+    self.min_delay = min_delay
+    self.max_delay = max_delay
+    self.average_response_time = None
+    self.next_request_time = 0
+    self.lock = asyncio.Lock()
+
+  async def wait(self):
+    async with self.lock:
+      now = time.monotonic()
+      if self.next_request_time > now:
+        await asyncio.sleep(self.next_request_time - now)
+      self.next_request_time = max(now, self.next_request_time) + self.delay
+
+  def onResponse(self, response_time):
+    if self.average_response_time == None:
+      self.average_response_time = response_time
+
+    if response_time > 2 * self.average_response_time: # the server is slowing down under load
+      self.delay = min(self.max_delay, self.delay * 1.5)
+    else:
+      self.delay = max(self.min_delay, self.delay * 0.95)
+    self.average_response_time = 0.8 * self.average_response_time + 0.2 * response_time
+
+  def onRateLimited(self, retry_after):
+    self.delay = min(self.max_delay, self.delay * 2)
+    if retry_after != None:
+      self.next_request_time = max(self.next_request_time, time.monotonic() + retry_after)
+
+class AsyncLogsFetcher:
+  """
+  Fetches logs concurrently over a pool of keep-alive connections, saving each log to {logs_cache} as soon as it arrives.
+  If there's a {projection}, only those fields of each log are kept
+  """
+  RETRYABLE_STATUSES = [429, 500, 502, 503, 504]
+
+  def __init__(self, logs_cache, projection=None, api_url=LOGS_TF_API_URL, max_connections=4, max_retries=5, initial_delay=0.2, timeout=30, flush_interval=50):
+    self.logs_cache = logs_cache
+    self.projection = projection
+    self.projection_id = getProjectionId(projection)
+    self.api_url = api_url
+    self.max_connections = max_connections
+    self.max_retries = max_retries
+    self.initial_delay = initial_delay
+    self.timeout = timeout
+    self.flush_interval = flush_interval
+
+    self.num_requests = 0
+    self.num_retries = 0
+    self.num_rate_limited = 0
+    self.num_failed_logs = 0
+
+  def createSession(self):
+    return aiohttp.ClientSession(
+      connector=aiohttp.TCPConnector(limit=self.max_connections),
+      headers={ 'Accept-Encoding': 'gzip' }, # aiohttp transparently decompresses the responses
+      timeout=aiohttp.ClientTimeout(total=self.timeout),
+    )
+
+  async def fetchJson(self, session, rate_limiter, url):
+    await rate_limiter.wait()
+
+    self.num_requests += 1
+    METRICS.increment('http.requests')
+    start = time.monotonic()
+    try:
+      async with session.get(url) as response:
+        if response.status == 429:
+          self.num_rate_limited += 1
+          METRICS.increment('http.rate_limited')
+          retry_after = response.headers.get('Retry-After')
+          retry_after = float(retry_after) if retry_after and retry_after.replace('.', '', 1).isdigit() else None
+          rate_limiter.onRateLimited(retry_after)
+          raise TransientFetchError(f"Rate limited fetching {url}", retry_after)
+        if response.status in AsyncLogsFetcher.RETRYABLE_STATUSES:
+          raise TransientFetchError(f"HTTP {response.status} fetching {url}")
+        response.raise_for_status()
+
+        response_json = await response.json(content_type=None)
+    except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+      raise TransientFetchError(f"{type(e).__name__} fetching {url}")
+
+    response_time = time.monotonic() - start
+    rate_limiter.onResponse(response_time)
+    METRICS.recordLatency('http.request', response_time)
+    return response_json
+
+  async def fetchJsonWithRetries(self, session, rate_limiter, url):
+    for attempt in range(self.max_retries + 1):
+      try:
+        return await self.fetchJson(session, rate_limiter, url)
+      except TransientFetchError as e:
+        if attempt == self.max_retries:
+          raise
+        self.num_retries += 1
+        METRICS.increment('http.retries')
+        # exponential backoff with jitter, unless the server said how long to wait
+        backoff = e.retry_after if e.retry_after != None else (0.5 * 2 ** attempt) * (0.5 + random.random())
+        await asyncio.sleep(backoff)
+
+  async def fetchLogsAsync(self, log_ids, keep_logs):
+    rate_limiter = AdaptiveRateLimiter(self.initial_delay)
+    queue = asyncio.Queue()
+    for log_id in log_ids:
+      queue.put_nowait(log_id)
+
+    fetched_logs = {}
+    async def worker(session):
+      while not queue.empty():
+        log_id = queue.get_nowait()
+        try:
+          log = await self.fetchJsonWithRetries(session, rate_limiter, self.getLogUrl(log_id))
+        except (TransientFetchError, aiohttp.ClientResponseError) as e:
+          # e.g. the log was deleted (404), so skip it instead of losing every other log being fetched (it's tried
+          # again on the next run, since it isn't cached)
+          print(f"Failed to fetch log {log_id}: {e}")
+          self.num_failed_logs += 1
+          METRICS.increment('http.failed_logs')
+          continue
+        if self.projection != None:
+          log = projectJson(log, self.projection)
+
+        self.logs_cache.save(log_id, log, self.projection_id)
+        fetched_logs[log_id] = log if keep_logs else None
+        if len(fetched_logs) % self.flush_interval == 0:
+          self.logs_cache.flush()
+
+    async with self.createSession() as session:
+      try:
+        await asyncio.gather(*[worker(session) for _ in range(min(self.max_connections, len(log_ids)))])
+      finally:
+        self.logs_cache.flush() # keep whatever was fetched before any failure
+
+    return fetched_logs
+
+  def fetchLogs(self, log_ids, keep_logs=True):
+    """
+    Fetches & caches every log in {log_ids}, returning a lookup of the fetched logs by id. Unless {keep_logs}, each log is
+    dropped as soon as it's cached (leaving None in the lookup), so fetching any number of logs takes the same memory.
+    Logs that can't be fetched (e.g. that were deleted, or still failed after every retry) are left out of the lookup
+    """
+    if len(log_ids) == 0:
+      return {}
+    return asyncio.run(self.fetchLogsAsync(log_ids, keep_logs))
+
+  def getLogUrl(self, log_id):
+    return self.api_url + '/log/' + str(log_id)
+
+  async def fetchUploaderLogMetadataSince(self, session, rate_limiter, uploader_id, known_log_ids, page_size, num_rechecked_logs):
+    """
+    Pages through the uploader's logs (which logs.tf lists newest first) until reaching the end of the list, or a page by
+    which {num_rechecked_logs} of {known_log_ids} (or all of them, if there are fewer) have been listed. Returns the metadata
+    of every log on the pages read & whether the uploader's full list was read. Re-reading the most recent known logs
+    updates the metadata of any that were re-uploaded since the last sync, so their cached logs are seen to be stale
+    """
+    num_known_logs_to_list = min(num_rechecked_logs, len(known_log_ids))
+    listed_logs = []
+    num_listed_known_logs = 0
+    offset = 0
+    while True:
+      page_logs = (await self.fetchJsonWithRetries(session, rate_limiter, self.getUploaderLogsUrl(uploader_id, page_size, offset)))[u'logs']
+      listed_logs.extend(page_logs)
+      num_listed_known_logs += sum(1 for log in page_logs if log[u'id'] in known_log_ids)
+      if len(page_logs) < page_size:
+        return listed_logs, True
+      if num_known_logs_to_list > 0 and num_listed_known_logs >= num_known_logs_to_list:
+        return listed_logs, False
+      offset += page_size
+
+  async def fetchLogMetadataSinceAsync(self, known_log_ids_by_uploader, page_size, full_page_size, num_rechecked_logs):
+    rate_limiter = AdaptiveRateLimiter(self.initial_delay)
+    async with self.createSession() as session:
+      uploader_ids = list(known_log_ids_by_uploader.keys())
+      results = await asyncio.gather(*[
+        self.fetchUploaderLogMetadataSince(session, rate_limiter, uploader_id, known_log_ids_by_uploader[uploader_id], page_size if len(known_log_ids_by_uploader[uploader_id]) > 0 else full_page_size, num_rechecked_logs)
+        for uploader_id in uploader_ids
+      ])
+    return dict(zip(uploader_ids, results))
+
+  def fetchLogMetadataSince(self, known_log_ids_by_uploader, page_size=50, full_page_size=1000, num_rechecked_logs=NUM_RECHECKED_LOGS):
+    """
+    Concurrently fetches the metadata of the logs that each uploader has uploaded since the logs in {known_log_ids_by_uploader}
+    (or all of their logs, in pages of {full_page_size}, if none are known), along with their {num_rechecked_logs} most
+    recent known logs in case any were re-uploaded. Returns the (listed logs' metadata, whether the uploader's full list was
+    read) of each uploader
+    """
+    if len(known_log_ids_by_uploader) == 0:
+      return {}
+    return asyncio.run(self.fetchLogMetadataSinceAsync(known_log_ids_by_uploader, page_size, full_page_size, num_rechecked_logs))
+
+  def getUploaderLogsUrl(self, uploader_id, limit, offset):
+    return self.api_url + '/log?' + urllib.parse.urlencode({ 'uploader': uploader_id, 'limit': limit, 'offset': offset })
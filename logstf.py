@@ -1,20 +1,15 @@
+from bisect import bisect_left
+from collections.abc import Mapping
 import datetime
-import json
+import itertools
 from math import floor
-import io
-import os
 import urllib
 
-import requests
-from requests_throttler import BaseThrottler
-
-def loadJson(filepath):
-  with io.open(filepath, 'r') as f:
-    return json.load(f)
-
-def saveJson(filepath, jsonObject):
-  with io.open(filepath, 'w') as f:
-    return json.dump(jsonObject, f)
+from instrumentation import METRICS
+from logcache import getProjectionId, FULL_LOG_PROJECTION_ID
+from logmetadata import LogMetadataStore
+from logsfetcher import AsyncLogsFetcher
+from tf2stats import projectJson
 
 def getLogIdFromUrl(url):
   return int(url[url.rindex('/') + 1:])
@@ -22,55 +17,162 @@ def getLogIdFromUrl(url):
 def getPlayerNameFromUrl(url):
   return urllib.parse.unquote(url[url.index('=') + 1:])
 
-def filterLogMetadataInTimeRange(logs, timerange):
-  return [log for log in logs if log[u'players'] and log[u'players'] >= 12 and log[u'players'] < 18 and log[u'date'] >= timerange.start and log[u'date'] <= timerange.end] # only include 6v6 games (which might have had subs)
+def isSixesLog(log):
+  return log[u'players'] and log[u'players'] >= 12 and log[u'players'] < 18 # 6v6 games (which might have had subs)
+
+class LogMetadataIndex:
+  """
+  The 6v6 logs in a list of log metadata, sorted by date so that the logs in any time range can be found with a binary
+  search instead of scanning every log
+  """
+  def __init__(self, logs):
+    self.logs = sorted([log for log in logs if isSixesLog(log)], key=lambda log: (log[u'date'], log[u'id']))
+    self.dates = [log[u'date'] for log in self.logs]
+
+  def getLogsInTimeRange(self, timerange):
+    """
+    Returns the logs from the start of {timerange} up to (but not including) its end, oldest first
+    """
+    return self.logs[bisect_left(self.dates, timerange.start):bisect_left(self.dates, timerange.end)]
+
+  def contains(self, log):
+    """
+    Whether the index has a log with the same id & date as {log}
+    """
+    i = bisect_left(self.dates, log[u'date'])
+    while i < len(self.logs) and self.dates[i] == log[u'date']:
+      if self.logs[i][u'id'] == log[u'id']:
+        return True
+      i += 1
+    return False
+
+class FetchPlan:
+  def __init__(self, cached_log_ids, unprojected_log_ids, stale_log_ids, missing_log_ids):
+    self.cached_log_ids = cached_log_ids
+    self.unprojected_log_ids = unprojected_log_ids
+    self.stale_log_ids = stale_log_ids
+    self.missing_log_ids = missing_log_ids
+
+class LazyLogs(Mapping):
+  """
+  A lookup of logs by id, which only loads each cached log from the cache when it's accessed
+  """
+  def __init__(self, logs_cache, cached_log_ids, fetched_logs):
+    self.logs_cache = logs_cache
+    self.cached_log_ids = set(cached_log_ids) - fetched_logs.keys()
+    self.fetched_logs = fetched_logs
+
+  def __getitem__(self, id):
+    if id in self.fetched_logs:
+      return self.fetched_logs[id]
+    if id not in self.cached_log_ids:
+      raise KeyError(id)
+    return self.logs_cache.load(id)
+
+  def __contains__(self, id):
+    return id in self.fetched_logs or id in self.cached_log_ids
+
+  def __iter__(self):
+    return itertools.chain(self.cached_log_ids, self.fetched_logs)
+
+  def __len__(self):
+    return len(self.cached_log_ids) + len(self.fetched_logs)
+
+  def rawItems(self):
+    """
+    Yields each (log id, log), where cached logs are left as undecoded json text
+    """
+    for id in self.cached_log_ids:
+      yield id, self.logs_cache.loadRaw(id)
+    yield from self.fetched_logs.items()
 
 class LogsClient:
-  def __init__(self, logs_cache_dir):
-    self.logs_cache_dir = logs_cache_dir + '/'
-    self.throttler = BaseThrottler(name='base-throttler', delay=0.2)
-    self.throttler.start()
+  def __init__(self, logs_cache, projection=None, logs_fetcher=None, metadata_store=None):
+    """
+    {logs_cache} stores the fetched logs between runs (see logcache.DirectoryLogCache & logcache.SegmentLogCache).
+    If there's a {projection} (e.g. tf2stats.LOG_PROJECTION), only those fields of each log are cached & returned.
+    {metadata_store} (a logmetadata.LogMetadataStore) stores each uploader's list of logs between runs
+    """
+    self.logs_cache = logs_cache
+    self.projection = projection
+    self.projection_id = getProjectionId(projection)
+    self.logs_fetcher = logs_fetcher if logs_fetcher else AsyncLogsFetcher(logs_cache, projection)
+    self.metadata_store = metadata_store if metadata_store else LogMetadataStore(':memory:')
+
+  def planFetch(self, log_metadata):
+    """
+    Decides which logs need to be fetched using only the cache's manifest, without loading any cached logs
+    """
+    cached_log_ids, unprojected_log_ids, stale_log_ids, missing_log_ids = [], [], [], []
+    for log in log_metadata:
+      manifest_entry = self.logs_cache.getManifestEntry(log[u'id'])
+      if manifest_entry == None:
+        missing_log_ids.append(log[u'id'])
+      elif manifest_entry.date < log[u'date']: # the log was re-uploaded after it was cached
+        stale_log_ids.append(log[u'id'])
+      elif manifest_entry.projection_id == self.projection_id:
+        cached_log_ids.append(log[u'id'])
+      elif manifest_entry.projection_id == FULL_LOG_PROJECTION_ID: # the whole log was cached, so it can be projected without re-fetching it
+        unprojected_log_ids.append(log[u'id'])
+      else: # the log was cached without some of the fields that are needed now
+        stale_log_ids.append(log[u'id'])
+
+    return FetchPlan(cached_log_ids, unprojected_log_ids, stale_log_ids, missing_log_ids)
 
   def fetchLogs(self, log_metadata):
-    log_metadata_lookup = { log[u'id']: log for log in log_metadata }
-    
-    # fetch cached log data
-    if not os.path.isdir(self.logs_cache_dir):
-      os.makedirs(self.logs_cache_dir)
-    
-    cache_filepaths = { id: self.getLogFilepath(id) for id in log_metadata_lookup }
-    existing_logs = { id: loadJson(filepath) for id, filepath in cache_filepaths.items() if os.path.isfile(filepath) }
-
-    updated_log_ids = [id for id, log in existing_logs.items() if log[u'info'][u'date'] < log_metadata_lookup[id][u'date']]
-
-    # fetch any new uncached logs or logs that need to be updated
-    fetched_log_ids = [id for id in log_metadata_lookup if (id not in existing_logs or id in updated_log_ids)]
-    fetched_logs = {}
-    if len(fetched_log_ids) > 0:
-      reqs = [requests.Request('GET', 'http://logs.tf/api/v1/log/' + str(id)) for id in fetched_log_ids]
-
-      throttled_requests = self.throttler.multi_submit(reqs)
-
-      fetched_logs = { getLogIdFromUrl(tr.request.url): tr.response.json() for tr in throttled_requests }
-
-      # update cache
-      for id, log_json in fetched_logs.items():
-        saveJson(self.getLogFilepath(id), log_json)
-    
-    # return merged cached & new results, preferring the new results if any conflicts
-    return { **existing_logs, **fetched_logs }
-
-  def getUploaderLogMetadata(self, uploaderId):
-    return self.throttler.submit(requests.Request('GET', 'http://logs.tf/api/v1/log?uploader=' + uploaderId + '&limit=10000')).response.json()
-
-  def getLogFilepath(self, id):
-    return self.logs_cache_dir + str(id) + '.json'
-  
+    """
+    Fetches any uncached or stale logs, returning a lookup of every log by id. Every log (including the fetched ones,
+    which are cached as they arrive) is only loaded from the cache when it's accessed, so memory doesn't grow with the
+    number of logs
+    """
+    fetch_plan = self.planFetch(log_metadata)
+    METRICS.increment('logs_cache.hits', len(fetch_plan.cached_log_ids) + len(fetch_plan.unprojected_log_ids))
+    METRICS.increment('logs_cache.reprojected', len(fetch_plan.unprojected_log_ids))
+    METRICS.increment('logs_cache.stale_refreshes', len(fetch_plan.stale_log_ids))
+    METRICS.increment('logs_cache.misses', len(fetch_plan.missing_log_ids))
+
+    # shrink any fully cached logs down to the projection
+    for id in fetch_plan.unprojected_log_ids:
+      self.logs_cache.save(id, projectJson(self.logs_cache.load(id), self.projection), self.projection_id)
+    self.logs_cache.flush()
+
+    # fetch any new uncached logs or logs that need to be updated (which are cached as they arrive)
+    fetched_log_ids = list(self.logs_fetcher.fetchLogs(fetch_plan.stale_log_ids + fetch_plan.missing_log_ids, keep_logs=False))
+
+    return LazyLogs(self.logs_cache, fetch_plan.cached_log_ids + fetch_plan.unprojected_log_ids + fetched_log_ids, {})
+
+  def syncUploaderLogMetadata(self, uploader_ids, force_full_sync=False):
+    """
+    Fetches the metadata of the logs each of {uploader_ids} has uploaded since they were last synced, along with their most
+    recent known logs (in case any were re-uploaded), or all of their logs if they've never been synced or {force_full_sync}.
+    Returns the metadata of all of their logs without duplicates
+    """
+    known_log_ids_by_uploader = { uploader_id: set() if force_full_sync else self.metadata_store.getUploaderLogIds(uploader_id) for uploader_id in uploader_ids }
+    listed_log_metadata = self.logs_fetcher.fetchLogMetadataSince(known_log_ids_by_uploader)
+    for uploader_id, (listed_logs, is_full_list) in listed_log_metadata.items():
+      METRICS.increment('log_metadata.new_logs', sum(1 for log in listed_logs if log[u'id'] not in known_log_ids_by_uploader[uploader_id]))
+      # a full list also drops any logs that were deleted since the last sync
+      self.metadata_store.saveUploaderLogs(uploader_id, listed_logs, replace=force_full_sync and is_full_list)
+    self.metadata_store.commit()
+
+    return self.loadUploaderLogMetadata(uploader_ids)
+
+  def loadUploaderLogMetadata(self, uploader_ids):
+    """
+    Returns the stored metadata of the logs of all of {uploader_ids} without duplicates, as of the last time they were synced
+    """
+    return { u'logs': self.metadata_store.loadLogMetadata(uploader_ids) }
+
+  def getUploaderLogMetadata(self, uploader_id, force_full_sync=False):
+    return self.syncUploaderLogMetadata([uploader_id], force_full_sync)
+
   def close(self):
-    self.throttler.shutdown()
+    self.logs_cache.close()
+    self.metadata_store.close()
 
 TF2_DAY_END = 16 # include any late-night games from the previous day by ending days at noon EST
 SECONDS_PER_DAY = 24 * 60 * 60
+DAYS_PER_WEEK = 7
 class TimeBounds:
   def __init__(self, start, end):
     self.start = start
@@ -86,3 +188,43 @@ class TimeBounds:
     start = datetime.datetime(year, month, 1, TF2_DAY_END, tzinfo=datetime.timezone.utc).timestamp()
     end = datetime.datetime(year + floor(month / 12), (month % 12) + 1, 1, TF2_DAY_END, tzinfo=datetime.timezone.utc).timestamp()
     return TimeBounds(start, end)
+
+  @staticmethod
+  def forMonths(first_year, first_month, last_year, last_month):
+    return TimeBounds(TimeBounds.forMonth(first_year, first_month).start, TimeBounds.forMonth(last_year, last_month).end)
+
+  @staticmethod
+  def forWeek(year, month, day):
+    """
+    The week starting on the given day
+    """
+    start = TimeBounds.forDay(year, month, day).start
+    return TimeBounds(start, start + DAYS_PER_WEEK * SECONDS_PER_DAY)
+
+  @staticmethod
+  def forLastDays(num_days, date):
+    """
+    The {num_days} days up to & including the day of {date}
+    """
+    end = TimeBounds.forDay(*getDayOfDate(date)).end
+    return TimeBounds(end - num_days * SECONDS_PER_DAY, end)
+
+  def isMonthAligned(self):
+    """
+    Whether the bounds start & end on month boundaries (see forMonth)
+    """
+    return all(TimeBounds.forMonth(*getMonthOfDate(date)).start == date for date in [self.start, self.end])
+
+def getDayOfDate(date):
+  """
+  Returns the (year, month, day) whose TimeBounds.forDay contains {date}
+  """
+  day_time = datetime.datetime.fromtimestamp(date, datetime.timezone.utc) - datetime.timedelta(hours=TF2_DAY_END)
+  return day_time.year, day_time.month, day_time.day
+
+def getMonthOfDate(date):
+  """
+  Returns the (year, month) whose TimeBounds.forMonth contains {date}. A date on the boundary between two months is in the later one
+  """
+  month_time = datetime.datetime.fromtimestamp(date, datetime.timezone.utc) - datetime.timedelta(hours=TF2_DAY_END)
+  return month_time.year, month_time.month
\ No newline at end of file
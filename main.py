@@ -1,26 +1,47 @@
+import argparse
+from collections.abc import Mapping
+import concurrent.futures
 import datetime
+import hashlib
 import itertools
+import json
 import operator
+import sys
+import time
+import traceback
 
 import googledocs
+import logcache
+import logmetadata
 import logstf
 import tf2stats
 from consts import GameResult, Team, ClassType, SIXES_COMBAT_CLASSES
+from instrumentation import METRICS, PROFILER
 
-def createAliasLookup(spreadsheet, worksheet_name, logs_client):
-  aliases = googledocs.readAllCells(spreadsheet, worksheet_name)
-  
+KEY_WORKSHEET_NAME = 'Key'
+CONFIGURATION_WORKSHEET_NAME = 'Configuration'
+
+def parseAliasLookup(aliases):
   assert len(aliases) > 0
 
   aliases = aliases[1:] # skip the header row
   return { id_and_name[1]: id_and_name[0] for id_and_name in aliases }
 
-def fetchConfiguration(spreadsheet, worksheet_name):
-  config_def = googledocs.readAllCells(spreadsheet, worksheet_name)
-  
+def parseConfiguration(config_def):
   config_def = config_def[1:] # skip the header row
   return { row[0]: row[1] for row in config_def } # the first column is the config key and the second is the value
 
+def readSettings(sheets_planner):
+  """
+  Returns the alias lookup & config from the Key & Configuration worksheets, which are read in a single call
+  """
+  all_cells = sheets_planner.pacer.call(googledocs.readAllCellsOfWorksheets, sheets_planner.spreadsheet, [KEY_WORKSHEET_NAME, CONFIGURATION_WORKSHEET_NAME])
+  return parseAliasLookup(all_cells[KEY_WORKSHEET_NAME]), parseConfiguration(all_cells[CONFIGURATION_WORKSHEET_NAME])
+
+# part of each window's fingerprint, so bump it whenever generateWorksheetData (or the rows, columns or formatting it
+# lays out) changes, to rewrite every window's worksheet on the next run
+WORKSHEET_LAYOUT_VERSION = 2
+
 def formatNoneNumber(num):
   return str(round(num,  2)) if num != None else ''
 
@@ -28,7 +49,15 @@ def formatIndividualPlayerStat(alias, log_id, data):
   return ('=HYPERLINK("https://logs.tf/%s", "%s, %s")') % (str(log_id), alias, formatNoneNumber(data))
 
 def generateSummaryData(alias_lookup, stats_summary):
-  return [[stat.name + ':'] + [formatIndividualPlayerStat(alias_lookup.get(winner_steam_id, winner_steam_id), winner.log_id, winner.value) for winner_steam_id, winner in stat.winners] for stat in stats_summary.stats]
+  # each max stat is a row of its (earliest) ties, followed by how many more there are
+  max_stat_data = [
+    [stat.name + ':'] + [formatIndividualPlayerStat(alias_lookup.get(winner_steam_id, winner_steam_id), winner.log_id, winner.value) for winner_steam_id, winner in stat.winners]
+    + (['+%d more' % (stat.num_winners - len(stat.winners))] if stat.num_winners > len(stat.winners) else [])
+    for stat in stats_summary.stats
+  ]
+  # each leaderboard is a row of its entries, best first
+  leaderboard_data = [[leaderboard.name + ':'] + [formatIndividualPlayerStat(alias_lookup.get(steam_id, steam_id), entry.log_id, entry.value) for steam_id, entry in leaderboard.entries] for leaderboard in stats_summary.leaderboards]
+  return max_stat_data + [[]] + leaderboard_data
 
 def concatDataHorizontally(data1, data2):
   """
@@ -73,12 +102,27 @@ def generateSpreadsheetRow(player_aggregated_stats):
       str(round(player_aggregated_stats.win_rate * 100, 2)) + '%' if player_aggregated_stats.win_rate != None else ''
     ]
   per_class_dpm = [formatNoneNumber(player_aggregated_stats.per_class_dpm[class_type]) for class_type in SIXES_COMBAT_CLASSES]
+  quantiles = [
+    formatNoneNumber(quantiles.get(fraction))
+    for quantiles in [player_aggregated_stats.dpm_quantiles, player_aggregated_stats.hpm_quantiles]
+    for name, fraction in tf2stats.PLAYER_QUANTILE_DEFS
+  ]
+  per_class_quantiles = [
+    formatNoneNumber(player_aggregated_stats.per_class_dpm_quantiles.get(class_type, {}).get(fraction))
+    for class_type in SIXES_COMBAT_CLASSES
+    for name, fraction in tf2stats.PLAYER_QUANTILE_DEFS
+  ]
 
-  return core_stats + per_class_dpm
+  return core_stats + per_class_dpm + quantiles + per_class_quantiles
 
-def updateSpreadsheet(spreadsheet, worksheet_name, alias_lookup, stats_summary):
+def generateWorksheetData(alias_lookup, stats_summary):
+  """
+  Returns the grid of cells for a window's worksheet, and how many of its columns are player stats
+  """
   spreadsheet_data_header = ["Player", "Games Played", "Average DPM", "Average HRPM (combat)", "Average HPM", "Win Rate"]
   per_class_header = ['Average ' + class_type.value[0].upper() + class_type.value[1:] + ' DPM' for class_type in SIXES_COMBAT_CLASSES]
+  quantile_header = [name + ' ' + stat_name for stat_name in ['DPM', 'HPM'] for name, fraction in tf2stats.PLAYER_QUANTILE_DEFS]
+  per_class_quantile_header = [name + ' ' + class_type.value[0].upper() + class_type.value[1:] + ' DPM' for class_type in SIXES_COMBAT_CLASSES for name, fraction in tf2stats.PLAYER_QUANTILE_DEFS]
 
   spreadsheet_data = [
     [alias_lookup.get(steam_id, steam_id)] + generateSpreadsheetRow(stats)
@@ -87,77 +131,506 @@ def updateSpreadsheet(spreadsheet, worksheet_name, alias_lookup, stats_summary):
   ]
   sorted_spreadsheet_data = sorted(spreadsheet_data, key=(lambda row: row[0].lower()))
 
-  player_stat_data = [spreadsheet_data_header + per_class_header] + sorted_spreadsheet_data
-  NUM_CORE_PLAYER_STAT_COLS = 6
+  player_stat_data = [spreadsheet_data_header + per_class_header + quantile_header + per_class_quantile_header] + sorted_spreadsheet_data
   num_player_stat_cols = max([len(row) for row in player_stat_data])
 
   max_stat_data = [[]] + [[''] + row for row in generateSummaryData(alias_lookup, stats_summary)] # add 1 row & column of padding
-  data = concatDataHorizontally(player_stat_data, max_stat_data)
+  return concatDataHorizontally(player_stat_data, max_stat_data), num_player_stat_cols
 
-  googledocs.writeToWorksheetOverwriting(spreadsheet, worksheet_name, data)
-  googledocs.formatWorksheet(spreadsheet, worksheet_name, data, num_player_stat_cols, NUM_CORE_PLAYER_STAT_COLS)
+NUM_CORE_PLAYER_STAT_COLS = 6
+# the HPM quantiles come after the per-class average DPMs & the DPM quantiles, and are the only auxiliary stats that aren't DPM
+HPM_QUANTILE_COLS = [NUM_CORE_PLAYER_STAT_COLS + len(SIXES_COMBAT_CLASSES) + len(tf2stats.PLAYER_QUANTILE_DEFS) + i for i in range(len(tf2stats.PLAYER_QUANTILE_DEFS))]
 
-def updateStatsForTimebound(logs_client, log_metadata, ignored_team_member_ids, ignored_log_ids, spreadsheet, alias_lookup, worksheet_name, timebound):
-  print("Processing stats for " + worksheet_name)
+def updateSpreadsheet(sheets_planner, worksheet_name, alias_lookup, stats_summary):
+  data, num_player_stat_cols = generateWorksheetData(alias_lookup, stats_summary)
+  num_changed_cells = sheets_planner.planWorksheetWrite(worksheet_name, data, num_player_stat_cols, NUM_CORE_PLAYER_STAT_COLS, HPM_QUANTILE_COLS)
+  print("\t%d cells changed" % num_changed_cells)
 
-  filtered_log_metadata = [log for log in log_metadata[u'logs'] if log[u'id'] not in ignored_log_ids]
-  filtered_log_metadata_in_timebound = logstf.filterLogMetadataInTimeRange(filtered_log_metadata, timebound)
-  logs = logs_client.fetchLogs(filtered_log_metadata_in_timebound)
+def generatePlayerHistoryData(history):
+  """
+  Returns the grid of cells for a player's history worksheet: one row per game in {history} (see StatsStore.loadPlayerHistory)
+  """
+  header = ["Log", "Date", "Class", "Team", "Result", "Playtime (minutes)", "DPM", "HPM", "Kills", "Airshots"]
+  return [header] + [
+    [
+      '=HYPERLINK("https://logs.tf/%d", "%d")' % (entry.log_id, entry.log_id),
+      datetime.datetime.fromtimestamp(entry.date).strftime('%Y-%m-%d'),
+      entry.class_type.value[0].upper() + entry.class_type.value[1:],
+      entry.team.value,
+      entry.game_result.value,
+      formatNoneNumber(entry.stat_values['total_playtime_in_seconds'] / 60),
+      formatNoneNumber(entry.stat_values['average_dpm']),
+      formatNoneNumber(entry.stat_values['average_hpm']),
+      entry.stat_values['kills'],
+      entry.stat_values['airshots'],
+    ]
+    for entry in history
+  ]
 
-  print("\tDone fetching logs")
+PLAYER_HISTORY_DPM_COL = 6
+PLAYER_HISTORY_HPM_COL = 7
 
-  all_game_stats = [tf2stats.SingleGameStats(id, log) for id, log in logs.items()]
-  non_scrim_stats = [game_stats for game_stats in all_game_stats if not game_stats.is_scrim(ignored_team_member_ids, 4)]
-  stats_summary = tf2stats.AggregatedStats(non_scrim_stats, alias_lookup.keys())
+def updatePlayerHistories(stats_store, sheets_planner, alias_lookup, steam_ids, ignored_log_ids):
+  """
+  Plans writing the history of every game each of {steam_ids} played to their own worksheet
+  """
+  for steam_id in steam_ids:
+    with METRICS.stage('player_history'):
+      history = [entry for entry in stats_store.loadPlayerHistory(steam_id) if entry.log_id not in ignored_log_ids]
+    if len(history) == 0:
+      continue
+
+    worksheet_name = 'History - ' + alias_lookup.get(steam_id, steam_id)
+    data = generatePlayerHistoryData(history)
+    num_changed_cells = sheets_planner.planFormattedWorksheetWrite(
+      worksheet_name, data, lambda worksheet: googledocs.createFormatHistoryWorksheetRequests(worksheet, data, PLAYER_HISTORY_DPM_COL, PLAYER_HISTORY_HPM_COL)
+    )
+    print("Planned the history of %s: %d cells changed" % (alias_lookup.get(steam_id, steam_id), num_changed_cells))
+
+def getMonthKey(year, month):
+  return '%04d-%02d' % (year, month)
+
+def getDayKey(year, month, day):
+  return '%04d-%02d-%02d' % (year, month, day)
+
+def getBucketTimeBounds(bucket_key):
+  """
+  Returns the TimeBounds of a month or day key
+  """
+  date_parts = [int(part) for part in bucket_key.split('-')]
+  return logstf.TimeBounds.forDay(*date_parts) if len(date_parts) == 3 else logstf.TimeBounds.forMonth(*date_parts)
 
-  print("\tDone calculating aggregated stats")
-  
-  if stats_summary.hasStats():
-    updateSpreadsheet(spreadsheet, worksheet_name, alias_lookup, stats_summary)
-  
-  print("\tDone updating spreadsheet")
+def getBucketKeys(timebound):
+  """
+  Returns the keys of the months that {timebound} spans if it starts & ends on month boundaries, otherwise the keys of its days
+  """
+  if timebound.isMonthAligned():
+    first_year, first_month = logstf.getMonthOfDate(timebound.start)
+    last_year, last_month = logstf.getMonthOfDate(timebound.end - 1)
+    return [
+      getMonthKey(year, month)
+      for year in range(first_year, last_year + 1)
+      for month in range(1, 13)
+      if (year, month) >= (first_year, first_month) and (year, month) <= (last_year, last_month)
+    ]
 
-def splitAndCleanCSV(stringData):
-  return [s.strip() for s in stringData.split(',')]
+  num_days = round((timebound.end - timebound.start) / logstf.SECONDS_PER_DAY)
+  return [getDayKey(*logstf.getDayOfDate(timebound.start + day * logstf.SECONDS_PER_DAY)) for day in range(num_days)]
 
-TOKEN_FILEPATH = './google_docs_token.json'
-CREDENTIALS_FILEPATH = './google_docs_credentials.json'
-SCOPES = 'https://www.googleapis.com/auth/spreadsheets'
-LOGS_CACHE_DIR = '.logs'
+class StatsWindow:
+  """
+  A named time range whose stats are written to their own worksheet, merged from the stored stats of each month (or
+  each day, for windows like weeks that don't start & end on month boundaries) that it spans
+  """
+  def __init__(self, worksheet_name, timebound):
+    self.worksheet_name = worksheet_name
+    self.timebound = timebound
+    self.bucket_keys = getBucketKeys(timebound)
+    self.sliding_accumulator = None
+
+  def aggregate(self, bucket_accumulators, tracked_player_steam_ids, changed_bucket_keys=None):
+    """
+    Merges the accumulators of the window's buckets (from {bucket_accumulators}) into one. If it's known which buckets
+    changed since the window was last aggregated ({changed_bucket_keys}, e.g. in watch mode), see aggregateIncrementally
+    """
+    if changed_bucket_keys != None:
+      return self.aggregateIncrementally(bucket_accumulators, tracked_player_steam_ids, changed_bucket_keys)
+
+    window_accumulator = tf2stats.AggregatedStatsAccumulator(tracked_player_steam_ids)
+    for bucket_key in self.bucket_keys:
+      if bucket_key in bucket_accumulators:
+        window_accumulator.merge(bucket_accumulators[bucket_key])
+    return window_accumulator
+
+  def aggregateIncrementally(self, bucket_accumulators, tracked_player_steam_ids, changed_bucket_keys):
+    """
+    Keeps the window's merged stats in a SlidingWindowAccumulator between calls, so only the buckets that changed or
+    entered the window since the last call need to be merged again
+    """
+    if self.sliding_accumulator == None or self.sliding_accumulator.tracked_player_steam_ids != set(tracked_player_steam_ids):
+      self.sliding_accumulator = tf2stats.SlidingWindowAccumulator(tracked_player_steam_ids)
+    self.sliding_accumulator.slideTo({ bucket_key: bucket_accumulators[bucket_key] for bucket_key in self.bucket_keys if bucket_key in bucket_accumulators }, changed_bucket_keys)
+    return self.sliding_accumulator.toAccumulator()
+
+class RollingStatsWindow(StatsWindow):
+  """
+  The last {num_days} days up to & including the day of {date}. Its stats are always kept in a SlidingWindowAccumulator,
+  so moving the window on to a later date (see slideTo) only merges the days that entered or left it
+  """
+  def __init__(self, worksheet_name, num_days, date):
+    super().__init__(worksheet_name, logstf.TimeBounds.forLastDays(num_days, date))
+    self.num_days = num_days
 
-CONFIG_KEY_UPLOADER_ID = 'uploaderId'
-CONFIG_KEY_IGNORED_TEAM_IDS = 'ignoredTeamSteamIds'
-CONFIG_KEY_IGNORED_LOG_IDS = 'ignoredLogIds'
-CONFIG_KEY_START_MONTH = 'startMonth'
-CONFIG_KEY_START_YEAR = 'startYear'
+  def slideTo(self, date):
+    self.timebound = logstf.TimeBounds.forLastDays(self.num_days, date)
+    self.bucket_keys = getBucketKeys(self.timebound)
 
-SPREADSHEET_ID = '1dcWoKRfR6-Y5uPgL3p7387p8uqnObgyTNVYlYdqz8xM'
+  def aggregate(self, bucket_accumulators, tracked_player_steam_ids, changed_bucket_keys=None):
+    return self.aggregateIncrementally(bucket_accumulators, tracked_player_steam_ids, changed_bucket_keys if changed_bucket_keys != None else ())
 
-if __name__ == '__main__':
-  spreadsheet = googledocs.openSpreadsheet(TOKEN_FILEPATH, CREDENTIALS_FILEPATH, SCOPES, SPREADSHEET_ID)
-  logs_client = logstf.LogsClient(LOGS_CACHE_DIR)
-  alias_lookup = createAliasLookup(spreadsheet, 'Key', logs_client)
-  config = fetchConfiguration(spreadsheet, 'Configuration')
-  
-  # extract config values
-  uploader_id = config[CONFIG_KEY_UPLOADER_ID]
-  ignored_team_member_ids = splitAndCleanCSV(config[CONFIG_KEY_IGNORED_TEAM_IDS])
-  ignored_log_ids = [int(log_id) for log_id in splitAndCleanCSV(config[CONFIG_KEY_IGNORED_LOG_IDS])]
-  pug_start_month = int(config[CONFIG_KEY_START_MONTH])
-  pug_start_year = int(config[CONFIG_KEY_START_YEAR])
+def mergeWindows(windows, bucket_accumulators, tracked_player_steam_ids):
+  """
+  Merges each (bucket key, accumulator) from {bucket_accumulators} (in key order, e.g. from tf2stats.iterMonthlyAccumulators)
+  into every window it's in, yielding each window & its merged accumulator as soon as its last bucket has been merged. Only
+  the windows still being merged are held in memory, so a long history of months doesn't all need to be loaded at once
+  """
+  windows = sorted(windows, key=lambda window: max(window.bucket_keys, default=''))
+  window_bucket_keys = [set(window.bucket_keys) for window in windows]
+  window_accumulators = [None for window in windows]
+  num_merged_windows = 0
+
+  def popMergedWindow():
+    nonlocal num_merged_windows
+    window_accumulator = window_accumulators[num_merged_windows]
+    window_accumulators[num_merged_windows] = None
+    num_merged_windows += 1
+    return windows[num_merged_windows - 1], window_accumulator if window_accumulator != None else tf2stats.AggregatedStatsAccumulator(tracked_player_steam_ids)
+
+  for bucket_key, bucket_accumulator in bucket_accumulators:
+    # a window only has month keys or day keys, whose keys sort in time order
+    while num_merged_windows < len(windows) and max(windows[num_merged_windows].bucket_keys, default='') < bucket_key:
+      yield popMergedWindow()
+
+    for i in range(num_merged_windows, len(windows)):
+      if bucket_key in window_bucket_keys[i]:
+        if window_accumulators[i] == None:
+          window_accumulators[i] = tf2stats.AggregatedStatsAccumulator(tracked_player_steam_ids)
+        window_accumulators[i].merge(bucket_accumulator)
+
+  while num_merged_windows < len(windows):
+    yield popMergedWindow()
+
+class WatchState:
+  """
+  What watch mode keeps in memory between updates: the accumulator of each month (or day) & the revisions of its logs,
+  every log's tags, and the windows themselves (which keep their merged stats, see StatsWindow.aggregateIncrementally)
+  """
+  def __init__(self):
+    self.cached_accumulators = {} # see tf2stats.iterMonthlyAccumulators
+    self.bucket_log_revisions = {}
+    self.all_log_tags = None
+    self.windows = {}
+
+  def reuseWindows(self, windows, date):
+    """
+    Swaps each of {windows} for the same window from the last update (slid on to {date} if it's a rolling window), so
+    that its merged stats are kept
+    """
+    reused_windows = []
+    for window in windows:
+      previous_window = self.windows.get(window.worksheet_name)
+      if isinstance(window, RollingStatsWindow) and isinstance(previous_window, RollingStatsWindow) and previous_window.num_days == window.num_days:
+        previous_window.slideTo(date)
+        window = previous_window
+      elif previous_window != None and type(previous_window) == type(window) and previous_window.bucket_keys == window.bucket_keys:
+        window = previous_window
+      reused_windows.append(window)
+
+    self.windows = { window.worksheet_name: window for window in reused_windows }
+    return reused_windows
+
+def isInBuckets(date, bucket_keys):
+  """
+  Whether {date} is in any of the months or days in {bucket_keys}
+  """
+  return getMonthKey(*logstf.getMonthOfDate(date)) in bucket_keys or getDayKey(*logstf.getDayOfDate(date)) in bucket_keys
+
+class BucketLogRevisions(Mapping):
+  """
+  {bucket key: {log id: log revision}} for every month or day in {bucket_keys} that has any logs in {log_index} (a
+  logstf.LogMetadataIndex), where a log's revision is its date & its tags (or None if it hasn't been tagged yet). A
+  bucket's revisions are only worked out when it's looked up, with its logs' tags from {all_log_tags} (if given) or else
+  loaded from {stats_store}, so going through the buckets only holds one bucket's logs at a time
+  """
+  def __init__(self, log_index, bucket_keys, stats_store, all_log_tags=None):
+    self.log_index = log_index
+    self.stats_store = stats_store
+    self.all_log_tags = all_log_tags
+    self.bucket_keys = { bucket_key: None for bucket_key in sorted(set(bucket_keys)) if len(log_index.getLogsInTimeRange(getBucketTimeBounds(bucket_key))) > 0 }
+
+  def __getitem__(self, bucket_key):
+    if bucket_key not in self.bucket_keys:
+      raise KeyError(bucket_key)
+    bucket_logs = self.log_index.getLogsInTimeRange(getBucketTimeBounds(bucket_key))
+    log_tags = self.all_log_tags if self.all_log_tags != None else self.stats_store.loadLogTags([log[u'id'] for log in bucket_logs])
+    return { log[u'id']: [log[u'date']] + (log_tags[log[u'id']].getRevision() if log[u'id'] in log_tags else [None]) for log in bucket_logs }
+
+  def __contains__(self, bucket_key):
+    return bucket_key in self.bucket_keys
+
+  def __iter__(self):
+    return iter(self.bucket_keys)
+
+  def __len__(self):
+    return len(self.bucket_keys)
 
-  log_metadata = logs_client.getUploaderLogMetadata(config[CONFIG_KEY_UPLOADER_ID])
+def calcBucketFingerprint(log_revisions):
+  """
+  Identifies the logs of a month or day ({log id: log revision}) & how they're tagged
+  """
+  return hashlib.sha1(json.dumps(sorted(log_revisions.items())).encode('utf-8')).hexdigest()
+
+def calcWindowFingerprint(bucket_fingerprints, alias_lookup):
+  """
+  Identifies everything that a window's worksheet is generated from: its logs (& when they were uploaded) & how they're
+  tagged, from the calcBucketFingerprint of each of its months or days ([(bucket key, fingerprint)]), the aliases, and
+  the versions of the code that extracts, tags & aggregates the stats and of the worksheet layout. The worksheet only
+  needs to be rewritten when this changes. A change to the ignored team members or logs only changes the tags of the
+  logs it affects, so only the windows that contain one of those logs change
+  """
+  fingerprint = [
+    bucket_fingerprints,
+    sorted(alias_lookup.items()),
+    tf2stats.STAT_DEFINITIONS_VERSION,
+    tf2stats.LOG_TAGS_VERSION,
+    tf2stats.AGGREGATION_VERSION,
+    WORKSHEET_LAYOUT_VERSION,
+  ]
+  return hashlib.sha1(json.dumps(fingerprint).encode('utf-8')).hexdigest()
 
-  today = datetime.datetime.today()
+class WindowsUpdate:
+  """
+  The steps of updating a spreadsheet's windows: prepare finds the windows that changed & the logs they need that haven't
+  been parsed yet, ingestLogs passes each of those logs to ingestStatRecord (which stores & tags it) as it's parsed, and
+  write merges & writes the changed windows. updateStatsForWindows runs them for one spreadsheet (see runUpdate), and
+  updateGroups runs them for several, sharing the fetching & parsing of their logs
+  """
+  def __init__(self, stats_store, log_metadata, ignored_team_member_ids, ignored_log_ids, sheets_planner, alias_lookup, windows, watch_state=None):
+    self.stats_store = stats_store
+    self.log_metadata = log_metadata
+    self.tags_config = tf2stats.LogTagsConfig(ignored_team_member_ids, ignored_log_ids)
+    self.sheets_planner = sheets_planner
+    self.alias_lookup = alias_lookup
+    self.windows = windows
+    self.watch_state = watch_state
+    self.all_log_tags = None # only kept in watch mode, otherwise each month's (or day's) tags are loaded from the store with it
+    self.log_index = None
+    self.window_bucket_keys = None
+    self.parsed_log_tags = [] # of the logs ingested since the last finishIngest
+
+  def calcWindowFingerprints(self, windows):
+    bucket_log_revisions = BucketLogRevisions(self.log_index, (bucket_key for window in windows for bucket_key in window.bucket_keys), self.stats_store, self.all_log_tags)
+    bucket_fingerprints = { bucket_key: calcBucketFingerprint(bucket_log_revisions[bucket_key]) for bucket_key in bucket_log_revisions }
+    return {
+      window.worksheet_name: calcWindowFingerprint([(bucket_key, bucket_fingerprints[bucket_key]) for bucket_key in window.bucket_keys if bucket_key in bucket_fingerprints], self.alias_lookup)
+      for window in windows
+    }
+
+  def prepare(self):
+    """
+    Re-tags any stored logs that the config change affects, then finds the windows that changed. Returns whether any window changed
+    """
+    with METRICS.stage('tag_logs'):
+      retagged_log_ids = tf2stats.updateLogTags(self.stats_store, self.tags_config)
+      METRICS.increment('logs.retagged', len(retagged_log_ids))
+      if self.watch_state != None:
+        if self.watch_state.all_log_tags == None:
+          self.watch_state.all_log_tags = self.stats_store.loadLogTags()
+        else:
+          self.watch_state.all_log_tags.update(self.stats_store.loadLogTags(retagged_log_ids))
+        self.all_log_tags = self.watch_state.all_log_tags
+
+    with METRICS.stage('filter_metadata'):
+      # ignored logs are kept, since their tags leave them out of the stats
+      self.log_index = logstf.LogMetadataIndex(self.log_metadata[u'logs'])
+
+    with METRICS.stage('check_fingerprints'):
+      stored_fingerprints = self.stats_store.loadWindowFingerprints()
+      window_fingerprints = self.calcWindowFingerprints(self.windows)
+      def isWindowUnchanged(window):
+        if window.worksheet_name not in stored_fingerprints:
+          return False
+        stored_fingerprint, has_worksheet = stored_fingerprints[window.worksheet_name]
+        # the worksheet also needs to be rewritten if it was deleted
+        return stored_fingerprint == window_fingerprints[window.worksheet_name] and (not has_worksheet or self.sheets_planner.worksheetExists(window.worksheet_name))
+      self.windows = [window for window in self.windows if not isWindowUnchanged(window)]
+    METRICS.increment('windows.unchanged', len(window_fingerprints) - len(self.windows))
+    METRICS.increment('windows.changed', len(self.windows))
+    if len(self.windows) == 0:
+      print("No windows have changed")
+      return False
+
+    self.window_bucket_keys = set(bucket_key for window in self.windows for bucket_key in window.bucket_keys)
+    return True
+
+  def iterUnparsedLogs(self):
+    """
+    Yields the metadata of every log in the changed windows that hasn't been parsed yet (or was re-uploaded since), oldest
+    first. The logs are checked against the store {INGEST_CHUNK_SIZE} at a time, as they're needed
+    """
+    windowed_logs = (log for log in self.log_index.logs if isInBuckets(log[u'date'], self.window_bucket_keys))
+    for logs in tf2stats.chunkLogs(windowed_logs, INGEST_CHUNK_SIZE):
+      yield from self.filterUnparsedLogs(logs)
+
+  def filterUnparsedLogs(self, logs):
+    """
+    Returns the metadata in {logs} of the logs that are in the changed windows, but haven't been parsed yet (or were
+    re-uploaded since)
+    """
+    logs = [log for log in logs if isInBuckets(log[u'date'], self.window_bucket_keys) and self.log_index.contains(log)]
+    stored_log_dates = self.stats_store.getStoredLogDates([log[u'id'] for log in logs])
+    return [log for log in logs if log[u'id'] not in stored_log_dates or stored_log_dates[log[u'id']] < log[u'date']]
+
+  def ingestStatRecord(self, log_id, log_date, game_stat_values, player_stat_values, game_stats):
+    """
+    Stores a record from tf2stats.extractStatRecords & tags its log (whose SingleGameStats is {game_stats})
+    """
+    self.stats_store.saveStatValues(log_id, log_date, game_stat_values, player_stat_values)
+    # tag each log as it's ingested, so nothing downstream needs to classify it again
+    self.parsed_log_tags.append(tf2stats.classifyLog(game_stats, self.tags_config))
+
+  def finishIngest(self):
+    self.stats_store.saveLogTags(self.parsed_log_tags)
+    self.stats_store.commit()
+    if self.all_log_tags != None:
+      self.all_log_tags.update((tags.log_id, tags) for tags in self.parsed_log_tags)
+    METRICS.increment('logs.parsed', len(self.parsed_log_tags))
+    self.parsed_log_tags = []
+
+  def write(self):
+    """
+    Merges the months (or days) of each changed window & writes its stats, with every worksheet written in one batch at the end
+    """
+    bucket_log_revisions = BucketLogRevisions(self.log_index, self.window_bucket_keys, self.stats_store, self.all_log_tags)
+    if self.watch_state != None:
+      bucket_log_revisions = dict(bucket_log_revisions) # to compare with the last update's (see below)
+    cached_accumulators = self.watch_state.cached_accumulators if self.watch_state != None else None
+    bucket_accumulators = METRICS.stageIter('update_monthly_stats', tf2stats.iterMonthlyAccumulators(self.stats_store, bucket_log_revisions, self.all_log_tags, self.alias_lookup.keys(), cached_accumulators))
+    if self.watch_state == None:
+      # stream each month (or day) through the windows it's in, so each one can be dropped as soon as it's merged
+      window_accumulators = METRICS.stageIter('merge_windows', mergeWindows(self.windows, bucket_accumulators, self.alias_lookup.keys()))
+    else:
+      # the windows kept from the last update only need to merge the buckets that changed since then
+      bucket_accumulators = dict(bucket_accumulators)
+      changed_bucket_keys = set(bucket_key for bucket_key, log_revisions in bucket_log_revisions.items() if self.watch_state.bucket_log_revisions.get(bucket_key) != log_revisions)
+      self.watch_state.bucket_log_revisions.update(bucket_log_revisions)
+      window_accumulators = ((window, window.aggregate(bucket_accumulators, self.alias_lookup.keys(), changed_bucket_keys)) for window in self.windows)
+
+    written_worksheet_names = set()
+    for window, window_accumulator in window_accumulators:
+      print("Processing stats for " + window.worksheet_name)
+
+      with METRICS.stage('window ' + window.worksheet_name):
+        with METRICS.stage('aggregate'), PROFILER.profile():
+          stats_summary = window_accumulator.toAggregatedStats()
+
+        print("\tDone calculating aggregated stats")
+
+        # a window that's left without any stats (e.g. a week with no logs) still clears the old rows off its worksheet
+        if stats_summary.hasStats() or self.sheets_planner.worksheetExists(window.worksheet_name):
+          with METRICS.stage('plan_write'):
+            updateSpreadsheet(self.sheets_planner, window.worksheet_name, self.alias_lookup, stats_summary)
+          written_worksheet_names.add(window.worksheet_name)
+
+      print("\tDone planning spreadsheet update")
+
+    print("Updating spreadsheet")
+    with METRICS.stage('write_spreadsheet'):
+      self.sheets_planner.execute()
+      window_fingerprints = self.calcWindowFingerprints(self.windows) # the newly parsed logs have been tagged since the fingerprints were checked
+      for window in self.windows:
+        self.stats_store.saveWindowFingerprint(window.worksheet_name, window_fingerprints[window.worksheet_name], window.worksheet_name in written_worksheet_names)
+      self.stats_store.commit()
+    print("\tDone updating spreadsheet")
+
+def ingestLogs(logs_client, updates):
+  """
+  Fetches & parses the logs that any of {updates} (WindowsUpdates that have been prepared) still need, passing each parsed
+  log to every update that needs it. Each log is only fetched & parsed once, however many updates need it. Logs are
+  fetched & parsed {INGEST_CHUNK_SIZE} at a time, so memory doesn't grow with the number of logs
+  """
+  for i, update in enumerate(updates):
+    for unparsed_logs in tf2stats.chunkLogs(update.iterUnparsedLogs(), INGEST_CHUNK_SIZE):
+      # the later updates get any of these logs that they need now, so they're already stored by the time it's their turn
+      log_updates = [update] + updates[i + 1:]
+      updates_by_log_id = {}
+      for log_update in log_updates:
+        for log in (unparsed_logs if log_update == update else log_update.filterUnparsedLogs(unparsed_logs)):
+          updates_by_log_id.setdefault(log[u'id'], []).append(log_update)
+
+      with METRICS.stage('fetch_logs'):
+        logs = logs_client.fetchLogs(unparsed_logs)
+
+      with METRICS.stage('parse_logs'), PROFILER.profile():
+        for log_id, log_date, game_stat_values, player_stat_values in tf2stats.extractStatRecords(logs.rawItems(), PARSE_WORKERS):
+          game_stats = tf2stats.SingleGameStats.fromStatValues(log_id, game_stat_values, player_stat_values)
+          for log_update in updates_by_log_id.get(log_id, []):
+            log_update.ingestStatRecord(log_id, log_date, game_stat_values, player_stat_values, game_stats)
+        for log_update in log_updates:
+          log_update.finishIngest()
+
+  print("\tDone fetching & parsing logs")
+
+def updateStatsForWindows(logs_client, stats_store, log_metadata, ignored_team_member_ids, ignored_log_ids, sheets_planner, alias_lookup, windows, watch_state=None):
+  """
+  Fetches and parses any logs that aren't in {stats_store} yet (tagging each one as it's parsed), folds them into the
+  stored stats of their month (or day), then merges the months (or days) of each window to write its stats (with every
+  worksheet written in one batch at the end). Logs, their stats & the months' stats are streamed through each of these
+  steps, so memory doesn't grow with the length of history.
+
+  Windows whose fingerprint (see calcWindowFingerprint) is the same as when their worksheet was last written are skipped.
+  If there's a {watch_state} (a WatchState), what it kept from the last update is reused & only the changes are applied
+  """
+  update = WindowsUpdate(stats_store, log_metadata, ignored_team_member_ids, ignored_log_ids, sheets_planner, alias_lookup, windows, watch_state)
+  if not update.prepare():
+    return
+
+  print("Fetching logs for %d changed windows" % len(update.windows))
+  ingestLogs(logs_client, [update])
+  update.write()
+
+def createWeeklyWindows(num_weeks, date):
+  """
+  Returns a window for each of the last {num_weeks} weeks (which start on Mondays) up to the week of {date}, newest first
+  """
+  year, month, day = logstf.getDayOfDate(date)
+  current_week_start = datetime.date(year, month, day) - datetime.timedelta(days=datetime.date(year, month, day).weekday())
+  week_starts = [current_week_start - datetime.timedelta(weeks=i) for i in range(num_weeks)]
+  return [StatsWindow('Week of ' + week_start.isoformat(), logstf.TimeBounds.forWeek(week_start.year, week_start.month, week_start.day)) for week_start in week_starts]
+
+def createSeasonWindows(season_start_months, first_year, first_month, last_year, last_month):
+  """
+  Returns a window for each season (which each start on one of {season_start_months} & last until the next one starts)
+  that overlaps the months from {first_month} of {first_year} to {last_month} of {last_year}
+  """
+  season_start_months = sorted(season_start_months)
+  windows = []
+  for year in range(first_year - 1, last_year + 1):
+    for i, start_month in enumerate(season_start_months):
+      next_start_month = season_start_months[(i + 1) % len(season_start_months)]
+      end_year = year if next_start_month > start_month else year + 1
+      end_year, end_month = (end_year, next_start_month - 1) if next_start_month > 1 else (end_year - 1, 12)
+      if (year, start_month) > (last_year, last_month) or (end_year, end_month) < (first_year, first_month):
+        continue
+
+      start_name, end_name = datetime.date(year, start_month, 1).strftime('%b'), datetime.date(end_year, end_month, 1).strftime('%b')
+      worksheet_name = 'Season %s-%s %d' % (start_name, end_name, year) if end_year == year else 'Season %s %d-%s %d' % (start_name, year, end_name, end_year)
+      windows.append(StatsWindow(worksheet_name, logstf.TimeBounds.forMonths(year, start_month, end_year, end_month)))
+  return windows
+
+def createRollingWindows(all_num_days, date):
+  return [RollingStatsWindow('Last %d Days' % num_days, num_days, date) for num_days in all_num_days]
+
+def splitAndCleanCSV(stringData):
+  return [s.strip() for s in stringData.split(',')]
+
+def createWindows(config, now):
+  """
+  Returns every window that the config asks for as of {now} (a timestamp): all-time, each month since the pugs started,
+  and any weekly, per-season & rolling windows
+  """
+  pug_start_month = int(config[CONFIG_KEY_START_MONTH])
+  pug_start_year = int(config[CONFIG_KEY_START_YEAR])
+  today = datetime.datetime.fromtimestamp(now)
   current_year = today.year
   current_month = today.month
 
-  # update all-time stats
+  # all-time stats
   all_time_start_time = logstf.TimeBounds.forMonth(pug_start_year, pug_start_month).start
   all_time_end_time = logstf.TimeBounds.forMonth(current_year, current_month).end
-  updateStatsForTimebound(logs_client, log_metadata, ignored_team_member_ids, ignored_log_ids, spreadsheet, alias_lookup, 'All-Time', logstf.TimeBounds(all_time_start_time, all_time_end_time))
+  windows = [StatsWindow('All-Time', logstf.TimeBounds(all_time_start_time, all_time_end_time))]
 
-  # update per-month stats
+  # per-month stats
   for year in range(pug_start_year, current_year + 1):
     for month in range(1, 13):
       if year == pug_start_year and month < pug_start_month: # skip the months in the first year when there were no pugs
@@ -165,9 +638,238 @@ if __name__ == '__main__':
       if year == current_year and month > current_month:
         break
       worksheet_name = datetime.date(year, month, 1).strftime('%B') + ' ' + str(year)
-      # don't bother updating earlier months since their stats won't have changed
-      if googledocs.worksheetExists(spreadsheet, worksheet_name) and (year != current_year or month != current_month):
-        pass # continue
-      updateStatsForTimebound(logs_client, log_metadata, ignored_team_member_ids, ignored_log_ids, spreadsheet, alias_lookup, worksheet_name, logstf.TimeBounds.forMonth(year, month))
-  
-  logs_client.close()
\ No newline at end of file
+      # months whose stats haven't changed are skipped by updateStatsForWindows
+      windows.append(StatsWindow(worksheet_name, logstf.TimeBounds.forMonth(year, month)))
+
+  # optional weekly, per-season & rolling stats
+  windows += createWeeklyWindows(int(config.get(CONFIG_KEY_NUM_WEEKLY_WINDOWS) or 0), now)
+  season_start_months = [int(month) for month in splitAndCleanCSV(config.get(CONFIG_KEY_SEASON_START_MONTHS, '')) if month != '']
+  if len(season_start_months) > 0:
+    windows += createSeasonWindows(season_start_months, pug_start_year, pug_start_month, current_year, current_month)
+  windows += createRollingWindows([int(num_days) for num_days in splitAndCleanCSV(config.get(CONFIG_KEY_ROLLING_WINDOW_DAYS, '')) if num_days != ''], now)
+  return windows
+
+def getIgnoredIds(config):
+  """
+  Returns the (ignored team member steam ids, ignored log ids) in the config
+  """
+  return splitAndCleanCSV(config[CONFIG_KEY_IGNORED_TEAM_IDS]), [int(log_id) for log_id in splitAndCleanCSV(config[CONFIG_KEY_IGNORED_LOG_IDS])]
+
+def createCurrentWindows(config, watch_state=None):
+  """
+  Returns every window that the config asks for as of now (reusing the windows kept by {watch_state}, if there is one)
+  """
+  now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+  windows = createWindows(config, now)
+  if watch_state != None:
+    windows = watch_state.reuseWindows(windows, now)
+  return windows
+
+def createWindowsUpdate(stats_store, sheets_planner, alias_lookup, config, log_metadata, watch_state=None):
+  """
+  Returns the WindowsUpdate of every window that the config asks for as of now
+  """
+  return WindowsUpdate(stats_store, log_metadata, *getIgnoredIds(config), sheets_planner, alias_lookup, createCurrentWindows(config, watch_state), watch_state)
+
+def updateConfiguredPlayerHistories(stats_store, sheets_planner, alias_lookup, config):
+  """
+  Writes the history worksheets of the players in the config's (optional) historyPlayers
+  """
+  # players whose game history gets its own worksheet, by alias or steam id
+  steam_ids_by_alias = { alias: steam_id for steam_id, alias in alias_lookup.items() }
+  history_player_ids = [steam_ids_by_alias.get(player, player) for player in splitAndCleanCSV(config.get(CONFIG_KEY_HISTORY_PLAYERS, '')) if player != '']
+  if len(history_player_ids) > 0:
+    updatePlayerHistories(stats_store, sheets_planner, alias_lookup, history_player_ids, set(getIgnoredIds(config)[1]))
+    sheets_planner.execute()
+
+def runUpdate(logs_client, stats_store, sheets_planner, alias_lookup, config, full_metadata_sync=False, watch_state=None):
+  """
+  Syncs the uploaders' logs & updates every window (and player history) that changed
+  """
+  with METRICS.stage('fetch_metadata'):
+    log_metadata = logs_client.syncUploaderLogMetadata(splitAndCleanCSV(config[CONFIG_KEY_UPLOADER_ID]), full_metadata_sync)
+
+  windows = createCurrentWindows(config, watch_state)
+  updateStatsForWindows(logs_client, stats_store, log_metadata, *getIgnoredIds(config), sheets_planner, alias_lookup, windows, watch_state)
+  updateConfiguredPlayerHistories(stats_store, sheets_planner, alias_lookup, config)
+
+class StatsGroup:
+  """
+  One pug group in a run that updates several at once (see updateGroups): its spreadsheet, and its own store of the
+  stats of its logs, since their tags, monthly stats & window fingerprints depend on the group's config
+  """
+  def __init__(self, name, sheets_planner, stats_store):
+    self.name = name
+    self.sheets_planner = sheets_planner
+    self.stats_store = stats_store
+
+def loadGroups(groups_filepath):
+  """
+  Opens the spreadsheet & stats store of every group listed in a JSON file like
+  {"groups": [{"name": "...", "spreadsheetId": "...", "statsStore": "(optional, .stats-{name}.sqlite by default)"}, ...]}
+  """
+  with open(groups_filepath) as groups_file:
+    groups_json = json.load(groups_file)
+
+  # every spreadsheet is written with the same credentials, so they all share the one per-user Sheets API quota
+  sheets_pacer = googledocs.QuotaPacer()
+  return [
+    StatsGroup(
+      group_json['name'],
+      googledocs.SheetsBatchPlanner(googledocs.openSpreadsheet(TOKEN_FILEPATH, CREDENTIALS_FILEPATH, SCOPES, group_json['spreadsheetId']), sheets_pacer),
+      tf2stats.StatsStore(group_json.get('statsStore', '.stats-%s.sqlite' % group_json['name']))
+    )
+    for group_json in groups_json['groups']
+  ]
+
+def updateGroups(logs_client, groups, full_metadata_sync=False, num_workers=None):
+  """
+  Updates the spreadsheets of several StatsGroups in one run. Every group's uploaders are synced together, each log that
+  any group needs is fetched & parsed once (through the one {logs_client}, its cache & its rate limits), and then each
+  group's settings are read & its windows & player histories are written on a pool of {num_workers} threads (one per
+  group by default), so a run takes about as long as the biggest group's instead of all of them in turn
+  """
+  num_workers = num_workers if num_workers != None else len(groups)
+  with concurrent.futures.ThreadPoolExecutor(max(1, num_workers)) as executor:
+    def forEachGroup(step, *step_args):
+      def runStep(group, *args):
+        # each group's stages are nested under its name, since groups run on their own threads
+        with METRICS.stage('group ' + group.name):
+          return step(group, *args)
+      return list(executor.map(runStep, groups, *step_args))
+
+    print("Reading the settings of %d groups" % len(groups))
+    all_settings = forEachGroup(lambda group: readSettings(group.sheets_planner))
+
+    with METRICS.stage('fetch_metadata'):
+      all_uploader_ids = [splitAndCleanCSV(config[CONFIG_KEY_UPLOADER_ID]) for alias_lookup, config in all_settings]
+      logs_client.syncUploaderLogMetadata(sorted(set(itertools.chain.from_iterable(all_uploader_ids))), full_metadata_sync)
+      updates = [
+        createWindowsUpdate(group.stats_store, group.sheets_planner, alias_lookup, config, logs_client.loadUploaderLogMetadata(uploader_ids))
+        for group, (alias_lookup, config), uploader_ids in zip(groups, all_settings, all_uploader_ids)
+      ]
+
+    changed_updates = [update for update, is_changed in zip(updates, forEachGroup(lambda group, update: update.prepare(), updates)) if is_changed]
+    if len(changed_updates) > 0:
+      print("Fetching logs for %d changed windows of %d groups" % (sum(len(update.windows) for update in changed_updates), len(changed_updates)))
+      ingestLogs(logs_client, changed_updates)
+
+    def writeGroup(group, update, settings):
+      if update in changed_updates:
+        update.write()
+      updateConfiguredPlayerHistories(group.stats_store, group.sheets_planner, *settings)
+    forEachGroup(writeGroup, updates, all_settings)
+
+WATCH_SNAPSHOT_REFRESH_INTERVAL = 60 * 60 # how often watch mode re-reads the whole spreadsheet, in case it was edited
+
+def watch(logs_client, stats_store, sheets_planner, poll_interval, full_metadata_sync=False, profile_filepath=None):
+  """
+  Keeps the spreadsheet up to date until interrupted: every {poll_interval} seconds, re-reads the Key & Configuration
+  worksheets & syncs any newly uploaded logs, then updates only the windows that changed. Everything from the last update
+  is kept in memory (see WatchState), so a new log only costs fetching & parsing that log and merging it into its windows.
+  If {full_metadata_sync}, the first update re-fetches the uploaders' full lists of logs
+  """
+  watch_state = WatchState()
+  settings = None
+  last_refresh_time = time.monotonic()
+  while True:
+    poll_start_time = time.monotonic()
+    try:
+      with METRICS.stage('read_settings'):
+        new_settings = readSettings(sheets_planner)
+      if settings != None and new_settings != settings:
+        print("The Key or Configuration changed")
+      if new_settings != settings or poll_start_time - last_refresh_time > WATCH_SNAPSHOT_REFRESH_INTERVAL:
+        sheets_planner.reset() # whoever changed the settings may have edited other worksheets too
+        last_refresh_time = poll_start_time
+      settings = new_settings
+
+      alias_lookup, config = settings
+      runUpdate(logs_client, stats_store, sheets_planner, alias_lookup, config, full_metadata_sync, watch_state)
+      full_metadata_sync = False
+    except Exception:
+      # e.g. logs.tf or the Sheets API being down, so start over from the stored stats at the next poll
+      traceback.print_exc()
+      watch_state = WatchState()
+      sheets_planner.reset()
+
+    if profile_filepath:
+      METRICS.writeReport(profile_filepath)
+    METRICS.reset() # only keep each update's metrics, so they don't grow forever
+
+    time.sleep(max(0, poll_interval - (time.monotonic() - poll_start_time)))
+
+TOKEN_FILEPATH = './google_docs_token.json'
+CREDENTIALS_FILEPATH = './google_docs_credentials.json'
+SCOPES = 'https://www.googleapis.com/auth/spreadsheets'
+LOGS_CACHE_DIR = '.logs'
+STATS_STORE_FILEPATH = '.stats.sqlite'
+LOG_METADATA_FILEPATH = '.log_metadata.sqlite'
+PARSE_WORKERS = None # one per core
+INGEST_CHUNK_SIZE = 1000 # how many logs are fetched & parsed at a time (each chunk starts its own pool of parse workers)
+
+CONFIG_KEY_UPLOADER_ID = 'uploaderId'
+CONFIG_KEY_IGNORED_TEAM_IDS = 'ignoredTeamSteamIds'
+CONFIG_KEY_IGNORED_LOG_IDS = 'ignoredLogIds'
+CONFIG_KEY_START_MONTH = 'startMonth'
+CONFIG_KEY_START_YEAR = 'startYear'
+CONFIG_KEY_HISTORY_PLAYERS = 'historyPlayers' # optional
+CONFIG_KEY_NUM_WEEKLY_WINDOWS = 'weeklyWindows' # optional, how many of the latest weeks get their own worksheet
+CONFIG_KEY_SEASON_START_MONTHS = 'seasonStartMonths' # optional, e.g. "1, 5, 9" for seasons of Jan-Apr, May-Aug & Sep-Dec
+CONFIG_KEY_ROLLING_WINDOW_DAYS = 'rollingWindowDays' # optional, e.g. "7, 30" for worksheets of the last 7 & 30 days
+
+SPREADSHEET_ID = '1dcWoKRfR6-Y5uPgL3p7387p8uqnObgyTNVYlYdqz8xM'
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Updates the stats spreadsheet with any new logs')
+  parser.add_argument('--profile', nargs='?', const='profile.json', metavar='TRACE_FILEPATH',
+    help='write a JSON trace of the time spent in each stage (default: profile.json) & print a summary of the run')
+  parser.add_argument('--full-metadata-sync', action='store_true', help="re-fetch the uploaders' full lists of logs instead of only their new & most recent logs, e.g. to update older logs that were re-uploaded or drop deleted ones")
+  parser.add_argument('--cprofile', metavar='STATS_FILEPATH', help='also profile parsing & aggregation with cProfile, writing the stats to this file')
+  parser.add_argument('--watch', nargs='?', const=30, type=float, metavar='POLL_SECONDS',
+    help='keep running, checking for new logs & config changes every POLL_SECONDS (default: 30) & updating the spreadsheet as they appear')
+  parser.add_argument('--groups', metavar='GROUPS_FILEPATH',
+    help="update the spreadsheets of several groups listed in this JSON file (see loadGroups) instead, sharing the logs they have in common")
+  args = parser.parse_args()
+  if args.groups and args.watch:
+    parser.error('--watch only supports a single spreadsheet')
+  group_workers = None # one per group
+  if args.cprofile:
+    PROFILER.start(args.cprofile)
+    PARSE_WORKERS = 1 # parse in this process so that it's profiled
+    group_workers = 1 # and update each group in turn, since cProfile only profiles one thread
+
+  logs_cache = logcache.SegmentLogCache(LOGS_CACHE_DIR)
+  logcache.migrateLegacyLogCache(LOGS_CACHE_DIR, logs_cache) # pick up any logs cached in the old one-file-per-log layout
+  logs_client = logstf.LogsClient(logs_cache, tf2stats.LOG_PROJECTION, metadata_store=logmetadata.LogMetadataStore(LOG_METADATA_FILEPATH))
+
+  if args.groups:
+    groups = loadGroups(args.groups)
+    updateGroups(logs_client, groups, args.full_metadata_sync, group_workers)
+    for group in groups:
+      group.stats_store.close()
+  else:
+    spreadsheet = googledocs.openSpreadsheet(TOKEN_FILEPATH, CREDENTIALS_FILEPATH, SCOPES, SPREADSHEET_ID)
+    stats_store = tf2stats.StatsStore(STATS_STORE_FILEPATH)
+    sheets_planner = googledocs.SheetsBatchPlanner(spreadsheet)
+
+    if args.watch:
+      print("Watching for new logs every %g seconds (press Ctrl+C to stop)" % args.watch)
+      try:
+        watch(logs_client, stats_store, sheets_planner, args.watch, args.full_metadata_sync, args.profile)
+      except KeyboardInterrupt:
+        print("Stopped watching")
+    else:
+      alias_lookup, config = readSettings(sheets_planner)
+      runUpdate(logs_client, stats_store, sheets_planner, alias_lookup, config, args.full_metadata_sync)
+    stats_store.close()
+
+  logs_client.close()
+
+  if args.profile:
+    METRICS.writeReport(args.profile)
+    print(METRICS.getSummary())
+    print(f"Wrote the run's trace to '{args.profile}'")
+  if args.cprofile:
+    PROFILER.dump()
+    print(f"Wrote the cProfile stats to '{args.cprofile}'")
@@ -1,3 +1,11 @@
 from .aggregated_stats import *
 from .game_stats import *
-from .stat_definitions import *
\ No newline at end of file
+from .incremental_aggregation import *
+from .leaderboards import *
+from .log_tags import *
+from .parallel_parse import *
+from .quantile_sketch import *
+from .sliding_window import *
+from .stat_definitions import *
+from .stats_store import *
+from .vectorized_aggregation import *
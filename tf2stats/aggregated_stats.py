@@ -5,6 +5,18 @@ from consts import GameResult, Team, ClassType, SIXES_COMBAT_CLASSES
 
 from .stat_definitions import StatValue
 from .game_stats import PlayerSingleGameStats
+from .leaderboards import LEADERBOARD_DEFS, LeaderboardAccumulator
+from .quantile_sketch import QuantileSketch
+
+# how many of the player-games tied for a max stat are listed (the earliest ones), so a stat that's often tied (e.g.
+# captures) doesn't list more & more of them as logs are added
+MAX_STAT_MAX_WINNERS = 10
+
+def getEarliestWinners(winners):
+  """
+  Returns the MAX_STAT_MAX_WINNERS of {winners} ([(steam id, log id)]) from the earliest logs (then the lowest steam ids)
+  """
+  return sorted(winners, key=lambda winner: (winner[1], winner[0]))[:MAX_STAT_MAX_WINNERS]
 
 class MaxStat:
   def __init__(self, all_individual_stats, name, stat_getter):
@@ -20,35 +32,69 @@ class MaxStat:
       elif stat == max_scoring_stat:
         winners.append((stats_in_single_log.steam_id, StatValue(name, stats_in_single_log.log_id, stat)))
     
-    self.winners = winners
+    # only the earliest ties are listed, in the same order as before
+    self.num_winners = len(winners)
+    earliest_winners = set(getEarliestWinners([(steam_id, value.log_id) for steam_id, value in winners]))
+    self.winners = [(steam_id, value) for steam_id, value in winners if (steam_id, value.log_id) in earliest_winners]
+
+# the name of each max stat & the per-game player stat that it's the max of
+MAX_STAT_DEFS = [
+  ('Max DPM', 'average_dpm'),
+  ('Max HPM', 'average_hpm'),
+  ('Max Kills', 'kills'),
+  ('Max Airshots', 'airshots'),
+  ('Max Captures', 'captures'),
+]
+
+# the name of each quantile of a player's per-game dpm & hpm, and the fraction of their games that are at or below it
+PLAYER_QUANTILE_DEFS = [
+  ('Median', 0.5),
+  ('P90', 0.9),
+]
 
 class AggregatedStats:
   def __init__(self, all_game_stats, tracked_player_steam_ids):
     all_individual_stats_raw = list(sorted(itertools.chain.from_iterable([game_stats.player_stats for game_stats in all_game_stats]), key=PlayerSingleGameStats.STEAM_ID_GETTER))
     all_individual_stats = [stats for stats in all_individual_stats_raw if stats.steam_id in tracked_player_steam_ids]
 
-    self.stats = [
-      MaxStat(all_individual_stats, 'Max DPM', lambda stats: stats.stats['average_dpm'].value),
-      MaxStat(all_individual_stats, 'Max HPM', lambda stats: stats.stats['average_hpm'].value),
-      MaxStat(all_individual_stats, 'Max Kills', lambda stats: stats.stats['kills'].value),
-      MaxStat(all_individual_stats, 'Max Airshots', lambda stats: stats.stats['airshots'].value),
-      MaxStat(all_individual_stats, 'Max Captures', lambda stats: stats.stats['captures'].value),
-    ]
+    self.stats = [MaxStat(all_individual_stats, name, lambda stats, stat_name=stat_name: stats.stats[stat_name].value) for name, stat_name in MAX_STAT_DEFS]
+
+    leaderboard_accumulators = [LeaderboardAccumulator(name, stat_name) for name, stat_name in LEADERBOARD_DEFS]
+    for stats in all_individual_stats:
+      for leaderboard_accumulator in leaderboard_accumulators:
+        leaderboard_accumulator.add(stats)
+    self.leaderboards = [leaderboard_accumulator.toLeaderboard() for leaderboard_accumulator in leaderboard_accumulators]
     
     grouped_stats_per_player = itertools.groupby(all_individual_stats, key=PlayerSingleGameStats.STEAM_ID_GETTER)
     self.player_stats = { steam_id: PlayerAggregatedStats.createPlayerAggregatedStats(list(stats)) for steam_id, stats in grouped_stats_per_player }
   
+  @staticmethod
+  def fromAccumulator(accumulator):
+    aggregated_stats = AggregatedStats.__new__(AggregatedStats)
+    aggregated_stats.stats = [max_stat_accumulator.toMaxStat() for max_stat_accumulator in accumulator.max_stat_accumulators]
+    aggregated_stats.leaderboards = [leaderboard_accumulator.toLeaderboard() for leaderboard_accumulator in accumulator.leaderboard_accumulators]
+    aggregated_stats.player_stats = { steam_id: accumulator.player_accumulators[steam_id].toPlayerAggregatedStats() for steam_id in sorted(accumulator.player_accumulators) }
+    return aggregated_stats
+
   def hasStats(self):
     return len(self.player_stats) > 0
 
 class PlayerAggregatedStats:
-  def __init__(self, steam_id, average_dpm, average_heals_received_per_minute, average_hpm, game_result_counts, per_class_dpm):
+  # games with both a dpm & hpm this low are from a player leaving, but the logs still tracking them for the rest of the game
+  LOW_HPM = 400
+  LOW_DPM = 130
+
+  def __init__(self, steam_id, average_dpm, average_heals_received_per_minute, average_hpm, game_result_counts, per_class_dpm, dpm_quantiles=None, hpm_quantiles=None, per_class_dpm_quantiles=None):
     self.steam_id = steam_id
     self.average_dpm = average_dpm
     self.average_hpm = average_hpm
     self.game_result_counts = game_result_counts
     self.per_class_dpm = per_class_dpm
     self.average_heals_received_per_minute = average_heals_received_per_minute
+    # {fraction: value} of each quantile in PLAYER_QUANTILE_DEFS (and {class: {fraction: value}} per class), if they were calculated
+    self.dpm_quantiles = dpm_quantiles if dpm_quantiles != None else {}
+    self.hpm_quantiles = hpm_quantiles if hpm_quantiles != None else {}
+    self.per_class_dpm_quantiles = per_class_dpm_quantiles if per_class_dpm_quantiles != None else {}
 
     total_decided_games = game_result_counts[GameResult.WIN] + game_result_counts[GameResult.LOSS]
     self.win_rate = game_result_counts[GameResult.WIN] / total_decided_games if total_decided_games > 0 else None
@@ -58,47 +104,244 @@ class PlayerAggregatedStats:
     """
     Given all PlayerStatsForSingleGame for a player, calculates the aggregated stats
     """
-    LOW_HPM = 400
-    LOW_DPM = 130
 
     assert len(player_stats) > 0
     assert all([stats.steam_id == player_stats[0].steam_id for stats in player_stats])
 
-    steam_id = player_stats[0].steam_id
-    total_dpm, total_hpm, total_heals_received_per_minute = 0, 0, 0
-    per_class_total_dpm = { class_type: 0 for class_type in SIXES_COMBAT_CLASSES }
-    per_class_games = { class_type: 0 for class_type in SIXES_COMBAT_CLASSES }
-    num_combat_class_games, num_medic_games = 0, 0
-    game_result_counts = { result: 0 for result in GameResult }
-
+    accumulator = PlayerStatsAccumulator(player_stats[0].steam_id)
     for stats in player_stats:
-      # if they played less than half the game (aka subbed in late), ignore that game's stats
-      if stats.stats['total_playtime_in_seconds'].value < 0.5 * stats.game_stats.stats['duration'].value:
-        continue
+      accumulator.add(stats)
+    return accumulator.toPlayerAggregatedStats()
 
-      # other heuristics are low dpm and hpm from leaving the game, but the logs mistakenly tracked the remaining duration
-      if stats.stats['average_dpm'].value <= LOW_DPM and stats.stats['average_hpm'].value <= LOW_HPM:
-        continue
+def isCountedPlayerGame(stats):
+  """
+  Whether a player's PlayerSingleGameStats should count towards their aggregated stats
+  """
+  # if they played less than half the game (aka subbed in late), ignore that game's stats
+  if stats.stats['total_playtime_in_seconds'].value < 0.5 * stats.game_stats.stats['duration'].value:
+    return False
+
+  # other heuristics are low dpm and hpm from leaving the game, but the logs mistakenly tracked the remaining duration
+  return not (stats.stats['average_dpm'].value <= PlayerAggregatedStats.LOW_DPM and stats.stats['average_hpm'].value <= PlayerAggregatedStats.LOW_HPM)
 
-      game_result_counts[stats.stats['game_result'].value] += 1
-      if stats.stats['class_type'].value == ClassType.MEDIC:
-        total_hpm += stats.stats['average_hpm'].value
-        num_medic_games += 1
-      else:
-        total_dpm += stats.stats['average_dpm'].value
-        total_heals_received_per_minute += stats.stats['average_hrpm'].value
-        num_combat_class_games += 1
-      
-      if stats.stats['class_type'].value in SIXES_COMBAT_CLASSES:
-        per_class_total_dpm[stats.stats['class_type'].value] += stats.stats['average_dpm'].value
-        per_class_games[stats.stats['class_type'].value] += 1
-
-    per_class_dpm = { class_type: (per_class_total_dpm[class_type] / per_class_games[class_type] if per_class_games[class_type] > 0 else None) for class_type in SIXES_COMBAT_CLASSES }
+def calcAverage(total, count):
+  return total / count if count > 0 else None
+
+def getQuantiles(sketch):
+  return { fraction: sketch.getQuantile(fraction) for name, fraction in PLAYER_QUANTILE_DEFS }
+
+class PlayerStatsAccumulator:
+  """
+  The running totals behind a player's aggregated stats, which can be built up a game at a time and merged with the
+  totals from other games (e.g. to combine months). The distributions of their dpm & hpm are kept as QuantileSketches,
+  so their quantiles don't need every game's values either
+  """
+  def __init__(self, steam_id):
+    self.steam_id = steam_id
+    self.total_dpm, self.total_hpm, self.total_heals_received_per_minute = 0, 0, 0
+    self.per_class_total_dpm = { class_type: 0 for class_type in SIXES_COMBAT_CLASSES }
+    self.per_class_games = { class_type: 0 for class_type in SIXES_COMBAT_CLASSES }
+    self.num_combat_class_games, self.num_medic_games = 0, 0
+    self.game_result_counts = { result: 0 for result in GameResult }
+    self.dpm_sketch, self.hpm_sketch = QuantileSketch(), QuantileSketch()
+    self.per_class_dpm_sketches = { class_type: QuantileSketch() for class_type in SIXES_COMBAT_CLASSES }
+
+  def add(self, stats):
+    """
+    Adds a single game's PlayerSingleGameStats to the totals, unless it's a game that shouldn't count
+    """
+    if isCountedPlayerGame(stats):
+      self.addCounted(stats)
+
+  def addCounted(self, stats):
+    """
+    Adds a single game's PlayerSingleGameStats to the totals, which is already known to count (e.g. from its LogTags)
+    """
+    self.game_result_counts[stats.stats['game_result'].value] += 1
+    if stats.stats['class_type'].value == ClassType.MEDIC:
+      self.total_hpm += stats.stats['average_hpm'].value
+      self.hpm_sketch.add(stats.stats['average_hpm'].value)
+      self.num_medic_games += 1
+    else:
+      self.total_dpm += stats.stats['average_dpm'].value
+      self.dpm_sketch.add(stats.stats['average_dpm'].value)
+      self.total_heals_received_per_minute += stats.stats['average_hrpm'].value
+      self.num_combat_class_games += 1
+
+    if stats.stats['class_type'].value in SIXES_COMBAT_CLASSES:
+      self.per_class_total_dpm[stats.stats['class_type'].value] += stats.stats['average_dpm'].value
+      self.per_class_dpm_sketches[stats.stats['class_type'].value].add(stats.stats['average_dpm'].value)
+      self.per_class_games[stats.stats['class_type'].value] += 1
+
+  def merge(self, other):
+    self.total_dpm += other.total_dpm
+    self.total_hpm += other.total_hpm
+    self.total_heals_received_per_minute += other.total_heals_received_per_minute
+    self.num_combat_class_games += other.num_combat_class_games
+    self.num_medic_games += other.num_medic_games
+    self.dpm_sketch.merge(other.dpm_sketch)
+    self.hpm_sketch.merge(other.hpm_sketch)
+    for class_type in SIXES_COMBAT_CLASSES:
+      self.per_class_total_dpm[class_type] += other.per_class_total_dpm[class_type]
+      self.per_class_games[class_type] += other.per_class_games[class_type]
+      self.per_class_dpm_sketches[class_type].merge(other.per_class_dpm_sketches[class_type])
+    for result in GameResult:
+      self.game_result_counts[result] += other.game_result_counts[result]
+
+  def toPlayerAggregatedStats(self):
     return PlayerAggregatedStats(
-      steam_id,
-      total_dpm / num_combat_class_games if num_combat_class_games > 0 else None,
-      total_heals_received_per_minute / num_combat_class_games if num_combat_class_games > 0 else None,
-      total_hpm / num_medic_games if num_medic_games > 0 else None,
-      game_result_counts,
-      per_class_dpm
+      self.steam_id,
+      calcAverage(self.total_dpm, self.num_combat_class_games),
+      calcAverage(self.total_heals_received_per_minute, self.num_combat_class_games),
+      calcAverage(self.total_hpm, self.num_medic_games),
+      dict(self.game_result_counts),
+      { class_type: calcAverage(self.per_class_total_dpm[class_type], self.per_class_games[class_type]) for class_type in SIXES_COMBAT_CLASSES },
+      getQuantiles(self.dpm_sketch),
+      getQuantiles(self.hpm_sketch),
+      { class_type: getQuantiles(self.per_class_dpm_sketches[class_type]) for class_type in SIXES_COMBAT_CLASSES }
     )
+
+  def toJson(self):
+    return {
+      'steam_id': self.steam_id,
+      'totals': [self.total_dpm, self.total_hpm, self.total_heals_received_per_minute, self.num_combat_class_games, self.num_medic_games],
+      'per_class': { class_type.value: [self.per_class_total_dpm[class_type], self.per_class_games[class_type]] for class_type in SIXES_COMBAT_CLASSES },
+      'results': { result.value: count for result, count in self.game_result_counts.items() },
+      'sketches': {
+        'dpm': self.dpm_sketch.toJson(),
+        'hpm': self.hpm_sketch.toJson(),
+        'per_class_dpm': { class_type.value: self.per_class_dpm_sketches[class_type].toJson() for class_type in SIXES_COMBAT_CLASSES },
+      },
+    }
+
+  @staticmethod
+  def fromJson(accumulator_json):
+    accumulator = PlayerStatsAccumulator(accumulator_json['steam_id'])
+    accumulator.total_dpm, accumulator.total_hpm, accumulator.total_heals_received_per_minute, accumulator.num_combat_class_games, accumulator.num_medic_games = accumulator_json['totals']
+    for class_type in SIXES_COMBAT_CLASSES:
+      accumulator.per_class_total_dpm[class_type], accumulator.per_class_games[class_type] = accumulator_json['per_class'][class_type.value]
+    for result in GameResult:
+      accumulator.game_result_counts[result] = accumulator_json['results'][result.value]
+    accumulator.dpm_sketch = QuantileSketch.fromJson(accumulator_json['sketches']['dpm'])
+    accumulator.hpm_sketch = QuantileSketch.fromJson(accumulator_json['sketches']['hpm'])
+    for class_type in SIXES_COMBAT_CLASSES:
+      accumulator.per_class_dpm_sketches[class_type] = QuantileSketch.fromJson(accumulator_json['sketches']['per_class_dpm'][class_type.value])
+    return accumulator
+
+class MaxStatAccumulator:
+  """
+  The running max of a per-game player stat & how many player-games are tied for it (of which only the earliest
+  MAX_STAT_MAX_WINNERS are kept), which can be merged with the max from other games
+  """
+  def __init__(self, name, stat_name):
+    self.name = name
+    self.stat_name = stat_name
+    self.max_value = None
+    self.winners = [] # (steam id, log id) of the earliest player-games with the max value
+    self.num_winners = 0
+
+  def add(self, stats):
+    self.addValue(stats.steam_id, stats.log_id, stats.stats[self.stat_name].value)
+
+  def addValue(self, steam_id, log_id, value):
+    self.addTies(value, [(steam_id, log_id)], 1)
+
+  def addTies(self, value, winners, num_winners):
+    """
+    Adds {num_winners} player-games that all have the same {value}, where {winners} ([(steam id, log id)]) are (at least)
+    the earliest MAX_STAT_MAX_WINNERS of them
+    """
+    # like MaxStat, only non-negative values can win
+    if value < 0 or (self.max_value != None and value < self.max_value):
+      return
+    if self.max_value == None or value > self.max_value:
+      self.max_value, self.winners, self.num_winners = value, [], 0
+    self.winners = getEarliestWinners(self.winners + list(winners))
+    self.num_winners += num_winners
+
+  def merge(self, other):
+    if other.max_value != None:
+      self.addTies(other.max_value, other.winners, other.num_winners)
+
+  def toMaxStat(self):
+    max_stat = MaxStat([], self.name, None)
+    # list the ties in the same order as MaxStat, which goes through the games of each player in turn
+    max_stat.winners = [(steam_id, StatValue(self.name, log_id, self.max_value)) for steam_id, log_id in sorted(self.winners)]
+    max_stat.num_winners = self.num_winners
+    return max_stat
+
+  def toJson(self):
+    return { 'max_value': self.max_value, 'winners': self.winners, 'num_winners': self.num_winners }
+
+  @staticmethod
+  def fromJson(name, stat_name, accumulator_json):
+    accumulator = MaxStatAccumulator(name, stat_name)
+    accumulator.max_value = accumulator_json['max_value']
+    accumulator.winners = [tuple(winner) for winner in accumulator_json['winners']]
+    accumulator.num_winners = accumulator_json['num_winners']
+    return accumulator
+
+class AggregatedStatsAccumulator:
+  """
+  The running totals for every tracked player, max stat & leaderboard over a set of games, which can be turned into AggregatedStats
+  """
+  def __init__(self, tracked_player_steam_ids):
+    self.tracked_player_steam_ids = set(tracked_player_steam_ids)
+    self.player_accumulators = {}
+    self.max_stat_accumulators = [MaxStatAccumulator(name, stat_name) for name, stat_name in MAX_STAT_DEFS]
+    self.leaderboard_accumulators = [LeaderboardAccumulator(name, stat_name) for name, stat_name in LEADERBOARD_DEFS]
+
+  def add(self, game_stats, log_tags=None):
+    """
+    Adds every tracked player's stats from a game. If the game's LogTags are given, they decide which players' games count
+    instead of re-checking each one
+    """
+    for stats in game_stats.player_stats:
+      if stats.steam_id not in self.tracked_player_steam_ids:
+        continue
+      if stats.steam_id not in self.player_accumulators:
+        self.player_accumulators[stats.steam_id] = PlayerStatsAccumulator(stats.steam_id)
+      if log_tags == None:
+        self.player_accumulators[stats.steam_id].add(stats)
+      elif stats.steam_id not in log_tags.uncounted_steam_ids:
+        self.player_accumulators[stats.steam_id].addCounted(stats)
+      for max_stat_accumulator in self.max_stat_accumulators:
+        max_stat_accumulator.add(stats)
+      for leaderboard_accumulator in self.leaderboard_accumulators:
+        leaderboard_accumulator.add(stats)
+
+  def merge(self, other):
+    for steam_id, other_player_accumulator in other.player_accumulators.items():
+      if steam_id not in self.player_accumulators:
+        self.player_accumulators[steam_id] = PlayerStatsAccumulator(steam_id)
+      self.player_accumulators[steam_id].merge(other_player_accumulator)
+    for max_stat_accumulator, other_max_stat_accumulator in zip(self.max_stat_accumulators, other.max_stat_accumulators):
+      max_stat_accumulator.merge(other_max_stat_accumulator)
+    for leaderboard_accumulator, other_leaderboard_accumulator in zip(self.leaderboard_accumulators, other.leaderboard_accumulators):
+      leaderboard_accumulator.merge(other_leaderboard_accumulator)
+
+  def toAggregatedStats(self):
+    return AggregatedStats.fromAccumulator(self)
+
+  def toJson(self):
+    return {
+      'players': [player_accumulator.toJson() for player_accumulator in self.player_accumulators.values()],
+      'max_stats': [max_stat_accumulator.toJson() for max_stat_accumulator in self.max_stat_accumulators],
+      'leaderboards': [leaderboard_accumulator.toJson() for leaderboard_accumulator in self.leaderboard_accumulators],
+    }
+
+  @staticmethod
+  def fromJson(tracked_player_steam_ids, accumulator_json):
+    accumulator = AggregatedStatsAccumulator(tracked_player_steam_ids)
+    for player_accumulator_json in accumulator_json['players']:
+      player_accumulator = PlayerStatsAccumulator.fromJson(player_accumulator_json)
+      accumulator.player_accumulators[player_accumulator.steam_id] = player_accumulator
+    accumulator.max_stat_accumulators = [
+      MaxStatAccumulator.fromJson(name, stat_name, max_stat_json)
+      for (name, stat_name), max_stat_json in zip(MAX_STAT_DEFS, accumulator_json['max_stats'])
+    ]
+    accumulator.leaderboard_accumulators = [
+      LeaderboardAccumulator.fromJson(name, stat_name, leaderboard_json)
+      for (name, stat_name), leaderboard_json in zip(LEADERBOARD_DEFS, accumulator_json['leaderboards'])
+    ]
+    return accumulator
@@ -2,30 +2,51 @@ import operator
 
 from consts import GameResult, Team, ClassType, SIXES_COMBAT_CLASSES
 
-from .stat_definitions import StatDefinition
+from .stat_definitions import StatDefinition, CompiledStatExtractor, StatValuesView, createProjection
 
 class SingleGameStats:
+  """
+  The stats for a single game, stored as one value per stat output by GAME_STAT_EXTRACTOR
+  """
+  __slots__ = ('log_id', 'values', 'player_stats')
+
   def __init__(self, log_id, log):
     self.log_id = log_id
 
-    self.stats = {}
-    for stat_def in GAME_STAT_DEFS:
-      self.stats[stat_def.name] = stat_def.calcValue(self.log_id, self.stats, log)
+    self.values = GAME_STAT_EXTRACTOR.extract(log)
 
     self.player_stats = [PlayerSingleGameStats(log_id, self, steam_id, player_log) for steam_id, player_log in log[u'players'].items()]
 
-  def is_scrim(self, team_member_ids, min_num_team_members):
+  @property
+  def stats(self):
+    return StatValuesView(GAME_STAT_EXTRACTOR.output_defs, GAME_STAT_INDICES, self.values, self.log_id)
+
+  @staticmethod
+  def fromStatValues(log_id, game_stat_values, player_stat_values):
     """
-    A game with at least {min_num_team_members} players from {team_member_ids} on the same team is a scrim
+    Rebuilds the stats for a game from previously extracted values (see getStatValues) without needing its log
     """
-    counts = { team: 0 for team in Team }
-    for player in self.player_stats:
-      if player.steam_id in team_member_ids:
-        counts[player.stats['team'].value] += 1
+    game_stats = SingleGameStats.__new__(SingleGameStats)
+    game_stats.log_id = log_id
+    game_stats.values = tuple(game_stat_values[stat_def.name] for stat_def in GAME_STAT_EXTRACTOR.output_defs)
+    game_stats.player_stats = [PlayerSingleGameStats.fromStatValues(log_id, game_stats, steam_id, values) for steam_id, values in player_stat_values.items()]
+    return game_stats
 
-    return any([count >= min_num_team_members for count in counts.values()])
+  def getStatValues(self):
+    """
+    Returns the raw game & per-player stat values, which can be passed to fromStatValues
+    """
+    game_stat_values = { stat_def.name: value for stat_def, value in zip(GAME_STAT_EXTRACTOR.output_defs, self.values) }
+    player_stat_values = { player.steam_id: player.getStatValues() for player in self.player_stats }
+    return game_stat_values, player_stat_values
 
 class PlayerSingleGameStats:
+  """
+  A player's stats for a single game, stored as one value per stat output by PLAYER_STAT_EXTRACTOR.
+  The game's stats are available through {stats} with a "game_" prefix, but aren't copied
+  """
+  __slots__ = ('log_id', 'steam_id', 'game_stats', 'values')
+
   STEAM_ID_GETTER = lambda stats: stats.steam_id
 
   def __init__(self, log_id, game_stats, player_steam_id, player_log):
@@ -33,26 +54,41 @@ class PlayerSingleGameStats:
     self.steam_id = player_steam_id
     self.game_stats = game_stats
 
-    self.stats = { "game_" + k: v for k, v in game_stats.stats.items() }
-    for stat_def in PLAYER_STAT_DEFS:
-      self.stats[stat_def.name] = stat_def.calcValue(self.log_id, self.stats, player_log)
+    self.values = PLAYER_STAT_EXTRACTOR.extract(player_log, game_stats.values)
+
+  @property
+  def stats(self):
+    return StatValuesView(PLAYER_STAT_EXTRACTOR.output_defs, PLAYER_STAT_INDICES, self.values, self.log_id, self.game_stats.stats, 'game_')
+
+  @staticmethod
+  def fromStatValues(log_id, game_stats, player_steam_id, player_stat_values):
+    player_stats = PlayerSingleGameStats.__new__(PlayerSingleGameStats)
+    player_stats.log_id = log_id
+    player_stats.steam_id = player_steam_id
+    player_stats.game_stats = game_stats
+    player_stats.values = tuple(player_stat_values[stat_def.name] for stat_def in PLAYER_STAT_EXTRACTOR.output_defs)
+    return player_stats
+
+  def getStatValues(self):
+    return { stat_def.name: value for stat_def, value in zip(PLAYER_STAT_EXTRACTOR.output_defs, self.values) }
 
-def calc_average_stat(stats, stat_name):
-  duration_in_minutes = stats['game_duration'].value / 60.0
-  return stats[stat_name].value / duration_in_minutes
+def calc_average_stat(stat, game_duration):
+  duration_in_minutes = game_duration / 60.0
+  return stat / duration_in_minutes
 
 def calc_valid_class_stats(raw_stats):
   # filter out the 'undefined' & 'unknown' classes, which can occur if a player moves from spec to playing
   return [class_stats for class_stats in raw_stats[u'class_stats'] if class_stats[u'type'] != u'undefined' and class_stats[u'type'] != u'unknown']
 
-def calc_main_class_type(raw_stats):
-  valid_class_stats = calc_valid_class_stats(raw_stats)
+def calc_main_class_type(valid_class_stats):
   return ClassType(max(valid_class_stats, key=operator.itemgetter(u'total_time'))[u'type']) # the class is whatever single class had the highest playtime
 
-def calc_total_playtime_in_seconds(raw_stats):
-  valid_class_stats = calc_valid_class_stats(raw_stats)
+def calc_total_playtime_in_seconds(valid_class_stats):
   return sum([class_stats[u'total_time'] for class_stats in valid_class_stats])
 
+def calc_game_result(game_winning_team, team):
+  return GameResult.TIE if game_winning_team == None else (GameResult.WIN if game_winning_team == team else GameResult.LOSS)
+
 PLAYER_STAT_DEFS = [
   # base stats
   StatDefinition.createExtractorStatDefinition('damage', u'dmg'),
@@ -63,14 +99,15 @@ PLAYER_STAT_DEFS = [
   StatDefinition.createExtractorStatDefinition('airshots', u'as'),
   StatDefinition.createExtractorStatDefinition('captures', u'cpc'),
   StatDefinition.createExtractorStatDefinition('heals_received', u'hr'),
-  StatDefinition('team', lambda _, raw_stats: Team(raw_stats[u'team'])),
-  StatDefinition('class_type', lambda _, raw_stats: calc_main_class_type(raw_stats)),
-  StatDefinition('total_playtime_in_seconds', lambda _, raw_stats: calc_total_playtime_in_seconds(raw_stats)),
+  StatDefinition('team', lambda raw_stats: Team(raw_stats[u'team']), [], [(u'team',)]),
+  StatDefinition('valid_class_stats', calc_valid_class_stats, [], [(u'class_stats', u'type'), (u'class_stats', u'total_time')], is_intermediate=True),
+  StatDefinition('class_type', lambda _, valid_class_stats: calc_main_class_type(valid_class_stats), ['valid_class_stats']),
+  StatDefinition('total_playtime_in_seconds', lambda _, valid_class_stats: calc_total_playtime_in_seconds(valid_class_stats), ['valid_class_stats']),
   # derived stats
-  StatDefinition('game_result', lambda stats, _: GameResult.TIE if stats['game_winning_team'].value == None else (GameResult.WIN if stats['game_winning_team'].value == stats['team'].value else GameResult.LOSS)),
-  StatDefinition('average_dpm', lambda stats, _: calc_average_stat(stats, 'damage')),
-  StatDefinition('average_hpm', lambda stats, _: calc_average_stat(stats, 'heals')),
-  StatDefinition('average_hrpm', lambda stats, _: calc_average_stat(stats, 'heals_received')),
+  StatDefinition('game_result', lambda _, game_winning_team, team: calc_game_result(game_winning_team, team), ['game_winning_team', 'team']),
+  StatDefinition('average_dpm', lambda _, damage, game_duration: calc_average_stat(damage, game_duration), ['damage', 'game_duration']),
+  StatDefinition('average_hpm', lambda _, heals, game_duration: calc_average_stat(heals, game_duration), ['heals', 'game_duration']),
+  StatDefinition('average_hrpm', lambda _, heals_received, game_duration: calc_average_stat(heals_received, game_duration), ['heals_received', 'game_duration']),
 ]
 
 def decide_winning_team(game_log):
@@ -80,5 +117,26 @@ def decide_winning_team(game_log):
 
 GAME_STAT_DEFS = [
   StatDefinition.createExtractorStatDefinition('duration', u'length'),
-  StatDefinition('winning_team', lambda _, game_log: decide_winning_team(game_log)),
-]
\ No newline at end of file
+  StatDefinition('winning_team', decide_winning_team, [], [(u'teams', team.value, u'score') for team in Team]),
+]
+
+# the player stats that are actually used (by the aggregated stats & scrim detection), so only these and the stats they
+# depend on are calculated for each game
+OUTPUT_PLAYER_STATS = ['team', 'class_type', 'total_playtime_in_seconds', 'game_result', 'average_dpm', 'average_hpm', 'average_hrpm', 'kills', 'airshots', 'captures']
+
+GAME_STAT_EXTRACTOR = CompiledStatExtractor(GAME_STAT_DEFS, [stat_def.name for stat_def in GAME_STAT_DEFS])
+PLAYER_STAT_EXTRACTOR = CompiledStatExtractor(PLAYER_STAT_DEFS, OUTPUT_PLAYER_STATS, GAME_STAT_EXTRACTOR, 'game_')
+
+GAME_STAT_INDICES = GAME_STAT_EXTRACTOR.output_indices
+PLAYER_STAT_INDICES = PLAYER_STAT_EXTRACTOR.output_indices
+
+# the only parts of a log that are needed to calculate the stats (plus the log's date, which the logs cache relies on)
+LOG_PROJECTION = createProjection(
+  [(u'info', u'date')] +
+  GAME_STAT_EXTRACTOR.raw_fields +
+  [(u'players', '*') + field for field in PLAYER_STAT_EXTRACTOR.raw_fields]
+)
+
+# stored with the parsed stats, so bump it whenever a stat definition (or how stats are extracted from a log) changes, to
+# re-parse every stored log on the next run
+STAT_DEFINITIONS_VERSION = 1
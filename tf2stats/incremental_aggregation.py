@@ -0,0 +1,70 @@
+import hashlib
+import json
+
+from .aggregated_stats import AggregatedStatsAccumulator
+from .log_tags import LOG_TAGS_VERSION
+from .vectorized_aggregation import addGames
+
+# part of every stored accumulator's config key, so bump it whenever the way stats are aggregated (in aggregated_stats,
+# leaderboards or quantile_sketch) changes, to rebuild the stored accumulators on the next run
+AGGREGATION_VERSION = 2
+
+def calcAccumulatorConfigKey(tracked_player_steam_ids):
+  """
+  Identifies everything (besides the logs themselves) that a stored accumulator depends on, so it can be rebuilt when any of it changes
+  """
+  config = [sorted(tracked_player_steam_ids), AGGREGATION_VERSION, LOG_TAGS_VERSION]
+  return hashlib.sha1(json.dumps(config).encode('utf-8')).hexdigest()
+
+def iterMonthlyAccumulators(stats_store, monthly_log_revisions, all_log_tags, tracked_player_steam_ids, cached_accumulators=None):
+  """
+  Brings the accumulator stored for each month in {monthly_log_revisions} ({month: {log id: log revision}}) up to date,
+  only adding the logs that are new since it was stored, & yields each (month, accumulator) in month order as soon as it's
+  up to date. Only one month's accumulator & new logs are loaded at a time, so memory doesn't grow with the number of months.
+
+  A log's revision can be anything json-encodable that changes whenever the log would be aggregated differently, e.g. its
+  date & LogTags.getRevision. A month is rebuilt from scratch if any of its accumulated logs were removed or their revision
+  changed, or the config changed. Only the logs that are counted according to {all_log_tags} ({log id: LogTags}) are added.
+  If {all_log_tags} is None, each month's tags are loaded from the store along with it instead.
+
+  If a {cached_accumulators} dict is given, the accumulators are also kept in it between calls (e.g. by a long-running
+  process), so that a month already in it is updated in place instead of being loaded from the store again.
+
+  Any other period (e.g. a day) can be accumulated the same way, as long as its key can't be mistaken for a month's
+  """
+  config_key = calcAccumulatorConfigKey(tracked_player_steam_ids)
+
+  for month in sorted(monthly_log_revisions):
+    log_revisions = monthly_log_revisions[month]
+    accumulator, accumulated_log_revisions = AggregatedStatsAccumulator(tracked_player_steam_ids), {}
+
+    isUpToDate = lambda stored_config_key, stored_log_revisions: stored_config_key == config_key and all(log_revisions.get(log_id) == revision for log_id, revision in stored_log_revisions.items())
+    if cached_accumulators != None and month in cached_accumulators:
+      cached_config_key, cached_log_revisions, cached_accumulator = cached_accumulators[month]
+      if isUpToDate(cached_config_key, cached_log_revisions):
+        accumulator, accumulated_log_revisions = cached_accumulator, cached_log_revisions
+    else:
+      stored_accumulator = stats_store.loadMonthlyAccumulator(month)
+      if stored_accumulator != None:
+        stored_config_key, stored_log_revisions, accumulator_json = stored_accumulator
+        if isUpToDate(stored_config_key, stored_log_revisions):
+          accumulator, accumulated_log_revisions = AggregatedStatsAccumulator.fromJson(tracked_player_steam_ids, accumulator_json), stored_log_revisions
+    is_rebuilt = len(accumulated_log_revisions) == 0
+    if cached_accumulators != None:
+      # the new logs are added to the same accumulator & log revisions below
+      cached_accumulators[month] = (config_key, accumulated_log_revisions, accumulator)
+
+    # logs that haven't been fetched & tagged yet are left for a later run
+    log_tags = all_log_tags if all_log_tags != None else stats_store.loadLogTags([log_id for log_id in log_revisions if log_id not in accumulated_log_revisions])
+    new_log_ids = [log_id for log_id in log_revisions if log_id not in accumulated_log_revisions and log_id in log_tags]
+    if len(new_log_ids) > 0 or is_rebuilt:
+      # only the new logs that count need their stats loaded
+      new_game_stats = stats_store.loadGameStats([log_id for log_id in new_log_ids if log_tags[log_id].isCounted()])
+      addGames(accumulator, [new_game_stats[log_id] for log_id in new_log_ids if log_id in new_game_stats], log_tags)
+      for log_id in new_log_ids:
+        accumulated_log_revisions[log_id] = log_revisions[log_id]
+      stats_store.saveMonthlyAccumulator(month, config_key, accumulated_log_revisions, accumulator.toJson())
+
+    yield month, accumulator
+
+  stats_store.commit()
@@ -0,0 +1,72 @@
+import heapq
+
+from .stat_definitions import StatValue
+
+# the name of each leaderboard & the per-game player stat that it ranks
+LEADERBOARD_DEFS = [
+  ('Top DPM', 'average_dpm'),
+  ('Top HPM', 'average_hpm'),
+  ('Top Kills', 'kills'),
+  ('Top Airshots', 'airshots'),
+]
+LEADERBOARD_SIZE = 10
+LEADERBOARD_MAX_ENTRIES_PER_PLAYER = 2
+
+class Leaderboard:
+  def __init__(self, name, entries):
+    self.name = name
+    self.entries = entries # (steam id, StatValue) of each ranked player-game, best first
+
+class LeaderboardAccumulator:
+  """
+  The top {size} player-games for a per-game player stat, with at most {max_entries_per_player} of them from any one
+  player (or no limit if None). Games are added one at a time, and only the entries that could still make the
+  leaderboard are kept, using a bounded min-heap per player (or a single one if there's no per-player limit).
+  Accumulators for different games can be merged
+  """
+  def __init__(self, name, stat_name, size=LEADERBOARD_SIZE, max_entries_per_player=LEADERBOARD_MAX_ENTRIES_PER_PLAYER):
+    self.name = name
+    self.stat_name = stat_name
+    self.size = size
+    self.max_entries_per_player = max_entries_per_player
+    # heap key: min-heap of (value, -log id, steam id), so the root is the first entry to be pushed out and ties rank the
+    # earliest log first (then the highest steam id, so the ranking never depends on the order that games are added in)
+    self.heaps = {}
+
+  def getHeapKey(self, steam_id):
+    return steam_id if self.max_entries_per_player != None else None
+
+  def getHeapSize(self):
+    return min(self.size, self.max_entries_per_player) if self.max_entries_per_player != None else self.size
+
+  def add(self, stats):
+    self.addValue(stats.steam_id, stats.log_id, stats.stats[self.stat_name].value)
+
+  def addValue(self, steam_id, log_id, value):
+    self.addEntry((value, -log_id, steam_id))
+
+  def addEntry(self, entry):
+    heap = self.heaps.setdefault(self.getHeapKey(entry[2]), [])
+    if len(heap) < self.getHeapSize():
+      heapq.heappush(heap, entry)
+    elif entry > heap[0]:
+      heapq.heapreplace(heap, entry)
+
+  def merge(self, other):
+    for heap in other.heaps.values():
+      for entry in heap:
+        self.addEntry(entry)
+
+  def toLeaderboard(self):
+    entries = heapq.nlargest(self.size, (entry for heap in self.heaps.values() for entry in heap))
+    return Leaderboard(self.name, [(steam_id, StatValue(self.name, -negative_log_id, value)) for value, negative_log_id, steam_id in entries])
+
+  def toJson(self):
+    return [[steam_id, -negative_log_id, value] for heap in self.heaps.values() for value, negative_log_id, steam_id in heap]
+
+  @staticmethod
+  def fromJson(name, stat_name, accumulator_json):
+    accumulator = LeaderboardAccumulator(name, stat_name)
+    for steam_id, log_id, value in accumulator_json:
+      accumulator.addValue(steam_id, log_id, value)
+    return accumulator
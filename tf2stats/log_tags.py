@@ -0,0 +1,113 @@
+import hashlib
+import json
+
+from consts import Team
+
+from .aggregated_stats import isCountedPlayerGame
+
+SIXES_FORMAT = '6v6'
+HIGHLANDER_FORMAT = 'highlander'
+OTHER_FORMAT = 'other'
+
+# stored with the tags config, so bump it whenever the way logs are tagged (here or in isCountedPlayerGame) changes, to
+# re-tag every stored log on the next run
+LOG_TAGS_VERSION = 1
+
+NO_STEAM_IDS = frozenset() # shared by the (usual) logs where every player's game counts, as every LogTags is kept in memory
+
+def getLogFormat(num_players):
+  # allow for a few subs, like logstf.isSixesLog
+  if num_players >= 12 and num_players < 18:
+    return SIXES_FORMAT
+  if num_players >= 18 and num_players < 24:
+    return HIGHLANDER_FORMAT
+  return OTHER_FORMAT
+
+class LogTagsConfig:
+  """
+  The config that a log's tags depend on, besides the log itself
+  """
+  def __init__(self, ignored_team_member_ids, ignored_log_ids, min_num_scrim_team_members=4):
+    self.ignored_team_member_ids = set(ignored_team_member_ids)
+    self.ignored_log_ids = set(ignored_log_ids)
+    self.min_num_scrim_team_members = min_num_scrim_team_members
+
+  def toJson(self):
+    return {
+      'version': LOG_TAGS_VERSION,
+      'ignored_team_member_ids': sorted(self.ignored_team_member_ids),
+      'ignored_log_ids': sorted(self.ignored_log_ids),
+      'min_num_scrim_team_members': self.min_num_scrim_team_members,
+    }
+
+  def getKey(self):
+    return hashlib.sha1(json.dumps(self.toJson()).encode('utf-8')).hexdigest()
+
+class LogTags:
+  """
+  The decisions about a log that every window would otherwise make again: its format, whether it's a scrim or ignored,
+  and which players' games don't count (e.g. they subbed in late or left early)
+  """
+  __slots__ = ['log_id', 'format', 'is_scrim', 'is_ignored', 'uncounted_steam_ids']
+
+  def __init__(self, log_id, format, is_scrim, is_ignored, uncounted_steam_ids):
+    self.log_id = log_id
+    self.format = format
+    self.is_scrim = is_scrim
+    self.is_ignored = is_ignored
+    self.uncounted_steam_ids = frozenset(uncounted_steam_ids) if len(uncounted_steam_ids) > 0 else NO_STEAM_IDS
+
+  def isCounted(self):
+    """
+    Whether the log counts towards any window's stats
+    """
+    return self.format == SIXES_FORMAT and not self.is_scrim and not self.is_ignored
+
+  def getRevision(self):
+    """
+    Identifies the tags that decide how the log is aggregated, so anything aggregated from it can tell when they change
+    """
+    return [self.format, self.is_scrim, self.is_ignored]
+
+def classifyLog(game_stats, config):
+  """
+  Returns the LogTags of a SingleGameStats under a LogTagsConfig
+  """
+  # a game with at least {min_num_scrim_team_members} ignored team members on the same team is a scrim
+  team_member_counts = { team: 0 for team in Team }
+  for player in game_stats.player_stats:
+    if player.steam_id in config.ignored_team_member_ids:
+      team_member_counts[player.stats['team'].value] += 1
+
+  return LogTags(
+    game_stats.log_id,
+    getLogFormat(len(game_stats.player_stats)),
+    any(count >= config.min_num_scrim_team_members for count in team_member_counts.values()),
+    game_stats.log_id in config.ignored_log_ids,
+    [player.steam_id for player in game_stats.player_stats if not isCountedPlayerGame(player)]
+  )
+
+def updateLogTags(stats_store, config, chunk_size=500):
+  """
+  Tags every stored log that hasn't been tagged yet, and re-tags the stored logs whose tags could have been changed by
+  a change to the config since the last time: only the logs with a newly (un)ignored team member, or that were
+  themselves newly (un)ignored. Every log is re-tagged if the way logs are tagged changed. Returns the ids of the re-tagged logs.
+  Only {chunk_size} logs' stats are loaded at a time
+  """
+  stored_config_json = stats_store.loadLogTagsConfig()
+  if stored_config_json == None or stored_config_json['version'] != LOG_TAGS_VERSION or stored_config_json['min_num_scrim_team_members'] != config.min_num_scrim_team_members:
+    log_ids = set(stats_store.getStoredLogDates().keys())
+  else:
+    changed_team_member_ids = set(stored_config_json['ignored_team_member_ids']) ^ config.ignored_team_member_ids
+    changed_log_ids = set(stored_config_json['ignored_log_ids']) ^ config.ignored_log_ids
+    log_ids = stats_store.getLogIdsWithPlayers(changed_team_member_ids) | changed_log_ids | stats_store.getUntaggedLogIds()
+
+  retagged_log_ids = set()
+  log_ids = sorted(log_ids)
+  for i in range(0, len(log_ids), chunk_size):
+    all_game_stats = stats_store.loadGameStats(log_ids[i:i + chunk_size])
+    stats_store.saveLogTags([classifyLog(game_stats, config) for game_stats in all_game_stats.values()])
+    retagged_log_ids.update(all_game_stats.keys())
+  stats_store.saveLogTagsConfig(config.toJson())
+  stats_store.commit()
+  return retagged_log_ids
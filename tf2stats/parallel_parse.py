@@ -0,0 +1,62 @@
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+
+from .game_stats import SingleGameStats
+
+def extractStatRecord(log_id, log):
+  """
+  Parses a log (or its json text) into a compact, picklable record of (log id, log date, game stat values, player stat values)
+  """
+  if isinstance(log, (bytes, str)):
+    log = json.loads(log)
+
+  game_stat_values, player_stat_values = SingleGameStats(log_id, log).getStatValues()
+  return (log_id, log[u'info'][u'date'], game_stat_values, player_stat_values)
+
+def extractStatRecordsFromChunk(logs_chunk):
+  return [extractStatRecord(log_id, log) for log_id, log in logs_chunk]
+
+def chunkLogs(logs, chunk_size):
+  logs = iter(logs)
+  chunk = list(itertools.islice(logs, chunk_size))
+  while chunk:
+    yield chunk
+    chunk = list(itertools.islice(logs, chunk_size))
+
+def extractStatRecords(logs, num_workers=None, chunk_size=32, max_pending_chunks_per_worker=2):
+  """
+  Parses every (log id, log or its json text) in {logs} across a pool of {num_workers} processes (one per core by default),
+  yielding the stat records in the same order as {logs}. Falls back to parsing serially if there's only one worker, too few
+  logs to be worth it, or the pool can't be started.
+
+  {logs} is consumed lazily & only a few chunks per worker are in flight at once, so each log can be dropped as soon as
+  its record has been yielded, and memory doesn't grow with the number of logs
+  """
+  num_workers = num_workers if num_workers != None else (os.cpu_count() or 1)
+  chunks = chunkLogs(logs, chunk_size)
+  first_chunks = list(itertools.islice(chunks, 2)) # to tell whether there's more than one chunk
+  chunks = itertools.chain(first_chunks, chunks)
+  if num_workers <= 1 or len(first_chunks) < 2:
+    for chunk in chunks:
+      yield from extractStatRecordsFromChunk(chunk)
+    return
+
+  pending_chunks = collections.deque() # (chunk, future of its records), in submission order
+  try:
+    with concurrent.futures.ProcessPoolExecutor(num_workers) as executor:
+      for chunk in chunks:
+        pending_chunks.append((chunk, executor.submit(extractStatRecordsFromChunk, chunk)))
+        if len(pending_chunks) >= num_workers * max_pending_chunks_per_worker:
+          yield from pending_chunks[0][1].result()
+          pending_chunks.popleft()
+      while len(pending_chunks) > 0:
+        yield from pending_chunks[0][1].result()
+        pending_chunks.popleft()
+  except (OSError, NotImplementedError, concurrent.futures.process.BrokenProcessPool) as e:
+    print(f"\tFailed to parse logs in parallel, falling back to parsing serially: {e}")
+    # parse the chunks that haven't been yielded yet, then the rest
+    for chunk in itertools.chain([chunk for chunk, _ in pending_chunks], chunks):
+      yield from extractStatRecordsFromChunk(chunk)
@@ -0,0 +1,109 @@
+import math
+from array import array
+
+QUANTILE_SKETCH_SIZE = 200
+
+class QuantileSketch:
+  """
+  A KLL sketch of a stream of values, for estimating their quantiles (e.g. the median) in memory that stays about the
+  same however many values are added. Values are kept in levels, where each value in level h stands for 2^h of the added
+  values: whenever the levels are full, the lowest full level is sorted & every other value in it is promoted to the
+  next level up. Sketches of different values can be merged, e.g. to combine the months of a window.
+
+  Until {size} values have been added, every value is kept & quantiles are exact. Compactions alternate between
+  promoting the odd & even values (instead of choosing at random), so the same values added & merged in the same order
+  always give the same quantiles. Each level is a packed array of floats, which takes a quarter of the memory of a list of them
+  """
+  CAPACITY_RATIO = 2 / 3 # how much smaller each level's capacity is than the capacity of the level above it
+
+  def __init__(self, size=QUANTILE_SKETCH_SIZE):
+    self.size = size
+    self.levels = [array('d')]
+    self.num_compactions = [0] # of each level, to alternate which values are promoted
+    self.count = 0
+    # kept up to date so that adding a value doesn't need to go through every level
+    self.num_stored_values = 0
+    self.max_num_stored_values = self.getCapacity(0)
+
+  def getCapacity(self, level):
+    return max(2, math.ceil(self.size * QuantileSketch.CAPACITY_RATIO ** (len(self.levels) - level - 1)))
+
+  def addLevel(self):
+    self.levels.append(array('d'))
+    self.num_compactions.append(0)
+    self.max_num_stored_values = sum(self.getCapacity(level) for level in range(len(self.levels)))
+
+  def add(self, value):
+    self.levels[0].append(value)
+    self.count += 1
+    self.num_stored_values += 1
+    if self.num_stored_values >= self.max_num_stored_values:
+      self.compress()
+
+  def addAll(self, values):
+    """
+    Adds each of {values} in turn, giving the same sketch as adding them one at a time, but extending the lowest level
+    with as many values at once as fit before the next compaction
+    """
+    start = 0
+    while start < len(values):
+      end = start + self.max_num_stored_values - self.num_stored_values
+      self.levels[0].extend(values[start:end])
+      num_added = min(end, len(values)) - start
+      self.count += num_added
+      self.num_stored_values += num_added
+      start += num_added
+      if self.num_stored_values >= self.max_num_stored_values:
+        self.compress()
+
+  def merge(self, other):
+    while len(self.levels) < len(other.levels):
+      self.addLevel()
+    for level, values in enumerate(other.levels):
+      self.levels[level].extend(values)
+    self.count += other.count
+    self.num_stored_values += other.num_stored_values
+    self.compress()
+
+  def compress(self):
+    while self.num_stored_values >= self.max_num_stored_values:
+      level = next(level for level, values in enumerate(self.levels) if len(values) >= self.getCapacity(level))
+      if level + 1 == len(self.levels):
+        self.addLevel()
+
+      values = sorted(self.levels[level])
+      num_kept = len(values) % 2 # with an odd number of values, the smallest one stays behind
+      promoted_values = values[num_kept + self.num_compactions[level] % 2::2]
+      self.levels[level] = array('d', values[:num_kept])
+      self.levels[level + 1].extend(promoted_values)
+      self.num_compactions[level] += 1
+      self.num_stored_values = num_kept + len(promoted_values) + self.num_stored_values - len(values)
+
+  def getQuantile(self, fraction):
+    """
+    Returns the (estimated) smallest added value that at least {fraction} of the added values are at or below, e.g. 0.5
+    for the median, or None if no values have been added
+    """
+    if self.count == 0:
+      return None
+    weighted_values = sorted((value, 2 ** level) for level, values in enumerate(self.levels) for value in values)
+    cumulative_weight = 0
+    for value, weight in weighted_values:
+      cumulative_weight += weight
+      if cumulative_weight >= fraction * self.count:
+        return value
+    return weighted_values[-1][0]
+
+  def toJson(self):
+    return { 'levels': [values.tolist() for values in self.levels], 'compactions': self.num_compactions }
+
+  @staticmethod
+  def fromJson(sketch_json, size=QUANTILE_SKETCH_SIZE):
+    sketch = QuantileSketch(size)
+    for level in range(1, len(sketch_json['levels'])):
+      sketch.addLevel()
+    sketch.levels = [array('d', values) for values in sketch_json['levels']]
+    sketch.num_compactions = sketch_json['compactions']
+    sketch.count = sum(len(values) * 2 ** level for level, values in enumerate(sketch.levels))
+    sketch.num_stored_values = sum(len(values) for values in sketch.levels)
+    return sketch
@@ -0,0 +1,94 @@
+from .aggregated_stats import AggregatedStatsAccumulator
+
+class SlidingWindowAccumulator:
+  """
+  Aggregates a window of buckets that slides forward, e.g. the accumulator of each day in the last 30 days, where new buckets
+  are pushed at the end & old ones evicted from the start.
+
+  Max stats & leaderboards can't be un-merged, so instead of subtracting evicted buckets this keeps two stacks of partial
+  merges: the older buckets with the merge of each one & every bucket after it in the stack, and the newer buckets with
+  the merge of each one & every bucket before it. Sliding by a bucket then only costs a couple of merges (amortized),
+  instead of re-merging every bucket in the window
+  """
+  def __init__(self, tracked_player_steam_ids):
+    self.tracked_player_steam_ids = set(tracked_player_steam_ids)
+    self.older = [] # (bucket key, accumulator, merge of it & every newer bucket in this stack), with the oldest bucket last
+    self.newer = [] # (bucket key, accumulator, merge of it & every older bucket in this stack), with the newest bucket last
+
+  def mergeAccumulators(self, accumulators):
+    merged_accumulator = AggregatedStatsAccumulator(self.tracked_player_steam_ids)
+    for accumulator in accumulators:
+      if accumulator != None:
+        merged_accumulator.merge(accumulator)
+    return merged_accumulator
+
+  def getBucketKeys(self):
+    """
+    Returns the key of every bucket in the window, oldest first
+    """
+    return [bucket_key for bucket_key, _, _ in reversed(self.older)] + [bucket_key for bucket_key, _, _ in self.newer]
+
+  def push(self, bucket_key, accumulator):
+    """
+    Adds a bucket (which is newer than every bucket already in the window) to the end of the window
+    """
+    newer_merge = self.newer[-1][2] if len(self.newer) > 0 else None
+    self.newer.append((bucket_key, accumulator, self.mergeAccumulators([newer_merge, accumulator])))
+
+  def popNewest(self):
+    if len(self.newer) == 0:
+      # the newest bucket is at the bottom of the older stack, so rebuild the newer stack from every bucket
+      buckets = [(bucket_key, accumulator) for bucket_key, accumulator, _ in reversed(self.older)]
+      self.older = []
+      for bucket_key, accumulator in buckets:
+        self.push(bucket_key, accumulator)
+    self.newer.pop()
+
+  def evictOldest(self):
+    if len(self.older) == 0:
+      # move every bucket to the older stack, merging them from newest to oldest
+      older_merge = None
+      for bucket_key, accumulator, _ in reversed(self.newer):
+        older_merge = self.mergeAccumulators([accumulator, older_merge])
+        self.older.append((bucket_key, accumulator, older_merge))
+      self.newer = []
+    self.older.pop()
+
+  def slideTo(self, bucket_accumulators, changed_bucket_keys=()):
+    """
+    Slides the window to cover the buckets in {bucket_accumulators} ({bucket key: accumulator}, where the keys sort in
+    time order), evicting the buckets before them & pushing any new ones. Buckets already in the window are only replaced
+    if they're in {changed_bucket_keys}, which is cheap for the newest bucket (e.g. today getting a new game)
+    """
+    first_bucket_key = min(bucket_accumulators, default=None)
+    while len(self.older) + len(self.newer) > 0 and (first_bucket_key == None or self.getOldestBucketKey() < first_bucket_key):
+      self.evictOldest()
+
+    bucket_keys = self.getBucketKeys()
+    if len(bucket_keys) > 0:
+      # the buckets in the window that changed, were removed, or are new but not newer than the rest of the window
+      stale_bucket_keys = (set(changed_bucket_keys) & set(bucket_keys)) | (set(bucket_keys) ^ set(bucket_key for bucket_key in bucket_accumulators if bucket_key <= bucket_keys[-1]))
+      if stale_bucket_keys == { bucket_keys[-1] }:
+        self.popNewest()
+      elif len(stale_bucket_keys) > 0:
+        # replacing a bucket in the middle of the window means re-merging everything after it, so just start over
+        self.older, self.newer = [], []
+
+    newest_bucket_key = self.getNewestBucketKey()
+    for bucket_key in sorted(bucket_accumulators):
+      if newest_bucket_key == None or bucket_key > newest_bucket_key:
+        self.push(bucket_key, bucket_accumulators[bucket_key])
+
+  def getOldestBucketKey(self):
+    return self.older[-1][0] if len(self.older) > 0 else (self.newer[0][0] if len(self.newer) > 0 else None)
+
+  def getNewestBucketKey(self):
+    return self.newer[-1][0] if len(self.newer) > 0 else (self.older[0][0] if len(self.older) > 0 else None)
+
+  def toAccumulator(self):
+    """
+    Returns the merge of every bucket in the window
+    """
+    older_merge = self.older[-1][2] if len(self.older) > 0 else None
+    newer_merge = self.newer[-1][2] if len(self.newer) > 0 else None
+    return self.mergeAccumulators([older_merge, newer_merge])
@@ -1,10 +1,18 @@
+from collections.abc import Mapping
+
 class StatDefinition:
-  def __init__(self, name, extractor_func):
+  def __init__(self, name, extractor_func, dependencies=[], raw_fields=[], is_intermediate=False):
+    """
+    {extractor_func} is called with the raw stats followed by the value of each stat named in {dependencies}, which can
+    include the game's stats with a "game_" prefix when calculating a player's stats.
+    {raw_fields} are the paths (tuples of keys) of every field in the raw stats that {extractor_func} reads.
+    An {is_intermediate} stat is only calculated to be shared by the stats that depend on it, and is never output
+    """
     self.name = name
     self.extractor_func = extractor_func
-  
-  def calcValue(self, log_id, existing_stats, raw_stats):
-    return StatValue(self, log_id, self.extractor_func(existing_stats, raw_stats))
+    self.dependencies = dependencies
+    self.raw_fields = raw_fields
+    self.is_intermediate = is_intermediate
 
   def __str__(self):
     return self.name
@@ -14,9 +22,74 @@ class StatDefinition:
   
   @staticmethod
   def createExtractorStatDefinition(name, raw_stats_field):
-    return StatDefinition(name, lambda _, raw_stats: raw_stats[raw_stats_field])
+    return StatDefinition(name, lambda raw_stats: raw_stats[raw_stats_field], [], [(raw_stats_field,)])
+
+class CompiledStatExtractor:
+  """
+  Compiles {stat_defs} into a single function that calculates the {output_stat_names} (along with only the stats they
+  depend on, each calculated once) and returns their values as a tuple in the same order as {output_defs}.
+
+  Dependencies on stats with {parent_prefix} are read from the values output by {parent_extractor}, which are passed
+  alongside the raw stats (e.g. the game's stats when calculating a player's stats)
+  """
+  def __init__(self, stat_defs, output_stat_names, parent_extractor=None, parent_prefix=''):
+    stat_defs_by_name = { stat_def.name: stat_def for stat_def in stat_defs }
+    for name in output_stat_names:
+      if name not in stat_defs_by_name or stat_defs_by_name[name].is_intermediate:
+        raise ValueError(f"'{name}' isn't a stat that can be output")
+
+    # order the needed stats so every stat comes after its dependencies
+    ordered_defs = []
+    def addStatDefinition(name, dependents):
+      if name in dependents:
+        raise ValueError(f"Stat '{name}' depends on itself")
+      stat_def = stat_defs_by_name[name]
+      if stat_def in ordered_defs:
+        return
+      for dependency in stat_def.dependencies:
+        if parent_extractor != None and dependency.startswith(parent_prefix):
+          if dependency[len(parent_prefix):] not in parent_extractor.output_indices:
+            raise ValueError(f"Stat '{name}' depends on '{dependency}', which isn't output by the parent extractor")
+        elif dependency not in stat_defs_by_name:
+          raise ValueError(f"Stat '{name}' depends on unknown stat '{dependency}'")
+        else:
+          addStatDefinition(dependency, dependents + [name])
+      ordered_defs.append(stat_def)
+    for stat_def in stat_defs:
+      if stat_def.name in output_stat_names:
+        addStatDefinition(stat_def.name, [])
+
+    self.output_defs = [stat_def for stat_def in stat_defs if stat_def.name in output_stat_names]
+    self.output_indices = createStatIndices(self.output_defs)
+    self.raw_fields = [field for stat_def in ordered_defs for field in stat_def.raw_fields]
+    self.extract = CompiledStatExtractor.compileExtractFunction(ordered_defs, self.output_defs, parent_extractor, parent_prefix)
+
+  @staticmethod
+  def compileExtractFunction(ordered_defs, output_defs, parent_extractor, parent_prefix):
+    # generates e.g.
+    #   def extract(raw_stats, parent_values):
+    #     v0 = extractor_funcs[0](raw_stats)
+    #     v1 = extractor_funcs[1](raw_stats, v0, parent_values[0])
+    #     return (v1,)
+    # so a log's stats are calculated without any lookups by name
+    variable_names = { stat_def.name: 'v%d' % i for i, stat_def in enumerate(ordered_defs) }
+    if parent_extractor != None:
+      for name, index in parent_extractor.output_indices.items():
+        variable_names[parent_prefix + name] = 'parent_values[%d]' % index
+
+    lines = ['def extract(raw_stats, parent_values=None):']
+    for i, stat_def in enumerate(ordered_defs):
+      args = ', '.join(['raw_stats'] + [variable_names[dependency] for dependency in stat_def.dependencies])
+      lines.append(f"  {variable_names[stat_def.name]} = extractor_funcs[{i}]({args})")
+    lines.append('  return (%s)' % ''.join(variable_names[stat_def.name] + ', ' for stat_def in output_defs))
+
+    namespace = { 'extractor_funcs': [stat_def.extractor_func for stat_def in ordered_defs] }
+    exec('\n'.join(lines), namespace)
+    return namespace['extract']
 
 class StatValue:
+  __slots__ = ('stat_def', 'value', 'log_id')
+
   def __init__(self, stat_def, log_id, value):
     self.stat_def = stat_def
     self.value = value
@@ -26,4 +99,66 @@ class StatValue:
     return f"{str(self.stat_def)}: {self.value} (log: {self.log_id})"
   
   def __repr__(self):
-    return str(self)
\ No newline at end of file
+    return str(self)
+
+class StatValuesView(Mapping):
+  """
+  Exposes a sequence of raw stat values (one per stat definition in {stat_defs}) as a lookup of StatValues by stat name.
+  Names starting with {fallback_prefix} are looked up in the {fallback} view instead, without copying its values
+  """
+  __slots__ = ('stat_defs', 'stat_indices', 'values', 'log_id', 'fallback', 'fallback_prefix')
+
+  def __init__(self, stat_defs, stat_indices, values, log_id, fallback=None, fallback_prefix=''):
+    self.stat_defs = stat_defs
+    self.stat_indices = stat_indices
+    self.values = values
+    self.log_id = log_id
+    self.fallback = fallback
+    self.fallback_prefix = fallback_prefix
+
+  def __getitem__(self, name):
+    index = self.stat_indices.get(name)
+    if index != None:
+      return StatValue(self.stat_defs[index], self.log_id, self.values[index])
+    if self.fallback != None and name.startswith(self.fallback_prefix):
+      return self.fallback[name[len(self.fallback_prefix):]]
+    raise KeyError(name)
+
+  def __iter__(self):
+    if self.fallback != None:
+      yield from (self.fallback_prefix + name for name in self.fallback)
+    yield from (stat_def.name for stat_def in self.stat_defs)
+
+  def __len__(self):
+    return len(self.stat_defs) + (len(self.fallback) if self.fallback != None else 0)
+
+def createStatIndices(stat_defs):
+  return { stat_def.name: i for i, stat_def in enumerate(stat_defs) }
+
+def createProjection(field_paths):
+  """
+  Merges field paths (tuples of keys, where '*' matches every key) into a projection for projectJson
+  """
+  projection = {}
+  for path in field_paths:
+    node = projection
+    for key in path[:-1]:
+      if node.get(key) == True:
+        break # the whole parent is already included
+      node = node.setdefault(key, {})
+    else:
+      node[path[-1]] = True
+
+  return projection
+
+def projectJson(json_value, projection):
+  """
+  Returns a copy of {json_value} with only the fields in {projection}. Lists are projected element by element
+  """
+  if projection == True:
+    return json_value
+  if isinstance(json_value, list):
+    return [projectJson(item, projection) for item in json_value]
+  if '*' in projection:
+    return { key: projectJson(value, projection['*']) for key, value in json_value.items() }
+  return { key: projectJson(json_value[key], field_projection) for key, field_projection in projection.items() if key in json_value }
@@ -0,0 +1,254 @@
+import json
+import sqlite3
+from enum import Enum
+
+from consts import GameResult, Team, ClassType
+
+from .game_stats import SingleGameStats, STAT_DEFINITIONS_VERSION
+from .log_tags import LogTags
+
+STAT_VALUE_ENUM_TYPES = { enum_type.__name__: enum_type for enum_type in [GameResult, Team, ClassType] }
+
+def encodeStatValues(stat_values):
+  # enums are stored as [enum type name, enum value] so they can be restored when loaded
+  return json.dumps({ name: [type(value).__name__, value.value] if isinstance(value, Enum) else value for name, value in stat_values.items() })
+
+def decodeStatValues(encoded_stat_values):
+  return { name: STAT_VALUE_ENUM_TYPES[value[0]](value[1]) if isinstance(value, list) else value for name, value in json.loads(encoded_stat_values).items() }
+
+def chunkList(items, chunk_size):
+  return [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+class PlayerHistoryEntry:
+  """
+  A game that a player played, from the per-player index in StatsStore
+  """
+  __slots__ = ['log_id', 'date', 'class_type', 'team', 'game_result', 'stat_values']
+
+  def __init__(self, log_id, date, class_type, team, game_result, stat_values):
+    self.log_id = log_id
+    self.date = date
+    self.class_type = class_type
+    self.team = team
+    self.game_result = game_result
+    self.stat_values = stat_values
+
+def createPlayerHistoryRows(log_id, log_date, player_stat_values):
+  return [
+    (steam_id, log_id, log_date, values['class_type'].value, values['team'].value, values['game_result'].value)
+    for steam_id, values in player_stat_values.items()
+  ]
+
+class StatsStore:
+  """
+  A local SQLite store of the stats extracted from each log, so that a log only ever needs to be parsed once. The games
+  of each player are also indexed by steam id (see loadPlayerHistory), so they can be looked up without reading every log,
+  and each log's LogTags are stored alongside it so that it only needs to be classified again when the config changes.
+
+  All stored stats are dropped whenever the stat definitions change, since they would have been calculated differently.
+  """
+  STAT_DEFINITIONS_VERSION_KEY = 'stat_definitions_version'
+  LOG_TAGS_CONFIG_KEY = 'log_tags_config'
+  MAX_QUERY_PARAMETERS = 900 # older versions of SQLite only allow 999 parameters per query
+
+  def __init__(self, filepath):
+    # a store is only ever used by one thread at a time, but not always the one that opened it (see main.updateGroups)
+    self.connection = sqlite3.connect(filepath, check_same_thread=False)
+    self.connection.executescript('''
+      CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+      CREATE TABLE IF NOT EXISTS games (log_id INTEGER PRIMARY KEY, date INTEGER NOT NULL, stats TEXT NOT NULL);
+      CREATE TABLE IF NOT EXISTS player_games (log_id INTEGER NOT NULL, steam_id TEXT NOT NULL, stats TEXT NOT NULL, PRIMARY KEY (log_id, steam_id));
+      CREATE TABLE IF NOT EXISTS monthly_accumulators (month TEXT PRIMARY KEY, config_key TEXT NOT NULL, log_dates TEXT NOT NULL, accumulator TEXT NOT NULL);
+      CREATE TABLE IF NOT EXISTS window_fingerprints (worksheet_name TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, has_worksheet INTEGER NOT NULL);
+      CREATE TABLE IF NOT EXISTS player_history (
+        steam_id TEXT NOT NULL, log_id INTEGER NOT NULL, date INTEGER NOT NULL, class_type TEXT NOT NULL, team TEXT NOT NULL, game_result TEXT NOT NULL,
+        PRIMARY KEY (steam_id, log_id)
+      ) WITHOUT ROWID;
+      CREATE INDEX IF NOT EXISTS player_history_log_ids ON player_history (log_id);
+      CREATE TABLE IF NOT EXISTS log_tags (
+        log_id INTEGER PRIMARY KEY, format TEXT NOT NULL, is_scrim INTEGER NOT NULL, is_ignored INTEGER NOT NULL, uncounted_steam_ids TEXT NOT NULL
+      );
+    ''')
+
+    stored_version = self.connection.execute('SELECT value FROM metadata WHERE key = ?', (StatsStore.STAT_DEFINITIONS_VERSION_KEY,)).fetchone()
+    if stored_version == None or stored_version[0] != str(STAT_DEFINITIONS_VERSION):
+      self.clear()
+      self.connection.execute('INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)', (StatsStore.STAT_DEFINITIONS_VERSION_KEY, STAT_DEFINITIONS_VERSION))
+      self.connection.commit()
+
+    # index any games that were stored before the per-player index existed
+    if self.connection.execute('SELECT 1 FROM player_history LIMIT 1').fetchone() == None and self.connection.execute('SELECT 1 FROM player_games LIMIT 1').fetchone() != None:
+      self.rebuildPlayerHistory()
+      self.connection.commit()
+
+  def rebuildPlayerHistory(self):
+    self.connection.execute('DELETE FROM player_history')
+    log_dates = self.getStoredLogDates()
+    player_stat_values = {}
+    for log_id, steam_id, stats in self.connection.execute('SELECT log_id, steam_id, stats FROM player_games'):
+      player_stat_values.setdefault(log_id, {})[steam_id] = decodeStatValues(stats)
+    for log_id, values in player_stat_values.items():
+      self.connection.executemany('INSERT INTO player_history VALUES (?, ?, ?, ?, ?, ?)', createPlayerHistoryRows(log_id, log_dates[log_id], values))
+
+  def clear(self):
+    self.connection.execute('DELETE FROM games')
+    self.connection.execute('DELETE FROM player_games')
+    self.connection.execute('DELETE FROM monthly_accumulators')
+    self.connection.execute('DELETE FROM window_fingerprints')
+    self.connection.execute('DELETE FROM player_history')
+    self.connection.execute('DELETE FROM log_tags')
+    self.connection.execute('DELETE FROM metadata WHERE key = ?', (StatsStore.LOG_TAGS_CONFIG_KEY,))
+
+  def getStoredLogDates(self, log_ids=None):
+    """
+    Returns the date (from the log's info) of every stored log (or only those of {log_ids}), keyed by log id
+    """
+    if log_ids == None:
+      return { log_id: date for log_id, date in self.connection.execute('SELECT log_id, date FROM games') }
+
+    log_dates = {}
+    for log_ids_chunk in chunkList(sorted(log_ids), StatsStore.MAX_QUERY_PARAMETERS):
+      placeholders = ', '.join('?' * len(log_ids_chunk))
+      log_dates.update(self.connection.execute(f'SELECT log_id, date FROM games WHERE log_id IN ({placeholders})', log_ids_chunk))
+    return log_dates
+
+  def saveGameStats(self, game_stats, log_date):
+    self.saveStatValues(game_stats.log_id, log_date, *game_stats.getStatValues())
+
+  def saveStatValues(self, log_id, log_date, game_stat_values, player_stat_values):
+    """
+    Stores the values from SingleGameStats.getStatValues (or a record from extractStatRecords) for a log
+    """
+    self.connection.execute('DELETE FROM player_games WHERE log_id = ?', (log_id,))
+    self.connection.execute('DELETE FROM player_history WHERE log_id = ?', (log_id,))
+    self.connection.execute('DELETE FROM log_tags WHERE log_id = ?', (log_id,)) # the new stats need to be tagged again
+    self.connection.execute('INSERT OR REPLACE INTO games (log_id, date, stats) VALUES (?, ?, ?)', (log_id, log_date, encodeStatValues(game_stat_values)))
+    self.connection.executemany(
+      'INSERT INTO player_games (log_id, steam_id, stats) VALUES (?, ?, ?)',
+      [(log_id, steam_id, encodeStatValues(values)) for steam_id, values in player_stat_values.items()]
+    )
+    self.connection.executemany('INSERT INTO player_history VALUES (?, ?, ?, ?, ?, ?)', createPlayerHistoryRows(log_id, log_date, player_stat_values))
+
+  def loadPlayerHistory(self, steam_id, timebound=None, class_type=None):
+    """
+    Returns the PlayerHistoryEntry of every stored game that {steam_id} played (optionally only those in {timebound} or
+    played as {class_type}), newest first. Only that player's rows of the index are read
+    """
+    query = '''
+      SELECT player_history.log_id, player_history.date, class_type, team, game_result, player_games.stats
+      FROM player_history JOIN player_games ON player_games.log_id = player_history.log_id AND player_games.steam_id = player_history.steam_id
+      WHERE player_history.steam_id = ?
+    '''
+    parameters = [steam_id]
+    if timebound != None:
+      query += ' AND player_history.date BETWEEN ? AND ?'
+      parameters += [timebound.start, timebound.end]
+    if class_type != None:
+      query += ' AND class_type = ?'
+      parameters.append(class_type.value)
+
+    return [
+      PlayerHistoryEntry(log_id, date, ClassType(class_type_value), Team(team), GameResult(game_result), decodeStatValues(stats))
+      for log_id, date, class_type_value, team, game_result, stats in self.connection.execute(query + ' ORDER BY player_history.log_id DESC', parameters)
+    ]
+
+  def loadGameStats(self, log_ids):
+    """
+    Rebuilds the SingleGameStats of every requested log that has been stored, keyed by log id (in log id order)
+    """
+    game_stat_values, player_stat_values = {}, {}
+    for log_ids_chunk in chunkList(sorted(log_ids), StatsStore.MAX_QUERY_PARAMETERS):
+      placeholders = ', '.join('?' * len(log_ids_chunk))
+      for log_id, stats in self.connection.execute(f'SELECT log_id, stats FROM games WHERE log_id IN ({placeholders}) ORDER BY log_id', log_ids_chunk):
+        game_stat_values[log_id] = decodeStatValues(stats)
+        player_stat_values[log_id] = {}
+      for log_id, steam_id, stats in self.connection.execute(f'SELECT log_id, steam_id, stats FROM player_games WHERE log_id IN ({placeholders})', log_ids_chunk):
+        player_stat_values[log_id][steam_id] = decodeStatValues(stats)
+
+    return { log_id: SingleGameStats.fromStatValues(log_id, values, player_stat_values[log_id]) for log_id, values in game_stat_values.items() }
+
+  def getLogIdsWithPlayers(self, steam_ids):
+    """
+    Returns the ids of the stored logs that any of {steam_ids} played in, using the per-player index
+    """
+    log_ids = set()
+    for steam_ids_chunk in chunkList(sorted(steam_ids), StatsStore.MAX_QUERY_PARAMETERS):
+      placeholders = ', '.join('?' * len(steam_ids_chunk))
+      log_ids.update(log_id for log_id, in self.connection.execute(f'SELECT log_id FROM player_history WHERE steam_id IN ({placeholders})', steam_ids_chunk))
+    return log_ids
+
+  def getUntaggedLogIds(self):
+    return { log_id for log_id, in self.connection.execute('SELECT log_id FROM games WHERE log_id NOT IN (SELECT log_id FROM log_tags)') }
+
+  def saveLogTags(self, all_log_tags):
+    self.connection.executemany(
+      'INSERT OR REPLACE INTO log_tags (log_id, format, is_scrim, is_ignored, uncounted_steam_ids) VALUES (?, ?, ?, ?, ?)',
+      [(tags.log_id, tags.format, int(tags.is_scrim), int(tags.is_ignored), json.dumps(sorted(tags.uncounted_steam_ids))) for tags in all_log_tags]
+    )
+
+  def loadLogTags(self, log_ids=None):
+    """
+    Returns the LogTags of every stored log that has been tagged (or only those of {log_ids}), keyed by log id
+    """
+    query = 'SELECT log_id, format, is_scrim, is_ignored, uncounted_steam_ids FROM log_tags'
+    if log_ids == None:
+      rows = self.connection.execute(query).fetchall()
+    else:
+      rows = []
+      for log_ids_chunk in chunkList(sorted(log_ids), StatsStore.MAX_QUERY_PARAMETERS):
+        placeholders = ', '.join('?' * len(log_ids_chunk))
+        rows += self.connection.execute(f'{query} WHERE log_id IN ({placeholders})', log_ids_chunk).fetchall()
+
+    return {
+      log_id: LogTags(log_id, format, bool(is_scrim), bool(is_ignored), json.loads(uncounted_steam_ids))
+      for log_id, format, is_scrim, is_ignored, uncounted_steam_ids in rows
+    }
+
+  def loadLogTagsConfig(self):
+    """
+    Returns the json of the LogTagsConfig that the stored tags were made with, or None
+    """
+    row = self.connection.execute('SELECT value FROM metadata WHERE key = ?', (StatsStore.LOG_TAGS_CONFIG_KEY,)).fetchone()
+    return json.loads(row[0]) if row != None else None
+
+  def saveLogTagsConfig(self, config_json):
+    self.connection.execute('INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)', (StatsStore.LOG_TAGS_CONFIG_KEY, json.dumps(config_json)))
+
+  def loadMonthlyAccumulator(self, month):
+    """
+    Returns the (config key, {log id: log revision} of the accumulated logs, accumulator json) stored for {month}, or None
+    """
+    row = self.connection.execute('SELECT config_key, log_dates, accumulator FROM monthly_accumulators WHERE month = ?', (month,)).fetchone()
+    if row == None:
+      return None
+
+    config_key, log_revisions, accumulator_json = row
+    return config_key, { int(log_id): revision for log_id, revision in json.loads(log_revisions).items() }, json.loads(accumulator_json)
+
+  def saveMonthlyAccumulator(self, month, config_key, log_revisions, accumulator_json):
+    self.connection.execute(
+      'INSERT OR REPLACE INTO monthly_accumulators (month, config_key, log_dates, accumulator) VALUES (?, ?, ?, ?)',
+      (month, config_key, json.dumps({ str(log_id): revision for log_id, revision in log_revisions.items() }), json.dumps(accumulator_json))
+    )
+
+  def loadWindowFingerprints(self):
+    """
+    Returns the (fingerprint, whether a worksheet was written) of the stats last calculated for each window, keyed by worksheet name
+    """
+    return {
+      worksheet_name: (fingerprint, bool(has_worksheet))
+      for worksheet_name, fingerprint, has_worksheet in self.connection.execute('SELECT worksheet_name, fingerprint, has_worksheet FROM window_fingerprints')
+    }
+
+  def saveWindowFingerprint(self, worksheet_name, fingerprint, has_worksheet):
+    self.connection.execute(
+      'INSERT OR REPLACE INTO window_fingerprints (worksheet_name, fingerprint, has_worksheet) VALUES (?, ?, ?)',
+      (worksheet_name, fingerprint, int(has_worksheet))
+    )
+
+  def commit(self):
+    self.connection.commit()
+
+  def close(self):
+    self.connection.commit()
+    self.connection.close()
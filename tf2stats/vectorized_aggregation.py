@@ -0,0 +1,176 @@
+import numpy as np
+
+from consts import GameResult, ClassType, SIXES_COMBAT_CLASSES
+
+from .aggregated_stats import MAX_STAT_MAX_WINNERS, AggregatedStats, AggregatedStatsAccumulator, PlayerAggregatedStats, PlayerStatsAccumulator
+from .game_stats import GAME_STAT_INDICES, PLAYER_STAT_INDICES
+
+GAME_RESULTS = list(GameResult)
+CLASS_TYPES = list(ClassType)
+
+PLAYER_GAME_DTYPE = np.dtype([
+  ('player', np.int32), # index into the sorted tracked steam ids
+  ('log_id', np.int64),
+  ('result', np.int8), # index into GAME_RESULTS
+  ('class_type', np.int8), # index into CLASS_TYPES
+  ('is_uncounted', np.bool_), # according to the game's LogTags
+  ('duration', np.float64),
+  ('playtime', np.float64),
+  ('average_dpm', np.float64),
+  ('average_hpm', np.float64),
+  ('average_hrpm', np.float64),
+  ('kills', np.int64),
+  ('airshots', np.int64),
+  ('captures', np.int64),
+])
+
+def createPlayerGamesArray(all_game_stats, steam_id_indices, all_log_tags=None):
+  """
+  Flattens the stats of every tracked player in every game into one structured array row per player-game, in the order
+  that AggregatedStatsAccumulator.add would go through them
+  """
+  duration_index = GAME_STAT_INDICES['duration']
+  stat_indices = [PLAYER_STAT_INDICES[name] for name in ['game_result', 'class_type', 'total_playtime_in_seconds', 'average_dpm', 'average_hpm', 'average_hrpm', 'kills', 'airshots', 'captures']]
+  result_indices = { result: i for i, result in enumerate(GAME_RESULTS) }
+  class_type_indices = { class_type: i for i, class_type in enumerate(CLASS_TYPES) }
+
+  rows = []
+  for game_stats in all_game_stats:
+    duration = game_stats.values[duration_index]
+    uncounted_steam_ids = all_log_tags[game_stats.log_id].uncounted_steam_ids if all_log_tags != None else ()
+    for player in game_stats.player_stats:
+      player_index = steam_id_indices.get(player.steam_id)
+      if player_index == None:
+        continue
+      result, class_type, playtime, dpm, hpm, hrpm, kills, airshots, captures = [player.values[i] for i in stat_indices]
+      rows.append((player_index, player.log_id, result_indices[result], class_type_indices[class_type], player.steam_id in uncounted_steam_ids, duration, playtime, dpm, hpm, hrpm, kills, airshots, captures))
+
+  return np.array(rows, dtype=PLAYER_GAME_DTYPE)
+
+def areCountedPlayerGames(player_games):
+  """
+  Like aggregated_stats.isCountedPlayerGame, for every row of {player_games} at once
+  """
+  subbed_in_late = player_games['playtime'] < 0.5 * player_games['duration']
+  left_early = (player_games['average_dpm'] <= PlayerAggregatedStats.LOW_DPM) & (player_games['average_hpm'] <= PlayerAggregatedStats.LOW_HPM)
+  return ~subbed_in_late & ~left_early
+
+def addTotals(players, values, mask, num_players, current_totals):
+  """
+  Returns each player's total of their {values} where {mask} is set, added on to their {current_totals} in the same order
+  as adding each value in turn (bincount adds up its weights in order), and how many values were added
+  """
+  totals = np.bincount(np.concatenate([np.arange(num_players), players[mask]]), weights=np.concatenate([current_totals, values[mask]]), minlength=num_players)
+  counts = np.bincount(players[mask], minlength=num_players)
+  return totals.tolist(), counts.tolist()
+
+def groupValuesByPlayer(players, values, mask, num_players):
+  """
+  Returns the list of each player's {values} where {mask} is set, in their original order
+  """
+  masked_players, masked_values = players[mask], values[mask]
+  order = np.argsort(masked_players, kind='stable')
+  boundaries = np.searchsorted(masked_players[order], np.arange(num_players + 1))
+  sorted_values = masked_values[order].tolist()
+  return [sorted_values[boundaries[player]:boundaries[player + 1]] for player in range(num_players)]
+
+def addPlayerStats(player_accumulators, player_games, steam_ids, counted):
+  num_players = len(steam_ids)
+  players = player_games['player']
+  is_medic = player_games['class_type'] == CLASS_TYPES.index(ClassType.MEDIC)
+  accumulators = [player_accumulators.get(steam_id) for steam_id in steam_ids]
+  getTotals = lambda attr: [getattr(accumulator, attr) if accumulator != None else 0 for accumulator in accumulators]
+
+  def addToTotals(values, mask, total_attr, count_getter, count_setter, sketch_getter):
+    totals, counts = addTotals(players, values, mask, num_players, getTotals(total_attr))
+    player_values = groupValuesByPlayer(players, values, mask, num_players)
+    for player, accumulator in enumerate(accumulators):
+      if accumulator != None and counts[player] > 0:
+        setattr(accumulator, total_attr, totals[player])
+        count_setter(accumulator, count_getter(accumulator) + counts[player])
+        sketch_getter(accumulator).addAll(player_values[player])
+
+  medic_games, combat_class_games = counted & is_medic, counted & ~is_medic
+  addToTotals(player_games['average_hpm'], medic_games, 'total_hpm', lambda a: a.num_medic_games, lambda a, n: setattr(a, 'num_medic_games', n), lambda a: a.hpm_sketch)
+  addToTotals(player_games['average_dpm'], combat_class_games, 'total_dpm', lambda a: a.num_combat_class_games, lambda a, n: setattr(a, 'num_combat_class_games', n), lambda a: a.dpm_sketch)
+  hrpm_totals, hrpm_counts = addTotals(players, player_games['average_hrpm'], combat_class_games, num_players, getTotals('total_heals_received_per_minute'))
+
+  per_class = []
+  for class_type in SIXES_COMBAT_CLASSES:
+    class_games = counted & (player_games['class_type'] == CLASS_TYPES.index(class_type))
+    current_totals = [accumulator.per_class_total_dpm[class_type] if accumulator != None else 0 for accumulator in accumulators]
+    totals, counts = addTotals(players, player_games['average_dpm'], class_games, num_players, current_totals)
+    per_class.append((class_type, totals, counts, groupValuesByPlayer(players, player_games['average_dpm'], class_games, num_players)))
+
+  result_counts = np.bincount(players[counted] * len(GAME_RESULTS) + player_games['result'][counted], minlength=num_players * len(GAME_RESULTS))
+  result_counts = result_counts.reshape(num_players, len(GAME_RESULTS)).tolist()
+
+  for player, accumulator in enumerate(accumulators):
+    if accumulator == None:
+      continue
+    if hrpm_counts[player] > 0:
+      accumulator.total_heals_received_per_minute = hrpm_totals[player]
+    for class_type, totals, counts, player_values in per_class:
+      if counts[player] > 0:
+        accumulator.per_class_total_dpm[class_type] = totals[player]
+        accumulator.per_class_games[class_type] += counts[player]
+        accumulator.per_class_dpm_sketches[class_type].addAll(player_values[player])
+    for i, result in enumerate(GAME_RESULTS):
+      accumulator.game_result_counts[result] += result_counts[player][i]
+
+def addMaxStat(max_stat_accumulator, player_games, steam_ids):
+  values = player_games[max_stat_accumulator.stat_name]
+  max_value = values.max().item()
+  # only the earliest ties (by log id, then steam id) need to be handed to the accumulator, along with how many there are
+  ties = player_games[values == max_value]
+  earliest_ties = ties[np.lexsort((ties['player'], ties['log_id']))][:MAX_STAT_MAX_WINNERS]
+  max_stat_accumulator.addTies(max_value, [(steam_ids[row['player']], row['log_id'].item()) for row in earliest_ties], len(ties))
+
+def addLeaderboard(leaderboard_accumulator, player_games, steam_ids):
+  # rank like LeaderboardAccumulator (highest value, then earliest log, then highest steam id), then only add the entries
+  # that could make it onto each player's heap (or the single heap, if there's no per-player limit)
+  values = player_games[leaderboard_accumulator.stat_name]
+  players = player_games['player']
+  order = np.lexsort((-players, player_games['log_id'], -values))
+  if leaderboard_accumulator.max_entries_per_player != None:
+    order = order[np.argsort(players[order], kind='stable')]
+    group_starts = np.searchsorted(players[order], players[order])
+  else:
+    group_starts = np.zeros(len(order), dtype=np.int64)
+  candidates = player_games[order[np.arange(len(order)) - group_starts < leaderboard_accumulator.getHeapSize()]]
+  for row in candidates:
+    leaderboard_accumulator.addValue(steam_ids[row['player']], row['log_id'].item(), row[leaderboard_accumulator.stat_name].item())
+
+def addGames(accumulator, all_game_stats, all_log_tags=None):
+  """
+  Adds every tracked player's stats from {all_game_stats} to an AggregatedStatsAccumulator with group-by reductions over a
+  structured array of player-games, instead of per-player Python loops. Gives the same accumulator as calling its add
+  with each game (and its LogTags from {all_log_tags}, if given) in turn, except for the order of its leaderboards' heaps
+  """
+  steam_ids = sorted(accumulator.tracked_player_steam_ids)
+  player_games = createPlayerGamesArray(all_game_stats, { steam_id: i for i, steam_id in enumerate(steam_ids) }, all_log_tags)
+  if len(player_games) == 0:
+    return
+
+  # every tracked player in the games gets an accumulator, in the order they're first seen (like add)
+  players, first_rows = np.unique(player_games['player'], return_index=True)
+  for player in players[np.argsort(first_rows)].tolist():
+    if steam_ids[player] not in accumulator.player_accumulators:
+      accumulator.player_accumulators[steam_ids[player]] = PlayerStatsAccumulator(steam_ids[player])
+
+  counted = ~player_games['is_uncounted'] if all_log_tags != None else areCountedPlayerGames(player_games)
+  addPlayerStats(accumulator.player_accumulators, player_games, steam_ids, counted)
+  for max_stat_accumulator in accumulator.max_stat_accumulators:
+    addMaxStat(max_stat_accumulator, player_games, steam_ids)
+  for leaderboard_accumulator in accumulator.leaderboard_accumulators:
+    addLeaderboard(leaderboard_accumulator, player_games, steam_ids)
+
+class VectorizedAggregatedStats(AggregatedStats):
+  """
+  Calculates the same stats as AggregatedStats, by adding every game to an accumulator with addGames
+  """
+  def __init__(self, all_game_stats, tracked_player_steam_ids):
+    accumulator = AggregatedStatsAccumulator(tracked_player_steam_ids)
+    addGames(accumulator, all_game_stats)
+    aggregated_stats = AggregatedStats.fromAccumulator(accumulator)
+    self.stats, self.leaderboards, self.player_stats = aggregated_stats.stats, aggregated_stats.leaderboards, aggregated_stats.player_stats